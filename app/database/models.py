@@ -2,13 +2,17 @@ import uuid
 
 from enum import StrEnum
 
-from sqlalchemy import String, Date, Boolean, Text, ForeignKey, DateTime, func, Enum, Integer
+from sqlalchemy import (String, Date, Boolean, Text, ForeignKey, DateTime, func, Enum, Integer, BigInteger, Sequence, Index,
+                        LargeBinary, JSON)
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID
 
 
 Base = declarative_base()
 
+# orders every recipe write and delete, drives delta sync
+recipe_change_seq = Sequence("recipe_change_seq", metadata=Base.metadata)
+
 
 class Role(StrEnum):
     admin = "admin"
@@ -23,7 +27,6 @@ class User(Base):
     username: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
     email: Mapped[str] = mapped_column(String(150), nullable=False, unique=True)
     hashed_password: Mapped[str] = mapped_column(String(225), nullable=True)
-    refresh_token: Mapped[str] = mapped_column(String(255), nullable=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
     updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
     first_name: Mapped[str] = mapped_column(String(50), nullable=True)
@@ -34,6 +37,8 @@ class User(Base):
     is_verified: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     about: Mapped[str] = mapped_column(Text, nullable=True)
+    # access tokens carry the epoch they were issued in, bumping it revokes them all
+    token_epoch: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
 
     recipes = relationship("Recipe", back_populates="author")
 
@@ -46,6 +51,14 @@ class Recipe(Base):
     description: Mapped[str] = mapped_column(Text, nullable=True)
     image_url: Mapped[str] = mapped_column(String(255), nullable=True)
     user_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default="1", nullable=False)
+    change_seq: Mapped[int] = mapped_column(
+        BigInteger, recipe_change_seq, server_default=recipe_change_seq.next_value(), nullable=False
+    )
+
+    __table_args__ = (Index("ix_recipes_user_id_change_seq", "user_id", "change_seq"),)
+    # UPDATE and DELETE check the loaded version (StaleDataError otherwise), RecipeRepository.touch increments it
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
     author = relationship("User", back_populates="recipes")
     ingredients = relationship(
@@ -56,6 +69,19 @@ class Recipe(Base):
     )
 
 
+class RecipeTombstone(Base):
+    __tablename__ = "recipe_tombstones"
+
+    recipe_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    change_seq: Mapped[int] = mapped_column(
+        BigInteger, recipe_change_seq, server_default=recipe_change_seq.next_value(), nullable=False
+    )
+    deleted_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
+
+    __table_args__ = (Index("ix_recipe_tombstones_user_id_change_seq", "user_id", "change_seq"),)
+
+
 class Ingredient(Base):
     __tablename__ = "ingredients"
 
@@ -83,3 +109,36 @@ class RecipeIngredient(Base):
     @property
     def name(self) -> str:
         return self.ingredient.name
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    # null until the request has completed
+    status_code: Mapped[int] = mapped_column(Integer, nullable=True)
+    response_headers: Mapped[dict] = mapped_column(JSON, nullable=True)
+    response_body: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
+    locked_until: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+class RefreshToken(Base):
+    """
+    One row per issued refresh token, only its SHA-256 is stored. A login starts a family,
+    one per device, and every refresh replaces the family's token with a new one. Used tokens
+    are kept until they expire, so that presenting one again revokes its family.
+    """
+    __tablename__ = "refresh_tokens"
+
+    token_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    family_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False, index=True)
+    device: Mapped[str] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
+    # set once the token was exchanged for the next one
+    used_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False, index=True)
@@ -1,21 +1,79 @@
 from config import Config
+import asyncio
 import contextlib
+import functools
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Optional, Type
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from utils.prometheus_logging import DB_POOL_ACQUIRE_TIME
+
+
+class PoolWaitTracker:
+    """
+    Exponentially decaying average of the time spent acquiring a pooled connection.
+    The average decays with time as well, so an idle period after a spike does not keep it high.
+    """
+
+    def __init__(self, half_life: float = 5.0):
+        self._decay = math.log(2) / half_life
+        self._value = 0.0
+        self._updated = time.monotonic()
+
+    def current(self) -> float:
+        return self._value * math.exp(-self._decay * (time.monotonic() - self._updated))
+
+    def observe(self, wait: float) -> None:
+        now = time.monotonic()
+        weight = math.exp(-self._decay * (now - self._updated))
+        self._value = self._value * weight + wait * (1 - weight) if self._value else wait
+        self._updated = now
+
+
+def timed_pool(observe: Callable[[float], None]) -> Type[AsyncAdaptedQueuePool]:
+    """
+    Pool class reporting how long every checkout took, waiting for a free connection included.
+    A class rather than an event listener, the pool keeps it when the engine recreates the pool.
+    """
+
+    class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+        def connect(self):
+            before_time = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                # a checkout that timed out waited the longest
+                observe(time.perf_counter() - before_time)
+
+    return TimedAsyncAdaptedQueuePool
 
 
 class DatabaseSessionManager:
     def __init__(self, url: str):
-        self._engine: AsyncEngine | None = create_async_engine(url)
+        self.pool_wait = PoolWaitTracker()
+        self._engine: AsyncEngine | None = create_async_engine(url, poolclass=timed_pool(self.observe_pool_wait))
         self._session_maker = sessionmaker(bind=self._engine, expire_on_commit=False, class_=AsyncSession)
 
+    def observe_pool_wait(self, wait: float) -> None:
+        self.pool_wait.observe(wait)
+        DB_POOL_ACQUIRE_TIME.observe(wait)
+
+    @property
+    def url(self) -> str:
+        return self._engine.url.render_as_string(hide_password=False)
+
     @contextlib.asynccontextmanager
     async def session(self):
         if self._session_maker is None:
             raise Exception("Session is not initialized")
         async with self._session_maker() as session:
             try:
+                # the connection is checked out on the first query, requests without one never hold it
                 yield session
             except Exception as err:
                 print(err)
@@ -25,6 +83,42 @@ class DatabaseSessionManager:
                 await session.close()
 
 
+class SerializedSession:
+    """
+    Lets concurrently running sub-requests of /batch share one AsyncSession.
+    AsyncSession does not support concurrent operations, so its database calls take turns on a lock;
+    everything else is delegated as is. Results of `stream()` outlive the lock, it is refused:
+    streaming routes read through `detached_session`, which opens a session of its own.
+    """
+
+    _serialized = frozenset({
+        "execute", "scalar", "scalars", "get", "flush", "commit", "rollback", "refresh", "delete", "merge",
+        "connection", "run_sync",
+    })
+
+    def __init__(self, session: AsyncSession):
+        self._session = session
+        self._lock = asyncio.Lock()
+
+    def __getattr__(self, name: str):
+        if name in ("stream", "stream_scalars"):
+            raise AttributeError(f"{name}() cannot be serialized, use detached_session")
+        attr = getattr(self._session, name)
+        if name not in self._serialized:
+            return attr
+
+        @functools.wraps(attr)
+        async def serialized(*args, **kwargs):
+            async with self._lock:
+                return await attr(*args, **kwargs)
+
+        return serialized
+
+
+# set by /batch for the duration of its sub-requests
+shared_session: ContextVar[Optional[SerializedSession]] = ContextVar("shared_session", default=None)
+
+
 if Config.DEBUG:
     sessionmanager = DatabaseSessionManager(Config.LOCAL_DATABASE_URL)
 else:
@@ -32,5 +126,29 @@ else:
 
 
 async def get_db():
+    session = shared_session.get()
+    if session is not None:
+        # owned and closed by the batch request
+        yield session
+        return
     async with sessionmanager.session() as session:
         yield session
+
+
+@contextlib.asynccontextmanager
+async def detached_session(app: Any) -> AsyncIterator[AsyncSession]:
+    """
+    Session for work that outlives the route handler, like the body of a StreamingResponse:
+    the session of `get_db` is closed once the handler returns, before the body is sent.
+    Honors the app's override of `get_db`, but never shares the session of a /batch request.
+    """
+    sessions = app.dependency_overrides.get(get_db, get_db)()
+    token = shared_session.set(None)
+    try:
+        session = await sessions.__anext__()
+    finally:
+        shared_session.reset(token)
+    try:
+        yield session
+    finally:
+        await sessions.aclose()
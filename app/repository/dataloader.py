@@ -0,0 +1,117 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Set, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from utils.prometheus_logging import DATALOADER_BATCH_SIZE
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchFunction = Callable[[List[K]], Awaitable[Dict[K, V]]]
+
+
+class DataLoader(Generic[K, V]):
+    """
+    Coalesces lookups issued within the same event loop tick into one call of `batch_fn`
+    and memoizes the results until the session writes.
+
+    `batch_fn` receives the distinct keys and returns the found values by key, missing keys load as None.
+    Batches run one at a time under `lock`, loaders of the same session must share it since
+    a session cannot run concurrent queries.
+    """
+
+    def __init__(self, name: str, batch_fn: BatchFunction, max_batch_size: int = 500,
+                 lock: Optional[asyncio.Lock] = None):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._lock = lock or asyncio.Lock()
+        self._futures: Dict[K, asyncio.Future] = {}
+        self._queue: List[K] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                # let the other lookups of this tick join the batch
+                loop.call_soon(self._dispatch)
+        return await asyncio.shield(future)
+
+    def clear(self) -> None:
+        """Forgets loaded values, lookups still in flight are kept."""
+        self._futures = {key: future for key, future in self._futures.items() if not future.done()}
+
+    def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        futures = [self._futures[key] for key in keys]
+        task = asyncio.ensure_future(self._run_batches(keys, futures))
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._finish(task, keys, futures))
+
+    async def _run_batches(self, keys: List[K], futures: List[asyncio.Future]) -> None:
+        async with self._lock:
+            for start in range(0, len(keys), self.max_batch_size):
+                end = start + self.max_batch_size
+                await self._run(keys[start:end], futures[start:end])
+
+    def _finish(self, task: asyncio.Task, keys: List[K], futures: List[asyncio.Future]) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            # possibly before it even started, lookups not loaded yet are cancelled and forgotten
+            self._forget(keys, futures)
+            for future in futures:
+                future.cancel()
+
+    async def _run(self, keys: List[K], futures: List[asyncio.Future]) -> None:
+        DATALOADER_BATCH_SIZE.labels(loader=self.name).observe(len(keys))
+        try:
+            values = await self.batch_fn(keys)
+        except Exception as e:
+            self._forget(keys, futures)
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    # nobody may be waiting anymore
+                    future.exception()
+            return
+        for key, future in zip(keys, futures):
+            if not future.done():
+                future.set_result(values.get(key))
+
+    def _forget(self, keys: List[K], futures: List[asyncio.Future]) -> None:
+        # failures are not memoized, the next lookup retries
+        for key, future in zip(keys, futures):
+            if self._futures.get(key) is future and not future.done():
+                del self._futures[key]
+
+
+def get_loader(session: AsyncSession, name: str, batch_fn: BatchFunction) -> DataLoader:
+    """
+    Returns the loader `name` of the session, creating it with `batch_fn` on first use.
+    Sessions live for one request, and so do their loaders.
+    """
+    loaders: Dict[str, DataLoader] = session.info.setdefault("dataloaders", {})
+    loader = loaders.get(name)
+    if loader is None:
+        lock = session.info.get("dataloader_lock")
+        if lock is None:
+            lock = session.info["dataloader_lock"] = asyncio.Lock()
+        loader = loaders[name] = DataLoader(name, batch_fn, lock=lock)
+    return loader
+
+
+@event.listens_for(Session, "after_flush")
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _clear_loaders(session: Session, *args) -> None:
+    # memoized rows may be stale once the session has written
+    for loader in session.info.get("dataloaders", {}).values():
+        loader.clear()
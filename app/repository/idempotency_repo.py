@@ -0,0 +1,112 @@
+import datetime
+import uuid
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.database.models import IdempotencyKey
+from app.repository.user_repo import BaseRepository
+from config import Config
+
+
+class IdempotencyRepository(BaseRepository):
+    """
+    Records of requests sent with an Idempotency-Key. Every call commits, so a claim is visible
+    to the other workers before the request runs, whatever happens to the request's own transaction.
+    """
+
+    async def claim(self, user_id: uuid.UUID, key: str, fingerprint: str) -> Optional[IdempotencyKey]:
+        """
+        Takes the key for a new execution. A key can be taken again once its record has expired,
+        or when its request has not completed within IDEMPOTENCY_LOCK_SECONDS, e.g. after a crash.
+
+        :param user_id: caller the key belongs to
+        :param key: Idempotency-Key header
+        :param fingerprint: digest of the request the key is used for
+        :return: None when claimed, otherwise the record holding the key
+        """
+        lock = datetime.timedelta(seconds=Config.IDEMPOTENCY_LOCK_SECONDS)
+        ttl = datetime.timedelta(seconds=Config.IDEMPOTENCY_TTL_SECONDS)
+        try:
+            while True:
+                stmt = pg_insert(IdempotencyKey).values(
+                    user_id=user_id, key=key, fingerprint=fingerprint,
+                    locked_until=func.now() + lock, expires_at=func.now() + ttl,
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+                    set_={
+                        "fingerprint": stmt.excluded.fingerprint,
+                        "status_code": None,
+                        "response_headers": None,
+                        "response_body": None,
+                        "created_at": func.now(),
+                        "locked_until": stmt.excluded.locked_until,
+                        "expires_at": stmt.excluded.expires_at,
+                    },
+                    where=or_(
+                        IdempotencyKey.expires_at < func.now(),
+                        IdempotencyKey.status_code.is_(None) & (IdempotencyKey.locked_until < func.now()),
+                    ),
+                ).returning(IdempotencyKey.key)
+                claimed = (await self.session.execute(stmt)).scalar_one_or_none()
+                await self.session.commit()
+                if claimed is not None:
+                    return None
+
+                record = (await self.session.execute(
+                    select(IdempotencyKey)
+                    .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                    .execution_options(populate_existing=True)
+                )).scalar_one_or_none()
+                await self.session.commit()
+                if record is not None:
+                    return record
+                # released in between, try again
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def complete(
+            self,
+            user_id: uuid.UUID,
+            key: str,
+            status_code: int,
+            headers: Dict[str, str],
+            body: bytes
+    ) -> None:
+        """Stores the response to replay for the claimed key."""
+        try:
+            await self.session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                .values(status_code=status_code, response_headers=headers, response_body=body)
+            )
+            await self.session.commit()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def release(self, user_id: uuid.UUID, key: str) -> None:
+        """Gives the key up after a failed execution, so that a retry runs the request again."""
+        try:
+            # the request's transaction may have failed
+            await self.session.rollback()
+            await self.session.execute(
+                delete(IdempotencyKey)
+                .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+                       IdempotencyKey.status_code.is_(None))
+            )
+            await self.session.commit()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def purge_expired(self) -> int:
+        """
+        :return: number of expired records deleted
+        """
+        try:
+            result = await self.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < func.now()))
+            await self.session.commit()
+            return result.rowcount
+        except Exception as e:
+            await self.handle_exception(e)
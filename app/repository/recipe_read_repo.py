@@ -0,0 +1,188 @@
+from typing import AsyncIterator, Collection, Dict, Optional, Sequence, Tuple
+import uuid
+
+from sqlalchemy import Select, any_, bindparam, func, literal_column, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, UUID, aggregate_order_by
+
+from app.database.models import Recipe, Ingredient, RecipeIngredient, RecipeTombstone, User
+from app.repository.user_repo import BaseRepository
+from config import Config
+
+
+# scalar columns by response field name
+RECIPE_COLUMNS = {
+    "recipe_id": Recipe.recipe_id,
+    "title": Recipe.title,
+    "description": Recipe.description,
+    "image_url": Recipe.image_url,
+    "user_id": Recipe.user_id,
+    "version": Recipe.version,
+}
+
+
+class RecipeRow:
+    """
+    Read-only recipe as it is serialized, with ingredients as plain dicts.
+    Only the selected fields are set.
+    """
+
+    __slots__ = ("recipe_id", "title", "description", "image_url", "user_id", "version", "ingredients", "change_seq")
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+class RecipeReadRepository(BaseRepository):
+    """
+    Query layer for hot reads.
+    Selects only the serialized columns and aggregates ingredients in SQL, so rows never enter
+    the identity map and a recipe with its ingredients costs one small object instead of a graph.
+    Never use the rows for writes.
+    """
+
+    @staticmethod
+    def recipes_query(fields: Optional[Collection[str]] = None) -> Select:
+        """
+        :param fields: response fields to select, all by default. Ingredients are joined and aggregated
+            only when requested, recipe_id is always selected.
+        """
+        columns = [column for name, column in RECIPE_COLUMNS.items()
+                   if fields is None or name in fields or name == "recipe_id"]
+        stmt = select(*columns)
+        if fields is not None and "ingredients" not in fields:
+            return stmt
+
+        ingredients = func.coalesce(
+            func.json_agg(
+                aggregate_order_by(
+                    func.json_build_object("name", Ingredient.name, "quantity", RecipeIngredient.quantity),
+                    Ingredient.ingredient_id,
+                )
+            ).filter(RecipeIngredient.ingredient_id.is_not(None)),
+            literal_column("'[]'::json"),
+            type_=JSON,
+        )
+        return (stmt.add_columns(ingredients.label("ingredients"))
+                .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.recipe_id)
+                .outerjoin(Ingredient, Ingredient.ingredient_id == RecipeIngredient.ingredient_id)
+                .group_by(Recipe.recipe_id))
+
+    async def fetch_user_recipes(
+            self,
+            user_id: uuid.UUID,
+            fields: Optional[Collection[str]] = None
+    ) -> Sequence[RecipeRow]:
+        """
+        :param user_id: owner of the recipes
+        :param fields: response fields to load, all by default
+        :return: the user's recipes with ingredients aggregated in the same query
+        """
+        try:
+            rows = await self.session.execute(self.recipes_query(fields).where(Recipe.user_id == user_id))
+            return [RecipeRow(**row._mapping) for row in rows]
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def fetch_visible_recipes(
+            self,
+            recipe_ids: Collection[uuid.UUID],
+            viewer_id: uuid.UUID,
+            include_inactive_authors: bool = False,
+            fields: Optional[Collection[str]] = None
+    ) -> Dict[uuid.UUID, RecipeRow]:
+        """
+        Loads many recipes at once with a single `recipe_id = ANY(:ids)` query.
+        Recipes of deactivated authors are visible to their owner only, unless `include_inactive_authors`.
+
+        :param recipe_ids: ids to look up, bound as one array parameter
+        :param viewer_id: user the recipes are fetched for
+        :param include_inactive_authors: show recipes of deactivated authors as well, for staff
+        :param fields: response fields to load, all by default
+        :return: visible recipes by id, missing and hidden ones are absent
+        """
+        try:
+            ids = bindparam("recipe_ids", list(recipe_ids), type_=ARRAY(UUID(as_uuid=True)))
+            stmt = self.recipes_query(fields).where(Recipe.recipe_id == any_(ids))
+            if not include_inactive_authors:
+                stmt = (stmt.join(User, User.user_id == Recipe.user_id)
+                        .where(or_(User.is_active == True, Recipe.user_id == viewer_id)))
+            rows = await self.session.execute(stmt)
+            return {row.recipe_id: RecipeRow(**row._mapping) for row in rows}
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def fetch_user_changes(self, user_id: uuid.UUID, since: int, limit: int) -> Sequence[RecipeRow]:
+        """
+        Recipes of the user created or updated after a change sequence value, oldest change first.
+        Served by the (user_id, change_seq) index, so the cost follows the number of changes.
+
+        :param user_id: owner of the recipes
+        :param since: last change sequence value the client has seen
+        :param limit: maximum number of recipes to return
+        :return: full recipes with their `change_seq`
+        """
+        try:
+            stmt = (self.recipes_query().add_columns(Recipe.change_seq)
+                    .where(Recipe.user_id == user_id, Recipe.change_seq > since)
+                    .order_by(Recipe.change_seq)
+                    .limit(limit))
+            rows = await self.session.execute(stmt)
+            return [RecipeRow(**row._mapping) for row in rows]
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def fetch_user_tombstones(
+            self,
+            user_id: uuid.UUID,
+            since: int,
+            limit: int
+    ) -> Sequence[Tuple[uuid.UUID, int]]:
+        """
+        :param user_id: owner of the deleted recipes
+        :param since: last change sequence value the client has seen
+        :param limit: maximum number of deletions to return
+        :return: (recipe_id, change_seq) of recipes deleted after `since`, oldest first
+        """
+        try:
+            stmt = (select(RecipeTombstone.recipe_id, RecipeTombstone.change_seq)
+                    .where(RecipeTombstone.user_id == user_id, RecipeTombstone.change_seq > since)
+                    .order_by(RecipeTombstone.change_seq)
+                    .limit(limit))
+            rows = await self.session.execute(stmt)
+            return rows.all()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def stream_user_recipes(self, user_id: uuid.UUID) -> AsyncIterator[RecipeRow]:
+        """
+        Iterates over all the user's recipes through a server-side cursor,
+        holding only RECIPE_EXPORT_FETCH_SIZE rows at a time.
+
+        :param user_id: owner of the recipes
+        """
+        stmt = (self.recipes_query().where(Recipe.user_id == user_id).order_by(Recipe.recipe_id)
+                .execution_options(yield_per=Config.RECIPE_EXPORT_FETCH_SIZE))
+        try:
+            rows = await self.session.stream(stmt)
+        except Exception as e:
+            await self.handle_exception(e)
+        async for row in rows:
+            yield RecipeRow(**row._mapping)
+
+    async def stream_user_images(self, user_id: uuid.UUID) -> AsyncIterator[Tuple[uuid.UUID, str]]:
+        """
+        Iterates over (recipe_id, image_url) of the user's recipes having an image, through a server-side cursor.
+
+        :param user_id: owner of the recipes
+        """
+        stmt = (select(Recipe.recipe_id, Recipe.image_url)
+                .where(Recipe.user_id == user_id, Recipe.image_url.is_not(None))
+                .order_by(Recipe.recipe_id)
+                .execution_options(yield_per=Config.RECIPE_EXPORT_FETCH_SIZE))
+        try:
+            rows = await self.session.stream(stmt)
+        except Exception as e:
+            await self.handle_exception(e)
+        async for recipe_id, image_url in rows:
+            yield recipe_id, image_url
@@ -1,19 +1,75 @@
-from typing import List, Sequence, Dict, Optional
+from typing import Collection, List, Sequence, Dict, Optional, Tuple
 import uuid
 
-from sqlalchemy import select, update
-from sqlalchemy.orm import selectinload
+from sqlalchemy import Column, MetaData, Table, Text, func, literal, select, update
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.orm import selectinload, load_only, noload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import CreateTable
 
-from app.database.models import Recipe, Ingredient, RecipeIngredient
+from app.database.models import Recipe, Ingredient, RecipeIngredient, RecipeTombstone, recipe_change_seq
+from app.repository.recipe_read_repo import RECIPE_COLUMNS
 from app.repository.user_repo import BaseRepository
 from app.schemas.requests.recipe_schema_req import RecipeCreate
 from app.schemas.responses.recipe_schema_resp import IngredientSchema
+from app.services.invalidation_bus import user_recipes_tag
+
+# staging tables of bulk imports, dropped with the transaction
+_staging = MetaData()
+recipe_import_recipes = Table(
+    "recipe_import_recipes", _staging,
+    Column("recipe_id", UUID(as_uuid=True)),
+    Column("title", Text),
+    Column("description", Text),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+recipe_import_ingredients = Table(
+    "recipe_import_ingredients", _staging,
+    Column("recipe_id", UUID(as_uuid=True)),
+    Column("name", Text),
+    Column("quantity", Text),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
 
 
 class RecipeRepository(BaseRepository):
 
+    @staticmethod
+    def load_options(fields: Optional[Collection[str]] = None) -> list:
+        """
+        Loader options for the requested response fields.
+        Without fields, the full recipe is loaded along with its ingredients and author;
+        otherwise only the requested columns, and ingredients only when asked for.
+
+        :param fields: response fields to load, all by default
+        """
+        if fields is None:
+            return [selectinload(Recipe.ingredients).selectinload(RecipeIngredient.ingredient),
+                    selectinload(Recipe.author)]
+        columns = [column for name, column in RECIPE_COLUMNS.items() if name in fields or name == "recipe_id"]
+        options = [load_only(*columns), noload(Recipe.author)]
+        if "ingredients" in fields:
+            options.append(selectinload(Recipe.ingredients).selectinload(RecipeIngredient.ingredient))
+        else:
+            options.append(noload(Recipe.ingredients))
+        return options
+
+    async def lock_changes(self, user_id: uuid.UUID) -> None:
+        """
+        Serializes the writes to a user's recipes until the end of the transaction.
+        Change sequence values are taken under this lock, so they commit in order
+        and a sync token never skips a change that commits later with a lower value.
+
+        :param user_id: owner of the recipes being written
+        """
+        key = int.from_bytes(uuid.UUID(str(user_id)).bytes[:8], "big", signed=True)
+        await self.session.execute(select(func.pg_advisory_xact_lock(key)))
+
     async def create_recipe(self, user_id: uuid.UUID, body: RecipeCreate) -> Recipe:
         try:
+            await self.lock_changes(user_id)
             db_recipe = Recipe(
                 title=body.title,
                 description=body.description,
@@ -22,6 +78,7 @@ class RecipeRepository(BaseRepository):
 
             self.session.add(db_recipe)
             await self.session.flush()
+            self.invalidate(user_recipes_tag(user_id))
             return await self.get_recipe_by_id(db_recipe.recipe_id)
         except Exception as e:
             await self.handle_exception(e)
@@ -31,6 +88,7 @@ class RecipeRepository(BaseRepository):
             recipe: Recipe,
             ingredients_data: List[IngredientSchema]
     ) -> None:
+        self.invalidate(user_recipes_tag(recipe.user_id))
         for ing in ingredients_data:
             q = await self.session.execute(
                 select(Ingredient).where(Ingredient.name == ing.name)
@@ -44,25 +102,90 @@ class RecipeRepository(BaseRepository):
                 RecipeIngredient(ingredient=ingr_obj, quantity=ing.quantity)
             )
 
-    async def get_recipe_by_id(self, recipe_id: uuid.UUID) -> Optional[Recipe]:
+    async def copy_recipes(self, user_id: uuid.UUID, recipes: Sequence[RecipeCreate]) -> int:
+        """
+        Bulk-inserts validated recipes: rows are streamed with COPY into temporary staging tables,
+        then merged with three set-based statements, whatever the number of recipes and ingredients.
+        The rows must fit the columns and have distinct ingredient names, the transaction is left open.
+
+        :param user_id: owner of the recipes
+        :param recipes: recipes to insert
+        :return: number of inserted recipes
+        """
+        try:
+            await self.lock_changes(user_id)
+            for table in (recipe_import_recipes, recipe_import_ingredients):
+                await self.session.execute(CreateTable(table))
+
+            recipe_rows, ingredient_rows = [], []
+            for recipe in recipes:
+                recipe_id = uuid.uuid4()
+                recipe_rows.append((recipe_id, recipe.title, recipe.description))
+                ingredient_rows += [(recipe_id, ing.name, ing.quantity) for ing in recipe.ingredients]
+
+            connection = await (await self.session.connection()).get_raw_connection()
+            for table, rows in ((recipe_import_recipes, recipe_rows), (recipe_import_ingredients, ingredient_rows)):
+                await connection.driver_connection.copy_records_to_table(
+                    table.name, records=rows, columns=[column.name for column in table.columns]
+                )
+
+            # names in a stable order, so that concurrent imports lock them in the same order
+            await self.session.execute(
+                pg_insert(Ingredient)
+                .from_select(["name"], select(recipe_import_ingredients.c.name).distinct()
+                             .order_by(recipe_import_ingredients.c.name))
+                .on_conflict_do_nothing(index_elements=[Ingredient.name])
+            )
+            await self.session.execute(
+                Recipe.__table__.insert().from_select(
+                    ["recipe_id", "title", "description", "user_id"],
+                    select(recipe_import_recipes.c.recipe_id, recipe_import_recipes.c.title,
+                           recipe_import_recipes.c.description, literal(user_id, UUID(as_uuid=True)))
+                )
+            )
+            await self.session.execute(
+                RecipeIngredient.__table__.insert().from_select(
+                    ["recipe_id", "ingredient_id", "quantity"],
+                    select(recipe_import_ingredients.c.recipe_id, Ingredient.ingredient_id,
+                           recipe_import_ingredients.c.quantity)
+                    .join(Ingredient, Ingredient.name == recipe_import_ingredients.c.name)
+                )
+            )
+            self.invalidate(user_recipes_tag(user_id))
+            return len(recipe_rows)
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def get_recipe_by_id(
+            self,
+            recipe_id: uuid.UUID,
+            fields: Optional[Collection[str]] = None
+    ) -> Optional[Recipe]:
+        if fields is None:
+            # full recipes are batched and memoized for the request
+            return await self.loader("recipe_by_id", self._load_recipes_by_id).load(uuid.UUID(str(recipe_id)))
         try:
-            stmt = (select(Recipe).options(
-                selectinload(Recipe.ingredients).selectinload(RecipeIngredient.ingredient),
-                selectinload(Recipe.author)
-            ).where(Recipe.recipe_id == recipe_id)
-                    )
+            stmt = select(Recipe).options(*self.load_options(fields)).where(Recipe.recipe_id == recipe_id)
             recipe = await self.session.execute(stmt)
             return recipe.scalar_one_or_none()
         except Exception as e:
             await self.handle_exception(e)
 
-    async def fetch_all_user_recipes(self, user_id: uuid.UUID) -> Sequence[Recipe]:
+    async def _load_recipes_by_id(self, recipe_ids: List[uuid.UUID]) -> Dict[uuid.UUID, Recipe]:
         try:
-            stmt = (select(Recipe).
-                    options(selectinload(Recipe.ingredients).selectinload(RecipeIngredient.ingredient),
-                            selectinload(Recipe.author)).
-                    where(Recipe.user_id == user_id)
-                    )
+            stmt = select(Recipe).options(*self.load_options()).where(Recipe.recipe_id.in_(recipe_ids))
+            recipes = await self.session.execute(stmt)
+            return {recipe.recipe_id: recipe for recipe in recipes.scalars()}
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def fetch_all_user_recipes(
+            self,
+            user_id: uuid.UUID,
+            fields: Optional[Collection[str]] = None
+    ) -> Sequence[Recipe]:
+        try:
+            stmt = select(Recipe).options(*self.load_options(fields)).where(Recipe.user_id == user_id)
 
             recipes = await self.session.execute(stmt)
             return recipes.scalars().all()
@@ -70,11 +193,58 @@ class RecipeRepository(BaseRepository):
         except Exception as e:
             await self.handle_exception(e)
 
+    def touch(self, recipe: Recipe) -> None:
+        """
+        Marks the recipe as changed: bumps its version and change sequence and invalidates cached reads of it.
+        Ingredient changes do not touch the recipe row, so every write has to call this explicitly,
+        after `lock_changes` and before modifying anything, so that the row is never locked first.
+
+        :param recipe: recipe being modified in the current transaction
+        """
+        recipe.version += 1
+        recipe.change_seq = recipe_change_seq.next_value()
+        self.invalidate(user_recipes_tag(recipe.user_id))
+
+    async def delete_recipe(self, recipe: Recipe) -> None:
+        """
+        Deletes the recipe with its ingredient links and leaves a tombstone for delta sync.
+
+        :param recipe: recipe to delete, loaded in the current session
+        """
+        try:
+            await self.lock_changes(recipe.user_id)
+            self.session.add(RecipeTombstone(recipe_id=recipe.recipe_id, user_id=recipe.user_id))
+            await self.session.delete(recipe)
+            await self.session.flush()
+            self.invalidate(user_recipes_tag(recipe.user_id))
+        except StaleDataError:
+            # changed concurrently, up to the caller
+            raise
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def fetch_user_recipe_versions(self, user_id: uuid.UUID) -> Sequence[Tuple[uuid.UUID, int]]:
+        """
+        Cheap check for changes in a user's recipes: ids and versions only, no ingredients.
+
+        :param user_id: owner of the recipes
+        :return: (recipe_id, version) rows ordered by recipe_id
+        """
+        try:
+            stmt = (select(Recipe.recipe_id, Recipe.version)
+                    .where(Recipe.user_id == user_id)
+                    .order_by(Recipe.recipe_id))
+            rows = await self.session.execute(stmt)
+            return rows.all()
+        except Exception as e:
+            await self.handle_exception(e)
+
     async def update_ingredients(
             self,
             recipe: Recipe,
             new_ings: List[IngredientSchema]
     ) -> None:
+        self.invalidate(user_recipes_tag(recipe.user_id))
 
         existing_map = {ri.name: ri for ri in recipe.ingredients}
 
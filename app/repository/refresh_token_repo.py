@@ -0,0 +1,125 @@
+import datetime
+import hashlib
+import secrets
+import uuid
+from typing import Optional
+
+from sqlalchemy import Row, delete, func, insert, select, update
+
+from app.database.models import RefreshToken, User
+from app.repository.user_repo import BaseRepository
+from config import Config
+
+
+def hash_refresh_token(token: str) -> str:
+    # tokens are random, a plain digest is enough to keep a database leak from exposing them
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RefreshTokenRepository(BaseRepository):
+    """
+    Refresh tokens of every device a user is logged in on, looked up by the hash of the token.
+    """
+
+    async def issue(self, user_id: uuid.UUID, family_id: Optional[uuid.UUID] = None,
+                    device: Optional[str] = None) -> str:
+        """
+        Stores a new refresh token and commits, together with anything done before in the transaction.
+
+        :param user_id: owner of the token
+        :param family_id: family of the token it replaces, None to start a new one on login
+        :param device: what the token was issued to, e.g. the User-Agent
+        :return: the token, only its hash is stored
+        """
+        token = secrets.token_urlsafe(32)
+        try:
+            await self.session.execute(insert(RefreshToken).values(
+                token_hash=hash_refresh_token(token),
+                family_id=family_id or uuid.uuid4(),
+                user_id=user_id,
+                device=device[:255] if device else None,
+                expires_at=func.now() + datetime.timedelta(days=Config.REFRESH_TOKEN_EXPIRES_DAYS),
+            ))
+            await self.session.commit()
+            return token
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def use(self, token_hash: str) -> Optional[Row]:
+        """
+        Marks an unused, unexpired token of an active user as used, in one statement on the token's index.
+        Concurrent uses of a token wait for each other, only one of them gets it.
+
+        :return: user_id, family_id, device, role, is_verified and token_epoch, None when the token cannot be used
+        """
+        try:
+            # a Core update, the ORM one does not return the joined user's columns
+            return (await self.session.execute(
+                update(RefreshToken.__table__)
+                .where(RefreshToken.token_hash == token_hash,
+                       RefreshToken.used_at.is_(None),
+                       RefreshToken.expires_at > func.now(),
+                       RefreshToken.user_id == User.user_id,
+                       User.is_active == True)
+                .values(used_at=func.now())
+                .returning(RefreshToken.user_id, RefreshToken.family_id, RefreshToken.device,
+                           User.role, User.is_verified, User.token_epoch)
+            )).one_or_none()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def get_used_family(self, token_hash: str) -> Optional[uuid.UUID]:
+        """
+        :return: family of the token when it was already used, which means it was stolen or replayed
+        """
+        try:
+            return (await self.session.execute(
+                select(RefreshToken.family_id)
+                .where(RefreshToken.token_hash == token_hash, RefreshToken.used_at.is_not(None))
+            )).scalar_one_or_none()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def revoke_family(self, family_id: uuid.UUID) -> None:
+        try:
+            await self.session.execute(delete(RefreshToken).where(RefreshToken.family_id == family_id))
+            await self.session.commit()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def revoke(self, user_id: uuid.UUID, token_hash: Optional[str] = None) -> None:
+        """
+        Logs a user out of the device the token belongs to, or of every device without a token.
+        """
+        condition = RefreshToken.user_id == user_id
+        if token_hash is not None:
+            family = select(RefreshToken.family_id).where(RefreshToken.token_hash == token_hash).scalar_subquery()
+            condition &= RefreshToken.family_id == family
+        try:
+            await self.session.execute(delete(RefreshToken).where(condition))
+            await self.session.commit()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def purge_expired(self, batch_size: int = Config.REFRESH_TOKEN_PURGE_BATCH_SIZE) -> int:
+        """
+        Deletes expired tokens in batches, each in its own short transaction.
+        Rows locked by another worker purging at the same time are skipped.
+
+        :return: number of expired tokens deleted
+        """
+        purged = 0
+        try:
+            while True:
+                expired = (select(RefreshToken.token_hash)
+                           .where(RefreshToken.expires_at < func.now())
+                           .limit(batch_size)
+                           .with_for_update(skip_locked=True)
+                           .scalar_subquery())
+                result = await self.session.execute(delete(RefreshToken).where(RefreshToken.token_hash.in_(expired)))
+                await self.session.commit()
+                purged += result.rowcount
+                if result.rowcount < batch_size:
+                    return purged
+        except Exception as e:
+            await self.handle_exception(e)
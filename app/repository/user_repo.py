@@ -1,10 +1,15 @@
 import uuid
+from typing import Dict, List, Optional, Set
 
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from app.database.models import User, Role
-from app.services.auth_services.hashing import Hasher
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm.attributes import set_committed_value
+from app.database.models import RefreshToken, User, Role
+from app.repository.dataloader import BatchFunction, DataLoader, get_loader
+from app.services.availability import taken_tags
+from app.services.invalidation_bus import user_tag
 
 
 class BaseRepository:
@@ -17,6 +22,23 @@ class BaseRepository:
         """
         self.session = session
 
+    def invalidate(self, *tags: str) -> None:
+        """
+        Schedules cache tags to be invalidated on every worker once the current transaction is committed.
+
+        :param tags: tags of the cached responses built from the changed rows
+        """
+        self.session.info.setdefault("cache_tags", set()).update(tags)
+
+    def loader(self, name: str, batch_fn: BatchFunction) -> DataLoader:
+        """
+        Request-scoped loader batching and memoizing lookups of this session.
+
+        :param name: loader name, unique per kind of lookup
+        :param batch_fn: loads many keys at once, returns the found values by key
+        """
+        return get_loader(self.session, name, batch_fn)
+
     async def handle_exception(self, e: Exception):
         """
         Handles exceptions by printing the error message, rolling back the transaction, and raising an HTTPException.
@@ -32,30 +54,59 @@ class BaseRepository:
 
 class UserRepository(BaseRepository):
 
-    async def create_user(self, create_params: dict) -> User:
+    async def create_user(self, create_params: dict) -> Optional[User]:
         """
-        Creates a new user in the database.
+        Creates a new user in the database with a single `INSERT ... ON CONFLICT DO NOTHING RETURNING`,
+        so concurrent signups for the same username or email never fail with an integrity error.
 
-        :param create_params: user data
-        :return: User object
+        :param create_params: user data, with the password already hashed
+        :return: User object, None when the username or the email is taken
         """
         try:
-            create_params["hashed_password"] = Hasher.get_password_hash(create_params["password"])
-            db_user = User(
-                email=create_params["email"],
-                username=create_params["username"],
-                hashed_password=create_params["hashed_password"],
-                first_name=create_params.get("first_name"),
-                last_name=create_params.get("last_name")
-            )
-            self.session.add(db_user)
+            stmt = (pg_insert(User)
+                    .values(email=create_params["email"],
+                            username=create_params["username"],
+                            hashed_password=create_params["hashed_password"],
+                            first_name=create_params.get("first_name"),
+                            last_name=create_params.get("last_name"))
+                    .on_conflict_do_nothing()
+                    .returning(User))
+            db_user = (await self.session.execute(stmt)).scalar_one_or_none()
+            if db_user is not None:
+                self.invalidate(*taken_tags(db_user.username, db_user.email))
             await self.session.commit()
-            await self.session.refresh(db_user)
             return db_user
 
         except Exception as e:
             await self.handle_exception(e)
 
+    async def get_taken_fields(self, username: Optional[str], email: Optional[str]) -> Set[str]:
+        """
+        Tells which of the unique user fields are taken, with a lookup on their unique indexes.
+
+        :param username: username to look up, None to skip it
+        :param email: email to look up, None to skip it
+        :return: "username" and/or "email"
+        """
+        conditions = []
+        if username is not None:
+            conditions.append(User.username == username)
+        if email is not None:
+            conditions.append(User.email == email)
+        if not conditions:
+            return set()
+        try:
+            rows = await self.session.execute(select(User.username, User.email).where(or_(*conditions)))
+            taken = set()
+            for row in rows:
+                if username is not None and row.username == username:
+                    taken.add("username")
+                if email is not None and row.email == email:
+                    taken.add("email")
+            return taken
+        except Exception as e:
+            await self.handle_exception(e)
+
     async def get_user_by_email(self, email: str) -> User:
         """
         Gets user from database by id
@@ -84,29 +135,89 @@ class UserRepository(BaseRepository):
 
     async def get_active_user_by_user_id(self, user_id: uuid.UUID) -> User | None:
         """
-        Gets user from database by email
+        Gets user from database by id, lookups of the same request are batched and memoized
 
         :param user_id: unique user identifier
         :return: User object.
         """
         try:
-            user = await self.session.execute(select(User).where((User.user_id == user_id) & (User.is_active == True)))
-            return user.scalar_one_or_none()
+            user_id = uuid.UUID(str(user_id))
+        except ValueError as e:
+            await self.handle_exception(e)
+        return await self.loader("active_user_by_id", self._load_active_users_by_id).load(user_id)
+
+    async def _load_active_users_by_id(self, user_ids: List[uuid.UUID]) -> Dict[uuid.UUID, User]:
+        try:
+            users = await self.session.execute(select(User).where(User.user_id.in_(user_ids) & (User.is_active == True)))
+            return {user.user_id: user for user in users.scalars()}
         except Exception as e:
             await self.handle_exception(e)
 
+    async def replace_password_hash(self, user: User, new_hash: str) -> None:
+        """
+        Stores a new hash of the same password, unless the password was changed meanwhile.
+
+        :param user: user whose hash was verified
+        :param new_hash: hash following the current hashing policy
+        """
+        try:
+            await self.session.execute(
+                update(User)
+                .where((User.user_id == user.user_id) & (User.hashed_password == user.hashed_password))
+                .values(hashed_password=new_hash)
+                .execution_options(synchronize_session=False)
+            )
+            await self.session.commit()
+            set_committed_value(user, "hashed_password", new_hash)
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def get_token_epoch(self, user_id: uuid.UUID) -> Optional[int]:
+        """
+        Reads only the token epoch of an active user, to check an access token without loading the user.
+
+        :param user_id: unique user identifier
+        :return: the epoch, None when the user is inactive or does not exist
+        """
+        try:
+            return (await self.session.execute(
+                select(User.token_epoch).where((User.user_id == user_id) & (User.is_active == True))
+            )).scalar_one_or_none()
+        except Exception as e:
+            await self.handle_exception(e)
+
+    async def bump_token_epoch(self, user_id: uuid.UUID) -> None:
+        """
+        Revokes every access token issued to the user so far.
+
+        :param user_id: unique user identifier
+        """
+        try:
+            await self.session.execute(
+                update(User).where(User.user_id == user_id).values(token_epoch=User.token_epoch + 1)
+            )
+            self.invalidate(user_tag(user_id))
+            await self.session.commit()
+        except Exception as e:
+            await self.handle_exception(e)
 
     async def get_active_user_by_username_or_email(self, username: str) -> User:
         """
-        Gets user from database by email
+        Gets user from database by username or email, lookups of the same request are batched and memoized
 
         :param username: Entered username or email
         :return: User object.
         """
+        return await self.loader("active_user_by_login", self._load_active_users_by_login).load(username)
+
+    async def _load_active_users_by_login(self, logins: List[str]) -> Dict[str, User]:
         try:
-            user = await self.session.execute(select(User).where(((User.email == username) | (User.username == username))
-                                                            & (User.is_active == True)))
-            return user.scalars().first()
+            users = (await self.session.execute(select(User).where((User.email.in_(logins) | User.username.in_(logins))
+                                                                   & (User.is_active == True)))).scalars().all()
+            by_login = {user.username: user for user in users}
+            # an email match wins over someone else's username that looks like it
+            by_login.update({user.email: user for user in users})
+            return by_login
         except Exception as e:
             await self.handle_exception(e)
 
@@ -123,20 +234,26 @@ class UserRepository(BaseRepository):
                               .where((User.user_id == user_id) & User.is_active == True)
                               .values(**update_params)
                               .returning(User))
-            updated_user = await self.session.execute(updating_query)
+            updated_user = (await self.session.execute(updating_query)).scalar_one_or_none()
+            if updated_user is not None:
+                self.invalidate(user_tag(updated_user.user_id))
             await self.session.commit()
-            return updated_user.scalar_one_or_none()
+            return updated_user
         except Exception as e:
             await self.handle_exception(e)
 
     async def delete_user(self, username: str) -> User:
         try:
-            deleted_user = await self.session.execute(update(User)
-                                                      .where((User.email == username) | (User.username == username))
-                                                      .values(is_active=False, refresh_token=None)
-                                                      .returning(User))
+            deleted_user = (await self.session.execute(update(User)
+                                                       .where((User.email == username) | (User.username == username))
+                                                       .values(is_active=False, token_epoch=User.token_epoch + 1)
+                                                       .returning(User))).scalars().first()
+            if deleted_user is not None:
+                # logged out of every device
+                await self.session.execute(delete(RefreshToken).where(RefreshToken.user_id == deleted_user.user_id))
+                self.invalidate(user_tag(deleted_user.user_id))
             await self.session.commit()
-            return deleted_user.scalars().first()
+            return deleted_user
         except Exception as e:
             await self.handle_exception(e)
 
@@ -158,12 +275,14 @@ class ModeratorRepository(UserRepository):
 
     async def retrieve_user(self, username: str) -> User:
         try:
-            retrieved_user = await self.session.execute(update(User)
-                                                   .where((User.email == username) | (User.username == username))
-                                                   .values(is_active=True)
-                                                   .returning(User))
+            retrieved_user = (await self.session.execute(update(User)
+                                                    .where((User.email == username) | (User.username == username))
+                                                    .values(is_active=True)
+                                                    .returning(User))).scalars().first()
+            if retrieved_user is not None:
+                self.invalidate(user_tag(retrieved_user.user_id))
             await self.session.commit()
-            return retrieved_user.scalars().first()
+            return retrieved_user
         except Exception as e:
             await self.handle_exception(e)
 
@@ -172,12 +291,15 @@ class AdminRepository(ModeratorRepository):
 
     async def promote_to_moderator(self, username: str):
         try:
-            promoted_user = await self.session.execute(update(User)
-                                                       .where(((User.username == username) | (User.email == username)) &
-                                                              (User.is_active == True))
-                                                       .values(role=Role.moderator)
-                                                       .returning(User))
+            promoted_user = (await self.session.execute(update(User)
+                                                        .where(((User.username == username) | (User.email == username)) &
+                                                               (User.is_active == True))
+                                                        .values(role=Role.moderator,
+                                                                token_epoch=User.token_epoch + 1)
+                                                        .returning(User))).scalars().first()
+            if promoted_user is not None:
+                self.invalidate(user_tag(promoted_user.user_id))
             await self.session.commit()
-            return promoted_user.scalars().first()
+            return promoted_user
         except Exception as e:
             await self.handle_exception(e)
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, status, Depends
+from typing import Literal, Optional
+
+from fastapi import APIRouter, status, Depends, Security, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import User
 from app.database.session import get_db
 from app.repository.user_repo import AdminRepository
-from app.services.auth_services.dependencies import get_current_user
+from app.schemas.responses.api_schema_resp import APIResponse
+from app.services.auth_services.dependencies import Principal, get_principal
 from app.services.admin_service import AdminService
+from utils.profiler import request_profiler
 
 admin_router = APIRouter(tags=["admin"])
 
@@ -14,7 +18,51 @@ admin_router = APIRouter(tags=["admin"])
                     status_code=status.HTTP_200_OK)
 async def grant_privileges(
         username: str,
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_principal),
         db: AsyncSession = Depends(get_db)) -> dict:
     await AdminService(AdminRepository(db)).promote_to_moderator(current_user, username)
     return {"msg": f"User {username} was promoted to moderator"}
+
+
+@admin_router.post("/profiler/arm", response_model=APIResponse, status_code=status.HTTP_200_OK)
+async def arm_profiler(
+        path: Optional[str] = Query(None, description="Profile only requests whose path starts with this prefix"),
+        count: int = Query(1, ge=0, le=10, description="How many requests to profile, 0 disarms the profiler"),
+        current_user: Principal = Security(get_principal, scopes=["admin"])
+) -> APIResponse:
+    """
+    Profiles the next `count` requests matching `path`.
+    Profiles are rate-limited, so requests arriving too close to the previous profile run unprofiled.
+    """
+    if count == 0:
+        request_profiler.disarm()
+        return APIResponse(success=True, message="Profiler disarmed")
+
+    request_profiler.arm(path, count)
+    return APIResponse(success=True, message=f"Profiler armed for {count} request(s)")
+
+
+@admin_router.get("/profiler/profiles", response_model=APIResponse, status_code=status.HTTP_200_OK)
+async def list_profiles(current_user: Principal = Security(get_principal, scopes=["admin"])) -> APIResponse:
+    return APIResponse(
+        success=True,
+        data=[profile.summary() for profile in reversed(request_profiler.profiles)],
+        message="Profiles fetched"
+    )
+
+
+@admin_router.get("/profiler/profiles/{profile_id}", status_code=status.HTTP_200_OK)
+async def get_profile(
+        profile_id: str,
+        fmt: Literal["speedscope", "collapsed"] = Query("speedscope", alias="format"),
+        current_user: Principal = Security(get_principal, scopes=["admin"])
+):
+    """
+    Returns a captured profile either as speedscope JSON or as collapsed stacks for flamegraph.pl.
+    """
+    profile = request_profiler.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    if fmt == "collapsed":
+        return PlainTextResponse(profile.to_collapsed())
+    return profile.to_speedscope()
@@ -1,4 +1,5 @@
 from logging import getLogger
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Response, Request, HTTPException, Query, status, Security
 from fastapi.security import OAuth2PasswordRequestForm
@@ -6,18 +7,19 @@ from starlette.background import BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+from app.routes.serialization import api_response
 from app.schemas.responses.api_schema_resp import APIResponse
-from app.services.auth_services.dependencies import get_current_user
-from app.database.models import User
+from app.services.auth_services.admission import admit_login
+from app.services.auth_services.dependencies import Principal, get_principal
 from app.database.session import get_db
-from app.schemas.responses.user_schema_resp import UserResponse
+from app.repository.user_repo import UserRepository
+from app.schemas.responses.user_schema_resp import UserAvailability, UserResponse
 from app.schemas.requests.user_schema_req import UserCreate, ForgetPasswordRequest, ResetPasswordRequest
 from app.schemas.responses.token_schema_resp import Token
+from app.services.user_services import UserService
 from app.services.auth_services.auth import (
-    signout, signup, authenticate_user, refresh_user, create_access_token, create_refresh_token,send_verification_email,
-    reset_password, update_is_verified, update_user_password)
-
-from config import ROLE_SCOPES
+    signout, signup, authenticate_user, refresh_user, create_access_token, issue_refresh_token, send_verification_email,
+    reset_password, update_is_verified, update_user_password, scopes_for)
 
 logger = getLogger(__name__)
 
@@ -25,31 +27,56 @@ logger = getLogger(__name__)
 auth_router = APIRouter(tags=["auth"])
 
 
-@auth_router.post("/signup", response_model=APIResponse, status_code=status.HTTP_201_CREATED)
+def set_refresh_cookie(response: Response, refresh_token: str) -> None:
+    response.set_cookie(
+        key="refresh_token", value=refresh_token,
+        httponly=True, secure=True, samesite="strict"
+    )
+
+
+@auth_router.post("/signup", response_model=APIResponse[UserResponse], status_code=status.HTTP_201_CREATED)
 async def register(
         background_tasks: BackgroundTasks,
         user_create: UserCreate,
         session: AsyncSession = Depends(get_db)
-) -> APIResponse:
+) -> Response:
     user = await signup(session, user_create)
 
     await send_verification_email(background_tasks, user)
 
-    return APIResponse(
-        success=True,
-        data=UserResponse.model_validate(user),
-        message="Account created successfully! Check your inbox to verify your email",
+    return api_response(
+        UserResponse,
+        user,
+        "Account created successfully! Check your inbox to verify your email",
+        status_code=status.HTTP_201_CREATED,
     )
 
 
+@auth_router.get("/availability", response_model=APIResponse[UserAvailability], status_code=status.HTTP_200_OK)
+async def check_availability(
+        username: Optional[str] = Query(None),
+        email: Optional[str] = Query(None),
+        session: AsyncSession = Depends(get_db)
+) -> Response:
+    """
+    Tells whether a username and/or an email are still free, for signup forms checking as the user types.
+    Most free values are answered from memory, without a database query.
+    """
+    availability = await UserService(UserRepository(session)).check_availability(username, email)
+    return api_response(UserAvailability, availability, "Availability checked")
+
+
 @auth_router.post("/login", status_code=status.HTTP_200_OK)
 async def login(
+        request: Request,
         form: OAuth2PasswordRequestForm = Depends(),
         db: AsyncSession = Depends(get_db),
         response: Response = None
 ) -> dict:
 
     if form.grant_type == "password":
+        # before anything touches the database or the hasher
+        admit_login(form.username, request.client.host if request.client else None)
         user = await authenticate_user(form.username, form.password, db)
 
     else:
@@ -58,22 +85,14 @@ async def login(
     if not user:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid credentials")
 
-    user_role = user.role.value
-    allowed_scopes = ROLE_SCOPES[user_role]
-
-    if user.is_verified:
-        allowed_scopes += ["user:verified"]
-
-    access_token = create_access_token(str(user.user_id), allowed_scopes)
-    refresh_token = create_refresh_token(str(user.user_id))
+    allowed_scopes = scopes_for(user.role.value, user.is_verified)
 
-    user.refresh_token = refresh_token
-    await db.commit()
-
-    response.set_cookie(
-        key="refresh_token", value=refresh_token,
-        httponly=True, secure=True, samesite="strict"
+    access_token = create_access_token(
+        str(user.user_id), allowed_scopes, user.role.value, user.is_verified, user.token_epoch
     )
+    refresh_token = await issue_refresh_token(user, db, request.headers.get("user-agent"))
+
+    set_refresh_cookie(response, refresh_token)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -81,6 +100,7 @@ async def login(
 @auth_router.post("/token", status_code=status.HTTP_200_OK, response_model=APIResponse)
 async def refresh_access_token(
         request: Request = None,
+        response: Response = None,
         session: AsyncSession = Depends(get_db),
 ) -> APIResponse:
     refresh_token = request.cookies.get("refresh_token")
@@ -88,17 +108,19 @@ async def refresh_access_token(
     if not refresh_token:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Refresh token missing")
 
-    user = await refresh_user(refresh_token, session)
+    refreshed = await refresh_user(refresh_token, session)
 
-    if not user:
+    if not refreshed:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+    owner, new_refresh_token = refreshed
 
-    base_scopes = ROLE_SCOPES.get(user.role.value, [])
-    allowed_scopes = base_scopes.copy()
-    if user.is_verified:
-        allowed_scopes.append("user:verified")
+    allowed_scopes = scopes_for(owner.role.value, owner.is_verified)
 
-    new_access_token = create_access_token(str(user.user_id), allowed_scopes)
+    new_access_token = create_access_token(
+        str(owner.user_id), allowed_scopes, owner.role.value, owner.is_verified, owner.token_epoch
+    )
+    # refresh tokens are single use, the client keeps the next one
+    set_refresh_cookie(response, new_refresh_token)
 
     return APIResponse(
         success=True,
@@ -111,8 +133,10 @@ async def refresh_access_token(
 async def verify_email(token: str = Query(...), session: AsyncSession = Depends(get_db)) -> APIResponse:
     user = await update_is_verified(token, session)
 
-    full_scopes = ["user", "user:verified"]
-    access_token = create_access_token(str(user.user_id), full_scopes)
+    full_scopes = scopes_for(user.role.value, user.is_verified)
+    access_token = create_access_token(
+        str(user.user_id), full_scopes, user.role.value, user.is_verified, user.token_epoch
+    )
     return APIResponse(
         success=True,
         data=Token(
@@ -126,10 +150,12 @@ async def verify_email(token: str = Query(...), session: AsyncSession = Depends(
 
 @auth_router.post("/forget-password", status_code=status.HTTP_200_OK, response_model=APIResponse)
 async def forget_password(
+        request: Request,
         background_tasks: BackgroundTasks,
         fpr: ForgetPasswordRequest,
         session: AsyncSession = Depends(get_db)
 ) -> APIResponse:
+    admit_login(fpr.username, request.client.host if request.client else None)
     await reset_password(background_tasks, fpr.username, session)
     return APIResponse(
         success=True,
@@ -152,8 +178,15 @@ async def reset_user_password(
 
 
 @auth_router.post("/sign-out", status_code=status.HTTP_200_OK)
-async def logot(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> APIResponse:
-    await signout(current_user, db)
+async def logot(
+        request: Request,
+        response: Response,
+        principal: Principal = Depends(get_principal),
+        db: AsyncSession = Depends(get_db)
+) -> APIResponse:
+    """Signs out of this device, or of every device when the request carries no refresh token cookie."""
+    await signout(principal, db, request.cookies.get("refresh_token"))
+    response.delete_cookie(key="refresh_token", httponly=True, secure=True, samesite="strict")
     return APIResponse(
         success=True,
         message="You successfully logged out!"
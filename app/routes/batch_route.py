@@ -0,0 +1,176 @@
+import asyncio
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import pydantic_core
+from fastapi import APIRouter, Depends, Request, Security, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.middleware.exceptions import ExceptionMiddleware
+from starlette.responses import Response
+from starlette.types import Message, Scope
+
+from app.database.session import SerializedSession, get_db, shared_session
+from app.routes.serialization import FastJSONResponse
+from app.schemas.requests.batch_schema_req import BatchRequest, SubRequest
+from app.schemas.responses.api_schema_resp import APIResponse
+from app.schemas.responses.batch_schema_resp import SubResponse
+from app.services.auth_services.dependencies import Principal, batch_principal, get_principal
+from config import Config
+
+logger = getLogger(__name__)
+
+batch_router = APIRouter(tags=["batch"])
+
+# request headers forwarded from the batch request to every sub-request
+FORWARDED_HEADERS = (b"authorization", b"host", b"user-agent")
+
+
+async def run_sub_request(parent: Scope, sub: SubRequest) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Runs a sub-request through the application's router, in process.
+    The outer middleware (metrics, load shedding, profiling) only sees the batch request itself.
+    """
+    body = b"" if sub.body is None else pydantic_core.to_json(sub.body)
+    headers = [(name, value) for name, value in parent["headers"] if name in FORWARDED_HEADERS]
+    headers += [(name.encode("latin-1"), value.encode("latin-1")) for name, value in sub.headers.items()]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": sub.method,
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": sub.path,
+        "raw_path": sub.path.encode(),
+        "query_string": urlencode(sub.query, doseq=True).encode(),
+        "headers": headers,
+        "app": parent["app"],
+        "state": {},
+    }
+
+    request_sent = False
+    response_complete = asyncio.Event()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    response_headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            for name, value in message.get("headers", []):
+                if name != b"content-length":
+                    response_headers[name.decode("latin-1")] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    app = parent["app"]
+    try:
+        # the router alone does not turn HTTPException (404, 405, ...) into responses
+        await ExceptionMiddleware(app.router, handlers=app.exception_handlers)(scope, receive, send)
+    except Exception:
+        logger.exception("Batch sub-request %s %s failed", sub.method, sub.path)
+        return error_sub_response(status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal server error")
+    return status_code, response_headers, b"".join(chunks)
+
+
+def error_sub_response(status_code: int, message: str) -> Tuple[int, Dict[str, str], bytes]:
+    body = pydantic_core.to_json({"success": False, "data": None, "message": message, "errors": None})
+    return status_code, {"content-type": "application/json"}, body
+
+
+def encode_sub_response(status_code: int, headers: Dict[str, str], body: bytes) -> bytes:
+    # JSON bodies are spliced in as they are, without decoding them
+    if not body:
+        payload = b"null"
+    elif headers.get("content-type", "").startswith("application/json"):
+        payload = body
+    else:
+        payload = pydantic_core.to_json(body.decode("utf-8", "replace"))
+    return b'{"status":%d,"headers":%s,"body":%s}' % (status_code, pydantic_core.to_json(headers), payload)
+
+
+def plan(requests: List[SubRequest]) -> List[List[int]]:
+    """Groups consecutive reads to run them concurrently, every write runs alone and in order."""
+    groups: List[List[int]] = []
+    for index, sub in enumerate(requests):
+        if sub.method == "GET" and groups and requests[groups[-1][0]].method == "GET":
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
+
+
+async def execute_batch(parent: Scope, requests: List[SubRequest], timeout: float) -> List[bytes]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    results: List[Optional[Tuple[int, Dict[str, str], bytes]]] = [None] * len(requests)
+
+    for group in plan(requests):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        tasks = {asyncio.create_task(run_sub_request(parent, requests[index])): index for index in group}
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            results[tasks[task]] = task.result()
+        if pending:
+            break
+
+    encoded: List[bytes] = []
+    budget = Config.BATCH_MAX_RESPONSE_BYTES
+    for result in results:
+        if result is None:
+            result = error_sub_response(status.HTTP_504_GATEWAY_TIMEOUT, "Batch time limit exceeded")
+        part = encode_sub_response(*result)
+        if len(part) > budget:
+            part = encode_sub_response(*error_sub_response(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Batch response size limit exceeded"
+            ))
+        budget -= len(part)
+        encoded.append(part)
+    return encoded
+
+
+@batch_router.post("/batch", response_model=APIResponse[List[SubResponse]], status_code=status.HTTP_200_OK)
+async def batch(
+        body: BatchRequest,
+        request: Request,
+        session: AsyncSession = Depends(get_db),
+        principal: Principal = Security(get_principal, scopes=["user"])
+) -> Response:
+    """
+    Executes up to BATCH_MAX_REQUESTS sub-requests with one authentication and one database session.
+    Consecutive GETs run concurrently, any other method waits for the previous sub-requests and blocks the next ones.
+    Sub-requests still running after BATCH_TIMEOUT_MS get 504, those past BATCH_MAX_RESPONSE_BYTES get 413.
+    """
+    session_token = shared_session.set(SerializedSession(session))
+    principal_token = batch_principal.set(principal)
+    try:
+        parts = await execute_batch(request.scope, body.requests, Config.BATCH_TIMEOUT_MS / 1000)
+    finally:
+        batch_principal.reset(principal_token)
+        shared_session.reset(session_token)
+
+    return FastJSONResponse(
+        b'{"success":true,"data":[' + b",".join(parts) + b'],"message":"Batch executed","errors":null}'
+    )
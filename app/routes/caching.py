@@ -0,0 +1,75 @@
+from typing import Awaitable, Callable, Dict, Iterable, Literal, Optional, Tuple, Union
+
+from fastapi import Request
+from starlette.responses import Response
+
+from app.routes.conditional import etag_matches, not_modified
+from app.routes.serialization import FastJSONResponse
+from app.services.auth_services.dependencies import Principal
+from app.services.response_cache import CachedBody, ResponseCache, response_cache
+
+
+class CachedRoute:
+    """
+    Serves a route from the response cache.
+    Entries are keyed by the route path, the query string and, with vary_on="user", the caller.
+    """
+
+    def __init__(self, request: Request, cache: ResponseCache, ttl: Optional[float], vary_on: str):
+        self.request = request
+        self.cache = cache
+        self.ttl = ttl
+        self.vary_on = vary_on
+
+    def key(self, current_user: Optional[Principal]) -> str:
+        query = "&".join(f"{k}={v}" for k, v in sorted(self.request.query_params.multi_items()))
+        caller = current_user.user_id if self.vary_on == "user" and current_user is not None else "*"
+        return f"{self.request.method} {self.request.url.path}?{query}|{caller}"
+
+    def lookup(self, current_user: Optional[Principal]) -> Optional[Response]:
+        entry = self.cache.get(self.key(current_user))
+        return self._to_response(entry) if entry is not None else None
+
+    async def respond(
+            self,
+            current_user: Optional[Principal],
+            compute: Callable[[], Awaitable[Union[bytes, Tuple[bytes, Dict[str, str]]]]],
+            tags: Iterable[str] = (),
+            headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        """
+        :param compute: builds the serialized body on a miss, shared by concurrent requests for the same key.
+            May return headers along with it, e.g. an ETag that must describe the very rows it serialized
+        :param tags: invalidation tags of the data the response is built from
+        :param headers: extra headers stored along with the body
+        """
+        async def build() -> CachedBody:
+            result = await compute()
+            body, computed_headers = result if isinstance(result, tuple) else (result, {})
+            return CachedBody(
+                body=body,
+                headers={**(headers or {}), **computed_headers},
+                tags=frozenset(tags),
+            )
+
+        entry = await self.cache.get_or_compute(self.key(current_user), build, self.ttl)
+        return self._to_response(entry)
+
+    def _to_response(self, entry: CachedBody) -> Response:
+        etag = entry.headers.get("ETag")
+        if etag is not None and etag_matches(self.request, etag):
+            return not_modified(etag)
+        return FastJSONResponse(entry.body, headers=entry.headers)
+
+
+def cached_route(ttl: Optional[float] = None, vary_on: Literal["user", "public"] = "user"):
+    """
+    Dependency giving a route access to the response cache.
+
+    :param ttl: seconds an entry lives, RESPONSE_CACHE_TTL_SECONDS by default
+    :param vary_on: "user" caches per caller, "public" shares entries between all callers
+    """
+    def dependency(request: Request) -> CachedRoute:
+        return CachedRoute(request, response_cache, ttl, vary_on)
+
+    return dependency
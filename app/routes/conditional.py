@@ -0,0 +1,56 @@
+import hashlib
+from typing import Optional, Set
+
+from fastapi import Request, status
+from starlette.responses import Response
+
+
+def make_etag(kind: str, *parts) -> str:
+    """
+    Builds a strong ETag from row versions, e.g. a user's `updated_at` or recipe versions.
+
+    :param kind: resource prefix, keeps tags of different resources apart
+    :param parts: values identifying the current state of the resource
+    """
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{kind}-{digest}"'
+
+
+def version_etag(kind: str, version: int) -> str:
+    """
+    ETag carrying a row version as is, so that If-Match can be turned back into the version to update.
+    """
+    return f'"{kind}-{version}"'
+
+
+def if_match_versions(request: Request, kind: str) -> Optional[Set[int]]:
+    """
+    Versions accepted by the If-Match header, None when any version is, i.e. without the header or with "*".
+    Weak and foreign tags never match, as If-Match uses strong comparison.
+    """
+    header = request.headers.get("if-match")
+    if header is None or header.strip() == "*":
+        return None
+    prefix = f'"{kind}-'
+    versions = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+            versions.add(int(tag[len(prefix):-1]))
+    return versions
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Checks the If-None-Match header against the current ETag, using weak comparison as RFC 9110 requires.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,55 @@
+import functools
+from typing import FrozenSet, Optional, Type
+
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel, ConfigDict, create_model
+
+Fields = Optional[FrozenSet[str]]
+
+
+def sparse_fields(model: Type[BaseModel]):
+    """
+    Dependency parsing the `fields=` query parameter of a read endpoint into a set of `model` fields.
+    Resolves to None when the parameter is absent, meaning all fields.
+    Unknown fields are rejected with 422.
+
+    :param model: response model the fields are picked from
+    """
+    allowed = frozenset(model.model_fields)
+
+    def dependency(
+            fields: Optional[str] = Query(None, description=f"Comma-separated subset of: {', '.join(sorted(allowed))}")
+    ) -> Fields:
+        if fields is None:
+            return None
+        requested = frozenset(name.strip() for name in fields.split(",") if name.strip())
+        unknown = requested - allowed
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Unknown fields: {', '.join(sorted(unknown)) or '<empty>'}. "
+                       f"Allowed fields: {', '.join(sorted(allowed))}"
+            )
+        return requested
+
+    return dependency
+
+
+@functools.lru_cache(maxsize=256)
+def sparse_model(model: Type[BaseModel], fields: Fields) -> Type[BaseModel]:
+    """
+    Copy of `model` restricted to `fields`, so only those are validated and serialized.
+    Returns `model` itself when all fields are requested.
+    """
+    if fields is None or fields == frozenset(model.model_fields):
+        return model
+    definitions = {
+        name: (info.annotation, info)
+        for name, info in model.model_fields.items()
+        if name in fields
+    }
+    return create_model(
+        f"{model.__name__}[{','.join(sorted(fields))}]",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions,
+    )
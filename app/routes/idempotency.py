@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, UploadFile, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import Response
+
+from app.database.session import get_db
+from app.repository.idempotency_repo import IdempotencyRepository
+from app.services.auth_services.dependencies import Principal
+from app.services.single_flight import SingleFlight
+from utils.prometheus_logging import IDEMPOTENCY_REQUESTS
+
+MAX_KEY_LENGTH = 255
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def replay(self) -> Response:
+        headers = {**self.headers, "Idempotent-Replayed": "true"}
+        return Response(self.body, status_code=self.status_code, headers=headers)
+
+
+# requests of this worker in flight by (user_id, key), registered with their fingerprint
+_inflight: SingleFlight[Tuple[Response, StoredResponse]] = SingleFlight()
+
+
+class IdempotentRoute:
+    """
+    Runs a route at most once per Idempotency-Key of a user.
+
+    A retry with the same key replays the stored response, a duplicate sent while the first one
+    is still running on this worker waits for its response, and on another worker gets 409.
+    Reusing a key for a different request is rejected with 422. Requests that fail with an error
+    do not keep their key, so they can be retried. Requests without the header run as usual.
+    """
+
+    def __init__(self, request: Request, repository: IdempotencyRepository):
+        self.request = request
+        self.repository = repository
+
+    def fingerprint(self, payload: bytes) -> str:
+        digest = hashlib.sha256()
+        query = "&".join(f"{k}={v}" for k, v in sorted(self.request.query_params.multi_items()))
+        for part in (self.request.method.encode(), self.request.url.path.encode(), query.encode(), payload):
+            digest.update(len(part).to_bytes(8, "big") + part)
+        return digest.hexdigest()
+
+    async def run(self, current_user: Principal, payload: bytes, compute: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        :param payload: what identifies the request besides its path and query, e.g. the body or an uploaded file
+        :param compute: executes the route, must commit its own changes
+        """
+        key = self.request.headers.get("idempotency-key")
+        if key is None:
+            return await compute()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long")
+
+        fingerprint = self.fingerprint(payload)
+        scope = (current_user.user_id, key)
+        while True:
+            flight = _inflight.get(scope)
+            if flight is None:
+                break
+            self._check_fingerprint(flight.info, fingerprint)
+            IDEMPOTENCY_REQUESTS.labels(result="coalesced").inc()
+            finished, result = await _inflight.wait(flight)
+            if finished:
+                return result[1].replay()
+
+        response, _ = await _inflight.lead(
+            scope, lambda: self._execute(current_user.user_id, key, fingerprint, compute), info=fingerprint
+        )
+        return response
+
+    async def _execute(
+            self,
+            user_id: uuid.UUID,
+            key: str,
+            fingerprint: str,
+            compute: Callable[[], Awaitable[Response]]
+    ) -> Tuple[Response, StoredResponse]:
+        record = await self.repository.claim(user_id, key, fingerprint)
+        if record is not None:
+            self._check_fingerprint(record.fingerprint, fingerprint)
+            if record.status_code is None:
+                IDEMPOTENCY_REQUESTS.labels(result="conflict").inc()
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="A request with this Idempotency-Key is still in progress")
+            IDEMPOTENCY_REQUESTS.labels(result="replayed").inc()
+            stored = StoredResponse(record.status_code, record.response_headers, record.response_body)
+            return stored.replay(), stored
+
+        IDEMPOTENCY_REQUESTS.labels(result="executed").inc()
+        try:
+            response = await compute()
+        except BaseException:
+            await asyncio.shield(self.repository.release(user_id, key))
+            raise
+
+        stored = StoredResponse(
+            status_code=response.status_code,
+            headers={name: value for name, value in response.headers.items() if name != "content-length"},
+            body=response.body,
+        )
+        if response.status_code >= 500:
+            await self.repository.release(user_id, key)
+        else:
+            await self.repository.complete(user_id, key, stored.status_code, stored.headers, stored.body)
+        return response, stored
+
+    @staticmethod
+    def _check_fingerprint(stored: str, fingerprint: str) -> None:
+        if stored != fingerprint:
+            IDEMPOTENCY_REQUESTS.labels(result="mismatch").inc()
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Idempotency-Key was already used for a different request")
+
+
+async def upload_digest(file: Optional[UploadFile]) -> bytes:
+    """Digest of an uploaded file to fingerprint the request with, the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    if file is not None:
+        while chunk := await file.read(64 * 1024):
+            digest.update(chunk)
+        await file.seek(0)
+    return digest.digest()
+
+
+def idempotent_route(request: Request, session: AsyncSession = Depends(get_db)) -> IdempotentRoute:
+    """Dependency giving a route Idempotency-Key support."""
+    return IdempotentRoute(request, IdempotencyRepository(session))
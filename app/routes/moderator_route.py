@@ -1,11 +1,10 @@
 from fastapi import APIRouter, status, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import User
 from app.database.session import get_db
 from app.repository.user_repo import ModeratorRepository
 from app.schemas.responses.user_schema_resp import UserIsActive
-from app.services.auth_services.dependencies import get_current_user
+from app.services.auth_services.dependencies import Principal, get_principal
 from app.services.moderator_service import ModeratorService
 
 moderator_router = APIRouter(tags=["moderator"])
@@ -14,6 +13,6 @@ moderator_router = APIRouter(tags=["moderator"])
 @moderator_router.patch("/retrieve-user", response_model=UserIsActive, status_code=status.HTTP_201_CREATED)
 async def retrieve_user(
         username: str,
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_principal),
         db: AsyncSession = Depends(get_db)) -> UserIsActive:
     return await ModeratorService(ModeratorRepository(db)).retrieve_user(current_user, username)
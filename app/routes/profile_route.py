@@ -1,23 +1,35 @@
+import datetime
+import functools
 import uuid
 import cloudinary
 import cloudinary.uploader
 
 from config import Config
 from app.database.models import User
-from app.database.session import get_db
+from app.database.session import detached_session, get_db
 from app.repository.recipe_repo import RecipeRepository
+from app.repository.recipe_read_repo import RecipeReadRepository
 from app.repository.user_repo import UserRepository
+from app.routes.caching import CachedRoute, cached_route
+from app.routes.conditional import make_etag, etag_matches, not_modified, version_etag, if_match_versions
+from app.routes.fieldsets import Fields, sparse_fields, sparse_model
+from app.routes.idempotency import IdempotentRoute, idempotent_route, upload_digest
+from app.routes.serialization import api_response, dump_envelope
 from app.schemas.requests.recipe_schema_req import RecipeCreate, RecipeUpdate
 from app.schemas.requests.user_schema_req import UserUpdate
 from app.schemas.responses.api_schema_resp import APIResponse
-from app.schemas.responses.recipe_schema_resp import RecipeResponse
+from app.schemas.responses.recipe_schema_resp import RecipeImportReport, RecipeResponse
 from app.schemas.responses.user_schema_resp import UserResponse
-from app.services.auth_services.dependencies import get_current_user
+from app.services.auth_services.dependencies import Principal, get_current_user, get_principal
+from app.services.recipe_export import EXPORT_FORMATS, RecipeExportService
+from app.services.recipe_import import RecipeImportService
 from app.services.recipe_service import RecipeService
+from app.services.invalidation_bus import user_recipes_tag
 from app.services.user_services import UserService
 
-from typing import Optional
-from fastapi import APIRouter, Security, Depends, status, UploadFile, Query
+from typing import Dict, List, Literal, Optional, Tuple
+from fastapi import APIRouter, Security, Depends, status, UploadFile, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 cloudinary.config(
@@ -29,103 +41,222 @@ cloudinary.config(
 profile_router = APIRouter(tags=["profile"])
 
 
-@profile_router.get("/", response_model=APIResponse, status_code=status.HTTP_200_OK)
-async def read_my_profile(current_user: User = Security(get_current_user, scopes=["user"])):
+@profile_router.get("/", response_model=APIResponse[UserResponse], status_code=status.HTTP_200_OK)
+async def read_my_profile(
+        request: Request,
+        current_user: User = Security(get_current_user, scopes=["user"])
+):
     """
     User can read information about his profile via this endpoint.
     It is protected with "user" scope in access token.
+    Responds with 304 when If-None-Match carries the current ETag.
     """
-    return APIResponse(
-        success=True,
-        data=UserResponse.model_validate(current_user),
-        message="User profile fetched"
-    )
+    etag = make_etag("user", current_user.user_id, current_user.updated_at)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    return api_response(UserResponse, current_user, "User profile fetched", headers={"ETag": etag})
 
 
-@profile_router.patch("/update", response_model=APIResponse, status_code=status.HTTP_201_CREATED)
+@profile_router.patch("/update", response_model=APIResponse[UserResponse], status_code=status.HTTP_201_CREATED)
 async def update_user(
         user_update: UserUpdate,
         session: AsyncSession = Depends(get_db),
-        current_user: User = Depends(get_current_user)
-) -> APIResponse:
+        current_user: Principal = Depends(get_principal)
+) -> Response:
     user = await UserService(UserRepository(session)).update_user(current_user, user_update)
-    return APIResponse(
-        success=True,
-        data=UserResponse.model_validate(user),
-        message="Your profile data was updated successfully"
+    return api_response(
+        UserResponse, user, "Your profile data was updated successfully", status_code=status.HTTP_201_CREATED
     )
 
 
-@profile_router.post("/my-recipes/upload", status_code=status.HTTP_201_CREATED)
+@profile_router.post(
+    "/my-recipes/upload", response_model=APIResponse[RecipeResponse], status_code=status.HTTP_201_CREATED
+)
 async def post_recipe(
         body: RecipeCreate,
         session: AsyncSession = Depends(get_db),
-        current_user: User = Security(get_current_user, scopes=["user", "user:verified"])
-) -> APIResponse:
+        current_user: Principal = Security(get_principal, scopes=["user", "user:verified"]),
+        idempotency: IdempotentRoute = Depends(idempotent_route)
+) -> Response:
+    """
+    Retries sent with the same Idempotency-Key get the response of the first request instead of a duplicate.
+    """
+    async def create() -> Response:
+        recipe = await RecipeRepository(session).create_recipe(
+            user_id=current_user.user_id,
+            body=body
+        )
 
-    recipe = await RecipeRepository(session).create_recipe(
-        user_id=current_user.user_id,
-        body=body
-    )
+        await RecipeRepository(session).add_ingredients(
+            recipe=recipe,
+            ingredients_data=body.ingredients,
+        )
 
-    await RecipeRepository(session).add_ingredients(
-        recipe=recipe,
-        ingredients_data=body.ingredients,
-    )
+        await session.commit()
+
+        return api_response(
+            RecipeResponse, recipe, "Recipe created successfully", status_code=status.HTTP_201_CREATED,
+            headers={"ETag": version_etag("recipe", recipe.version)}
+        )
 
-    await session.commit()
+    return await idempotency.run(current_user, body.model_dump_json().encode(), create)
 
-    return APIResponse(
-        success=True,
-        data=RecipeResponse.model_validate(recipe),
-        message="Recipe created successfully"
+
+@profile_router.post(
+    "/my-recipes/import", response_model=APIResponse[RecipeImportReport], status_code=status.HTTP_201_CREATED
+)
+async def import_recipes(
+        request: Request,
+        import_format: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+        session: AsyncSession = Depends(get_db),
+        current_user: Principal = Security(get_principal, scopes=["user", "user:verified"])
+) -> Response:
+    """
+    Bulk import of recipes from an NDJSON body (one RecipeCreate per line) or a CSV body
+    (`title,description,ingredients` header, ingredients as a JSON array).
+    The format follows Content-Type unless `format` is given. The body is streamed and loaded in chunks,
+    invalid rows are skipped and reported by line number.
+    """
+    if import_format is None:
+        content_type = request.headers.get("content-type", "")
+        import_format = "csv" if content_type.startswith("text/csv") else "ndjson"
+
+    report = await RecipeImportService(RecipeRepository(session)).import_recipes(
+        current_user.user_id, request.stream(), import_format
+    )
+    return api_response(
+        RecipeImportReport, report, f"{report['imported']} recipes imported", status_code=status.HTTP_201_CREATED
     )
 
 
-@profile_router.put("/my-recipes/update-photo", response_model=APIResponse, status_code=status.HTTP_201_CREATED)
+@profile_router.put(
+    "/my-recipes/update-photo", response_model=APIResponse[RecipeResponse], status_code=status.HTTP_201_CREATED
+)
 async def update_photo(
+        request: Request,
         file: Optional[UploadFile] = None,
         recipe_id: uuid.UUID = Query(...),
         session: AsyncSession = Depends(get_db),
-        current_user: User = Security(get_current_user, scopes=["user", "user:verified"])
+        current_user: Principal = Security(get_principal, scopes=["user", "user:verified"]),
+        idempotency: IdempotentRoute = Depends(idempotent_route)
 ):
-    recipe, action = await (RecipeService(RecipeRepository(session)).
-                            update_recipe_photo(recipe_id, file, current_user, session))
+    """
+    Retries sent with the same Idempotency-Key replay the first response without uploading the photo again.
+    With If-Match, only the recipe version it names is updated, 412 otherwise.
+    """
+    async def upload() -> Response:
+        recipe, action = await (RecipeService(RecipeRepository(session)).
+                                update_recipe_photo(recipe_id, file, current_user, session,
+                                                    if_match_versions(request, "recipe")))
 
-    return APIResponse(
-        success=True,
-        message=f"Recipe photo successfully {action}",
-        data=RecipeResponse.model_validate(recipe)
-    )
+        return api_response(
+            RecipeResponse, recipe, f"Recipe photo successfully {action}", status_code=status.HTTP_201_CREATED,
+            headers={"ETag": version_etag("recipe", recipe.version)}
+        )
+
+    return await idempotency.run(current_user, await upload_digest(file), upload)
 
 
-@profile_router.get("/my-recipes", response_model=APIResponse, status_code=status.HTTP_200_OK)
+@profile_router.get("/my-recipes", response_model=APIResponse[List[RecipeResponse]], status_code=status.HTTP_200_OK)
 async def read_my_recipes(
-        current_user: User = Security(get_current_user, scopes=["user"]),
-        session: AsyncSession = Depends(get_db)
-) -> APIResponse:
-    recipes = await RecipeRepository(session).fetch_all_user_recipes(current_user.user_id)
-    data = [RecipeResponse.model_validate(r) for r in recipes]
-    return APIResponse(
-        success=True,
-        data=data,
-        message="User recipes fetched",
+        request: Request,
+        current_user: Principal = Security(get_principal, scopes=["user"]),
+        session: AsyncSession = Depends(get_db),
+        cache: CachedRoute = Depends(cached_route()),
+        fields: Fields = Depends(sparse_fields(RecipeResponse))
+):
+    """
+    Served from the response cache until one of the user's recipes changes.
+    On a miss, responds with 304 when If-None-Match carries the current ETag,
+    which is checked against recipe versions before any recipe or ingredient is loaded.
+    With `fields=`, only the requested fields are selected and returned.
+    """
+    cached = cache.lookup(current_user)
+    if cached is not None:
+        return cached
+
+    def recipes_etag(versions) -> str:
+        return make_etag(
+            "recipes", current_user.user_id, ",".join(sorted(fields or ())),
+            *(f"{recipe_id}:{version}" for recipe_id, version in sorted(versions))
+        )
+
+    versions = await RecipeRepository(session).fetch_user_recipe_versions(current_user.user_id)
+    etag = recipes_etag(versions)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    async def compute() -> Tuple[bytes, Dict[str, str]]:
+        # a write may commit after the versions above were read, the ETag follows the rows serialized
+        recipes = await RecipeReadRepository(session).fetch_user_recipes(
+            current_user.user_id, None if fields is None else {*fields, "version"}
+        )
+        body = dump_envelope(List[sparse_model(RecipeResponse, fields)], recipes, "User recipes fetched")
+        return body, {"ETag": recipes_etag((recipe.recipe_id, recipe.version) for recipe in recipes)}
+
+    return await cache.respond(current_user, compute, tags=[user_recipes_tag(current_user.user_id)])
+
+
+@profile_router.get("/my-recipes/export", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_my_recipes(
+        request: Request,
+        export_format: Literal["ndjson", "zip"] = Query("ndjson", alias="format"),
+        current_user: Principal = Security(get_principal, scopes=["user"])
+) -> StreamingResponse:
+    """
+    Downloads all the user's recipes as NDJSON, one RecipeResponse per line, or as a zip holding
+    recipes.json and images.json, the manifest of the recipe images.
+    Streamed from a server-side cursor, memory use does not depend on the number of recipes.
+    """
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"recipes-{datetime.date.today().isoformat()}.{extension}"
+    service = RecipeExportService(functools.partial(detached_session, request.app))
+    return StreamingResponse(
+        service.export(current_user.user_id, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
-@profile_router.patch("/my-recipes/update", response_model=APIResponse, status_code=status.HTTP_201_CREATED)
+@profile_router.patch(
+    "/my-recipes/update", response_model=APIResponse[RecipeResponse], status_code=status.HTTP_201_CREATED
+)
 async def update_recipe(
+        request: Request,
         recipe_update: RecipeUpdate,
         recipe_id: uuid.UUID = Query(...),
         session: AsyncSession = Depends(get_db),
-        current_user: User = Depends(get_current_user)
-) -> APIResponse:
-
+        current_user: Principal = Depends(get_principal)
+) -> Response:
+    """
+    Send If-Match with the ETag of the recipe, `"recipe-<version>"`, to update only the version you have seen.
+    Responds with 412 when the recipe was changed meanwhile.
+    """
     updated_recipe = await (RecipeService(RecipeRepository(session)).
-                            update_recipe(recipe_id, recipe_update, current_user))
+                            update_recipe(recipe_id, recipe_update, current_user,
+                                          if_match_versions(request, "recipe")))
+
+    return api_response(
+        RecipeResponse, updated_recipe, "Recipe was updated successfully", status_code=status.HTTP_201_CREATED,
+        headers={"ETag": version_etag("recipe", updated_recipe.version)}
+    )
+
 
-    return APIResponse(
-        success=True,
-        data=RecipeResponse.model_validate(updated_recipe),
-        message="Recipe was updated successfully"
+@profile_router.delete(
+    "/my-recipes/delete", response_model=APIResponse[None], status_code=status.HTTP_200_OK
+)
+async def delete_recipe(
+        request: Request,
+        recipe_id: uuid.UUID = Query(...),
+        session: AsyncSession = Depends(get_db),
+        current_user: Principal = Security(get_principal, scopes=["user"])
+) -> Response:
+    """
+    Deletes the recipe. Synced clients learn about it from the next `/sync`.
+    With If-Match, only the recipe version it names is deleted, 412 otherwise.
+    """
+    await RecipeService(RecipeRepository(session)).delete_recipe(
+        recipe_id, current_user, if_match_versions(request, "recipe")
     )
+    return api_response(None, None, "Recipe was deleted successfully")
@@ -0,0 +1,33 @@
+from typing import List
+
+from fastapi import APIRouter, Security, Depends, status, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.session import get_db
+from app.repository.recipe_read_repo import RecipeReadRepository
+from app.routes.fieldsets import Fields, sparse_fields, sparse_model
+from app.routes.serialization import api_response
+from app.schemas.requests.recipe_schema_req import RecipeBatchGet
+from app.schemas.responses.api_schema_resp import APIResponse
+from app.schemas.responses.recipe_schema_resp import RecipeBatchItem, RecipeResponse
+from app.services.auth_services.dependencies import Principal, get_principal
+from app.services.recipe_service import RecipeReadService
+
+recipe_router = APIRouter(tags=["recipes"])
+
+
+@recipe_router.post(
+    "/batch-get", response_model=APIResponse[List[RecipeBatchItem[RecipeResponse]]], status_code=status.HTTP_200_OK
+)
+async def batch_get_recipes(
+        body: RecipeBatchGet,
+        session: AsyncSession = Depends(get_db),
+        current_user: Principal = Security(get_principal, scopes=["user"]),
+        fields: Fields = Depends(sparse_fields(RecipeResponse))
+) -> Response:
+    """
+    Fetches up to RECIPE_BATCH_MAX_IDS recipes with one query.
+    Results follow the order of the requested ids, missing or hidden recipes come with `found: false`.
+    """
+    items = await RecipeReadService(RecipeReadRepository(session)).batch_get(body.ids, current_user, fields)
+    return api_response(List[RecipeBatchItem[sparse_model(RecipeResponse, fields)]], items, "Recipes fetched")
@@ -0,0 +1,59 @@
+import functools
+from typing import Any, Dict, List, Optional
+
+import pydantic_core
+from pydantic import TypeAdapter
+from starlette.responses import Response
+
+from app.schemas.responses.api_schema_resp import APIResponse
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered by pydantic-core straight to bytes.
+    Models, UUIDs and dates are encoded natively, without jsonable_encoder and json.dumps.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return pydantic_core.to_json(content)
+
+
+@functools.lru_cache(maxsize=None)
+def envelope_adapter(data_type: Any) -> TypeAdapter:
+    return TypeAdapter(APIResponse[data_type])
+
+
+def dump_envelope(
+        data_type: Any,
+        data: Any = None,
+        message: Optional[str] = None,
+        success: bool = True,
+        errors: Optional[List[str]] = None
+) -> bytes:
+    """
+    Validates `data` into `APIResponse[data_type]` and serializes it to JSON in a single pass.
+    ORM objects are read through their attributes, so there is no need to build response models upfront.
+    """
+    adapter = envelope_adapter(data_type)
+    envelope = adapter.validate_python(
+        {"success": success, "data": data, "message": message, "errors": errors},
+        from_attributes=True,
+    )
+    return adapter.dump_json(envelope)
+
+
+def api_response(
+        data_type: Any,
+        data: Any = None,
+        message: Optional[str] = None,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    Builds the response of a route declared with `response_model=APIResponse[data_type]`.
+    Returning a Response skips FastAPI's second validation and encoding of the result.
+    """
+    return FastJSONResponse(dump_envelope(data_type, data, message), status_code=status_code, headers=headers)
@@ -0,0 +1,30 @@
+from typing import Optional
+
+from fastapi import APIRouter, Security, Depends, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.session import get_db
+from app.repository.recipe_read_repo import RecipeReadRepository
+from app.routes.serialization import api_response
+from app.schemas.responses.api_schema_resp import APIResponse
+from app.schemas.responses.recipe_schema_resp import RecipeChanges
+from app.services.auth_services.dependencies import Principal, get_principal
+from app.services.recipe_service import RecipeReadService
+from config import Config
+
+sync_router = APIRouter(tags=["sync"])
+
+
+@sync_router.get("/sync", response_model=APIResponse[RecipeChanges], status_code=status.HTTP_200_OK)
+async def sync_my_recipes(
+        since: Optional[str] = Query(None, description="`next_token` of the previous sync, omit for a full sync"),
+        limit: int = Query(Config.SYNC_PAGE_SIZE, ge=1, le=Config.SYNC_PAGE_SIZE),
+        session: AsyncSession = Depends(get_db),
+        current_user: Principal = Security(get_principal, scopes=["user"])
+) -> Response:
+    """
+    Returns the user's recipes created, updated or deleted since the sync token, for clients caching them offline.
+    Keep calling with `next_token` while `has_more` is true, then store it for the next sync.
+    """
+    changes = await RecipeReadService(RecipeReadRepository(session)).changes_since(current_user, since, limit)
+    return api_response(RecipeChanges, changes, "Changes fetched")
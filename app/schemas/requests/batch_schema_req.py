@@ -0,0 +1,47 @@
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import BaseModel, field_validator
+
+from config import Config
+
+# headers a sub-request may set, authorization always comes from the batch request
+SUB_REQUEST_HEADERS = frozenset({"if-none-match", "if-match", "idempotency-key"})
+
+
+class SubRequest(BaseModel):
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"] = "GET"
+    path: str
+    query: Dict[str, Union[str, List[str]]] = {}
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+    @field_validator("path")
+    @classmethod
+    def validate_path(cls, value: str):
+        if not value.startswith("/") or "?" in value:
+            raise ValueError("must be an absolute path, pass the query string in `query`")
+        if value.rstrip("/") == "/batch":
+            raise ValueError("batches cannot be nested")
+        return value
+
+    @field_validator("headers")
+    @classmethod
+    def validate_headers(cls, value: Dict[str, str]):
+        headers = {name.lower(): header for name, header in value.items()}
+        not_allowed = set(headers) - SUB_REQUEST_HEADERS
+        if not_allowed:
+            raise ValueError(f"headers not allowed: {', '.join(sorted(not_allowed))}")
+        return headers
+
+
+class BatchRequest(BaseModel):
+    requests: List[SubRequest]
+
+    @field_validator("requests")
+    @classmethod
+    def validate_batch_size(cls, value: List[SubRequest]):
+        if not value:
+            raise ValueError("at least one request must be provided")
+        if len(value) > Config.BATCH_MAX_REQUESTS:
+            raise ValueError(f"at most {Config.BATCH_MAX_REQUESTS} requests can be batched")
+        return value
@@ -2,9 +2,10 @@ import json
 import uuid
 from typing import Optional, List
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, model_validator, field_validator
 
 from app.schemas.responses.recipe_schema_resp import IngredientSchema
+from config import Config
 
 
 class RecipeCreate(BaseModel):
@@ -24,3 +25,16 @@ class RecipeUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     ingredients: Optional[List[IngredientSchema]] = None
+
+
+class RecipeBatchGet(BaseModel):
+    ids: List[uuid.UUID]
+
+    @field_validator("ids")
+    @classmethod
+    def validate_batch_size(cls, value: List[uuid.UUID]):
+        if not value:
+            raise ValueError("at least one id must be provided")
+        if len(value) > Config.RECIPE_BATCH_MAX_IDS:
+            raise ValueError(f"at most {Config.RECIPE_BATCH_MAX_IDS} ids can be fetched at once")
+        return value
@@ -1,9 +1,11 @@
 from pydantic import BaseModel
-from typing import Any, Optional, List
+from typing import Generic, Optional, List, TypeVar
 
+T = TypeVar("T")
 
-class APIResponse(BaseModel):
+
+class APIResponse(BaseModel, Generic[T]):
     success: bool
-    data: Optional[Any] = None
+    data: Optional[T] = None
     message: Optional[str] = None
     errors: Optional[List[str]] = None
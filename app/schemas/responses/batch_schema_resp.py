@@ -0,0 +1,9 @@
+from typing import Any, Dict
+
+from pydantic import BaseModel
+
+
+class SubResponse(BaseModel):
+    status: int
+    headers: Dict[str, str]
+    body: Any = None
@@ -1,7 +1,9 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Generic, Optional, List, TypeVar
 import uuid
 
+T = TypeVar("T")
+
 
 class IngredientSchema(BaseModel):
     name: str
@@ -18,6 +20,31 @@ class RecipeResponse(BaseModel):
     ingredients: List[IngredientSchema]
     image_url: Optional[str] = None
     user_id: uuid.UUID
+    version: int
 
     class Config:
         from_attributes = True
+
+
+class RecipeBatchItem(BaseModel, Generic[T]):
+    recipe_id: uuid.UUID
+    found: bool
+    recipe: Optional[T] = None
+
+
+class RecipeChanges(BaseModel):
+    changed: List[RecipeResponse]
+    deleted: List[uuid.UUID]
+    next_token: str
+    has_more: bool
+
+
+class RecipeImportRowError(BaseModel):
+    line: int
+    errors: List[str]
+
+
+class RecipeImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[RecipeImportRowError]
@@ -20,6 +20,11 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class UserAvailability(BaseModel):
+    username: bool | None = None
+    email: bool | None = None
+
+
 class UserIsActive(BaseModel):
     email: EmailStr
     username: str
@@ -2,13 +2,14 @@ from fastapi import HTTPException, status
 
 from app.database.models import User, Role
 from app.repository.user_repo import AdminRepository
+from app.services.auth_services.dependencies import Principal
 
 
 class AdminService:
     def __init__(self, repository: AdminRepository):
         self.repository = repository
 
-    async def promote_to_moderator(self, current_user: User, username: str) -> User:
+    async def promote_to_moderator(self, current_user: Principal, username: str) -> User:
         if current_user.role != Role.admin:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
         user = await self.repository.get_active_user_by_username_or_email(username)
@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import math
+import time
+from typing import Any, Callable, Optional, OrderedDict, Tuple, TypeVar
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+from utils.load_shedding import ConcurrencyLimiter
+from utils.prometheus_logging import LOGIN_ATTEMPTS, PASSWORD_HASHES_SHED
+from utils.request_accounting import accounted
+
+T = TypeVar("T")
+
+
+class TokenBuckets:
+    """
+    One token bucket per key: `burst` tokens, refilled at `per_minute`. Only the `max_entries` most
+    recently used keys are kept, an evicted key starts over with a full bucket.
+
+    A bucket is two floats in an OrderedDict, keys never seen are not stored until they take a token.
+    """
+
+    def __init__(self, burst: int, per_minute: float, max_entries: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.max_entries = max_entries
+        self.clock = clock
+        # key -> (tokens, time they were counted)
+        self._buckets: OrderedDict[str, Tuple[float, float]] = collections.OrderedDict()
+
+    def tokens(self, key: str, now: float) -> float:
+        if key not in self._buckets:
+            return float(self.burst)
+        tokens, updated = self._buckets[key]
+        return min(float(self.burst), tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """
+        :return: seconds until the key has a token, 0 when it has one now
+        """
+        missing = 1 - self.tokens(key, now)
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, key: str, now: float) -> None:
+        tokens = self.tokens(key, now) - 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class LoginAdmission:
+    """
+    Rate limits attempts to prove a password, per account and per client address, before any of
+    them reaches the database or the hasher. An attempt takes a token from both buckets or from none.
+    """
+
+    def __init__(self, accounts: TokenBuckets, addresses: TokenBuckets):
+        self.accounts = accounts
+        self.addresses = addresses
+
+    def admit(self, account: str, address: Optional[str]) -> Optional[float]:
+        """
+        :param account: username or email the attempt is for
+        :param address: client address, None when unknown
+        :return: None when admitted, otherwise seconds until the attempt would be
+        """
+        now = self.accounts.clock()
+        account = account.strip().casefold()
+        account_wait = self.accounts.wait_time(account, now)
+        address_wait = self.addresses.wait_time(address, now) if address is not None else 0.0
+        if account_wait or address_wait:
+            LOGIN_ATTEMPTS.labels(result="account_limited" if account_wait >= address_wait
+                                  else "address_limited").inc()
+            return max(account_wait, address_wait)
+
+        self.accounts.take(account, now)
+        if address is not None:
+            self.addresses.take(address, now)
+        LOGIN_ATTEMPTS.labels(result="admitted").inc()
+        return None
+
+    def clear(self) -> None:
+        self.accounts.clear()
+        self.addresses.clear()
+
+
+login_admission = LoginAdmission(
+    accounts=TokenBuckets(Config.LOGIN_ACCOUNT_BURST, Config.LOGIN_ACCOUNT_PER_MINUTE,
+                          Config.LOGIN_RATE_LIMIT_MAX_ENTRIES),
+    addresses=TokenBuckets(Config.LOGIN_ADDRESS_BURST, Config.LOGIN_ADDRESS_PER_MINUTE,
+                           Config.LOGIN_RATE_LIMIT_MAX_ENTRIES),
+)
+
+# hashes run in the threadpool, at most this many per worker, the others wait in a bounded queue
+hash_slots = ConcurrencyLimiter(
+    Config.PASSWORD_HASH_CONCURRENCY, Config.PASSWORD_HASH_QUEUE_SIZE, Config.PASSWORD_HASH_QUEUE_TIMEOUT_MS / 1000
+)
+
+
+def admit_login(account: str, address: Optional[str]) -> None:
+    """
+    :raises HTTPException: 429 with Retry-After when the account or the address is out of attempts
+    """
+    wait = login_admission.admit(account, address)
+    if wait is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+
+async def run_hash(func: Callable[..., T], *args: Any) -> T:
+    """
+    Runs a password hash or verification in the threadpool, so it neither blocks the event loop
+    nor takes more than its share of the worker's CPU.
+
+    :raises HTTPException: 503 with Retry-After when the hash cannot start within the queue timeout
+    """
+    reason = await hash_slots.acquire()
+    if reason is not None:
+        PASSWORD_HASHES_SHED.labels(reason=reason).inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": str(Config.LOAD_SHED_RETRY_AFTER_SECONDS)},
+        )
+    # a thread cannot be stopped, the slot is held until it is done even if the request is cancelled
+    hashing = asyncio.ensure_future(run_in_threadpool(accounted(func), *args))
+    hashing.add_done_callback(lambda _: hash_slots.release())
+    return await asyncio.shield(hashing)
@@ -1,26 +1,32 @@
 import datetime
 import uuid
+from logging import getLogger
 
 from fastapi_mail import MessageSchema, MessageType
 
 from app.services.auth_services.mail import fm
-from config import Config
+from config import Config, ROLE_SCOPES
 
 from fastapi import status
 from starlette.background import BackgroundTasks
-from passlib.context import CryptContext
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from fastapi import HTTPException
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.repository.refresh_token_repo import RefreshTokenRepository, hash_refresh_token
 from app.repository.user_repo import UserRepository
 from app.schemas.requests.user_schema_req import UserCreate, ResetPasswordRequest
+from app.services.auth_services.admission import run_hash
+from app.services.auth_services.dependencies import Principal
 from app.services.auth_services.hashing import Hasher
+from app.services.user_services import UserService
 from app.database.models import User
+from utils.prometheus_logging import REFRESH_TOKEN_REFRESHES
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = getLogger(__name__)
 
 
 def create_token(data: dict, expires_delta: timedelta, scope: str) -> str:
@@ -35,22 +41,23 @@ def create_token(data: dict, expires_delta: timedelta, scope: str) -> str:
     return jwt.encode(to_encode, Config.SECRET_KEY, algorithm=Config.ALGORITHM)
 
 
-def create_access_token(user_id: str, scopes: List[str]) -> str:
-
+def create_access_token(user_id: str, scopes: List[str], role: str, is_verified: bool, token_epoch: int) -> str:
+    """
+    The token carries everything authorization needs, requests are checked against the user's
+    current token epoch only, see `get_principal`.
+    """
     return create_token(
-        data={"sub": user_id, "scopes": scopes},
+        data={"sub": user_id, "scopes": scopes, "role": role, "verified": is_verified, "epoch": token_epoch},
         expires_delta=timedelta(minutes=Config.ACCESS_TOKEN_EXPIRES_MINUTES),
         scope="access_token",
     )
 
 
-def create_refresh_token(user_id: str):
-
-    return create_token(
-        data={"sub": user_id},
-        expires_delta=timedelta(days=Config.REFRESH_TOKEN_EXPIRES_DAYS),
-        scope="refresh_token",
-    )
+def scopes_for(role: str, is_verified: bool) -> List[str]:
+    scopes = list(ROLE_SCOPES.get(role, []))
+    if is_verified:
+        scopes.append("user:verified")
+    return scopes
 
 
 def create_email_verification_token(user_id: str):
@@ -71,39 +78,56 @@ def create_reset_password_token(user_id: str):
 
 
 async def authenticate_user(username: str, password: str, db: AsyncSession) -> Optional[User]:
-
-    user = await UserRepository(db).get_active_user_by_username_or_email(username)
-    if not user or not Hasher.verify_password(password, user.hashed_password):
+    """
+    Checks the credentials. A hash made with an older scheme or cost is replaced while the password is at hand.
+    Unknown users cost a verification too. The attempt has to be admitted by `admit_login` first.
+    """
+    repository = UserRepository(db)
+    user = await repository.get_active_user_by_username_or_email(username)
+    if not user:
+        await run_hash(Hasher.verify_dummy, password)
+        return None
+    verified, new_hash = await run_hash(Hasher.verify_and_update, password, user.hashed_password)
+    if not verified:
         return None
+    if new_hash is not None:
+        await repository.replace_password_hash(user, new_hash)
     return user
 
 
-async def refresh_user(refresh_token: str, session: AsyncSession,) -> Optional[User]:
-    try:
-        payload = jwt.decode(refresh_token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
-        if payload.get("scope") != "refresh_token":
-            return None
-        user_id = payload.get("sub")
-    except JWTError:
+async def issue_refresh_token(user: User, session: AsyncSession, device: Optional[str] = None) -> str:
+    """Starts a new token family on login, other devices of the user stay logged in."""
+    return await RefreshTokenRepository(session).issue(user.user_id, device=device)
+
+
+async def refresh_user(refresh_token: str, session: AsyncSession) -> Optional[Tuple[Row, str]]:
+    """
+    Exchanges a refresh token for the next one of its family.
+    A token that was already exchanged is a stolen or replayed one: its whole family is revoked,
+    so both the attacker and the legitimate device have to log in again.
+
+    :return: the owner's user_id, role, is_verified and token_epoch with the new token,
+        None when the token is not valid
+    """
+    repository = RefreshTokenRepository(session)
+    token_hash = hash_refresh_token(refresh_token)
+    owner = await repository.use(token_hash)
+    if owner is None:
+        family_id = await repository.get_used_family(token_hash)
+        if family_id is not None:
+            await repository.revoke_family(family_id)
+            REFRESH_TOKEN_REFRESHES.labels(result="reused").inc()
+            logger.warning("Refresh token reused, revoked token family %s", family_id)
+        else:
+            REFRESH_TOKEN_REFRESHES.labels(result="invalid").inc()
         return None
-    user = await UserRepository(session).get_active_user_by_user_id(user_id)
-    if not user or user.refresh_token != refresh_token:
-        return None
-    return user
+    new_token = await repository.issue(owner.user_id, owner.family_id, owner.device)
+    REFRESH_TOKEN_REFRESHES.labels(result="rotated").inc()
+    return owner, new_token
 
 
 async def signup(session: AsyncSession, data: UserCreate) -> User:
-    create_params = data.model_dump(exclude_unset=True)
-    existing_email = await UserRepository(session).get_user_by_email(create_params["email"])
-    if existing_email:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User with this email already exists")
-    existing_username = await UserRepository(session).get_user_by_username(create_params["username"])
-    if existing_username:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User with this username already exists")
-    user = await UserRepository(session).create_user(create_params)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong")
-    return user
+    return await UserService(UserRepository(session)).create_account(data)
 
 
 async def send_verification_email(background_tasks, user: User):
@@ -164,7 +188,7 @@ async def update_user_password(request: ResetPasswordRequest, token, session: As
     user = await UserRepository(session).get_active_user_by_user_id(uuid.UUID(user_id))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    hashed_pass = Hasher.get_password_hash(request.password)
+    hashed_pass = await run_hash(Hasher.get_password_hash, request.password)
     user.hashed_password = hashed_pass
     await session.commit()
     await session.refresh(user)
@@ -194,8 +218,11 @@ async def reset_password(background_tasks: BackgroundTasks, username: str, sessi
     return forget_url_link
 
 
-async def signout(current_user: User, session: AsyncSession) -> dict:
-    current_user.refresh_token = None
-    await session.commit()
-    await session.refresh(current_user)
-    return current_user
+async def signout(principal: Principal, session: AsyncSession, refresh_token: Optional[str] = None) -> None:
+    """
+    Logs out of the device the refresh token belongs to, or of every device without one.
+    Access tokens already issued are revoked on every device, the others get new ones with their refresh token.
+    """
+    token_hash = hash_refresh_token(refresh_token) if refresh_token else None
+    await RefreshTokenRepository(session).revoke(principal.user_id, token_hash)
+    await UserRepository(session).bump_token_epoch(principal.user_id)
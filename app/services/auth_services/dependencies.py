@@ -1,16 +1,19 @@
 import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
 
-from app.database.models import User
+from app.database.models import Role, User
 from config import Config
-from typing import List
+from typing import List, Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import SecurityScopes
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.session import get_db
+from app.database.session import detached_session, get_db
 from app.repository.user_repo import UserRepository
+from app.services.auth_services.token_epochs import token_epochs
 from fastapi.security import OAuth2PasswordBearer
 
 
@@ -25,10 +28,57 @@ oauth2_scheme = OAuth2PasswordBearer(
 )
 
 
-async def get_current_user(
+@dataclass(frozen=True)
+class Principal:
+    """
+    Caller resolved from an access token, without loading the user.
+    Routes needing more than the id, the role and the verified flag depend on `get_current_user`.
+    """
+    token: str
+    payload: dict
+    user_id: uuid.UUID
+    role: Role
+    is_verified: bool
+
+
+# set by /batch, so that sub-requests carrying the same token reuse the resolved caller
+batch_principal: ContextVar[Optional[Principal]] = ContextVar("batch_principal", default=None)
+
+
+def decode_access_token(token: str) -> Optional[Principal]:
+    try:
+        payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != "access_token" or not isinstance(payload.get("epoch"), int):
+        return None
+    try:
+        return Principal(
+            token=token,
+            payload=payload,
+            user_id=uuid.UUID(payload.get("sub")),
+            role=Role(payload.get("role")),
+            is_verified=bool(payload.get("verified")),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+async def load_token_epoch(request: Request, user_id: uuid.UUID) -> Optional[int]:
+    # a session only on a miss, most requests are authorized without one
+    async with detached_session(request.app) as session:
+        return await UserRepository(session).get_token_epoch(user_id)
+
+
+async def get_principal(
         security_scopes: SecurityScopes,
-        token: str = Depends(oauth2_scheme),
-        session: AsyncSession = Depends(get_db)) -> User:
+        request: Request,
+        token: str = Depends(oauth2_scheme)) -> Principal:
+    """
+    Authorizes the caller from the claims of the access token. The only check against the database
+    is the user's token epoch, served from memory: tokens issued before the user was deactivated,
+    changed role or signed out carry an older epoch and are rejected.
+    """
     if security_scopes.scopes:
         authenticate_value = f"Bearer scope=\"{security_scopes.scope_str}\""
     else:
@@ -38,21 +88,16 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": authenticate_value},
     )
-    try:
-        payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
-    except JWTError:
-        raise credentials_exception
-    token_scope = payload.get("scope")
-    if token_scope != "access_token":
-        raise credentials_exception
-    user_id: uuid.UUID = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
-    user = await UserRepository(session).get_active_user_by_user_id(user_id)
-    if user is None:
-        raise credentials_exception
+    principal = batch_principal.get()
+    if principal is None or principal.token != token:
+        principal = decode_access_token(token)
+        if principal is None:
+            raise credentials_exception
+        epoch = await token_epochs.get(principal.user_id, lambda user_id: load_token_epoch(request, user_id))
+        if epoch is None or epoch != principal.payload["epoch"]:
+            raise credentials_exception
 
-    token_scopes: List[str] = payload.get("scopes", [])
+    token_scopes: List[str] = principal.payload.get("scopes", [])
 
     for scope in security_scopes.scopes:
         if scope not in token_scopes:
@@ -62,4 +107,18 @@ async def get_current_user(
                 headers={"WWW-Authenticate": authenticate_value},
             )
 
+    return principal
+
+
+async def get_current_user(
+        principal: Principal = Depends(get_principal),
+        session: AsyncSession = Depends(get_db)) -> User:
+    """The caller's full user row, for routes that need more than the claims of the token."""
+    user = await UserRepository(session).get_active_user_by_user_id(principal.user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
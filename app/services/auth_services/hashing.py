@@ -1,6 +1,56 @@
+import functools
+import secrets
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from config import Config
+
+PASSWORD_HASH_SCHEMES = ("bcrypt", "argon2")
+
+
+def make_password_context(
+        scheme: str,
+        bcrypt_rounds: int,
+        argon2_time_cost: int,
+        argon2_memory_cost: int,
+        argon2_parallelism: int
+) -> CryptContext:
+    """
+    Hashing policy: new hashes use `scheme` with the given cost, hashes of the other scheme or of
+    a lower cost still verify but need an update. argon2 is argon2id and requires argon2-cffi.
+
+    :param argon2_memory_cost: in KiB
+    """
+    if scheme not in PASSWORD_HASH_SCHEMES:
+        raise ValueError(f"Unknown password hash scheme {scheme!r}, use one of: {', '.join(PASSWORD_HASH_SCHEMES)}")
+    return CryptContext(
+        schemes=[scheme] + [other for other in PASSWORD_HASH_SCHEMES if other != scheme],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        argon2__type="ID",
+        argon2__rounds=argon2_time_cost,
+        argon2__min_rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+pwd_context = make_password_context(
+    Config.PASSWORD_HASH_SCHEME,
+    bcrypt_rounds=Config.BCRYPT_ROUNDS,
+    argon2_time_cost=Config.ARGON2_TIME_COST,
+    argon2_memory_cost=Config.ARGON2_MEMORY_COST_KIB,
+    argon2_parallelism=Config.ARGON2_PARALLELISM,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def dummy_hash() -> str:
+    """A hash of a random password under the current policy, verified against for unknown users."""
+    return pwd_context.hash(secrets.token_urlsafe(16))
 
 
 class Hasher:
@@ -11,3 +61,22 @@ class Hasher:
     @staticmethod
     def get_password_hash(password: str) -> str:
         return pwd_context.hash(password)
+
+    @staticmethod
+    def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies the password and, when its hash does not follow the current policy, hashes it again.
+
+        :return: whether the password matches, and the new hash to store if one is needed
+        """
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
+    @staticmethod
+    def verify_dummy(plain_password: str) -> bool:
+        """
+        Takes as long as verifying a real password, so response times do not tell which accounts exist.
+
+        :return: always False
+        """
+        pwd_context.verify(plain_password, dummy_hash())
+        return False
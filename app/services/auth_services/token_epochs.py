@@ -0,0 +1,81 @@
+import collections
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable, Optional, OrderedDict, Tuple
+
+from app.services.invalidation_bus import USER_TAG_PREFIX, invalidation_bus
+from config import Config
+from utils.prometheus_logging import TOKEN_EPOCH_LOOKUPS
+
+
+class TokenEpochCache:
+    """
+    Current token epoch of the most recently seen users, None for inactive or unknown ones.
+
+    An entry is dropped whenever the user's cache tag is invalidated, which every change of the
+    epoch does, and reloaded on the next request. Loads that ran across an invalidation are not
+    stored, so an epoch read before the change cannot outlive it. Entries also expire after `ttl`
+    seconds, `negative_ttl` for None, bounding how long a lost invalidation message keeps a revoked
+    token working.
+    """
+
+    def __init__(
+            self,
+            max_entries: int,
+            ttl: float,
+            negative_ttl: float,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        # epoch and expiry by user
+        self._epochs: OrderedDict[uuid.UUID, Tuple[Optional[int], float]] = collections.OrderedDict()
+        # bumped on every invalidation
+        self._generation = 0
+
+    async def get(self, user_id: uuid.UUID, load: Callable[[uuid.UUID], Awaitable[Optional[int]]]) -> Optional[int]:
+        """
+        :param load: reads the epoch from the database on a miss
+        """
+        entry = self._epochs.get(user_id)
+        if entry is not None:
+            if entry[1] > self.clock():
+                self._epochs.move_to_end(user_id)
+                TOKEN_EPOCH_LOOKUPS.labels(result="hit").inc()
+                return entry[0]
+            del self._epochs[user_id]
+
+        TOKEN_EPOCH_LOOKUPS.labels(result="miss").inc()
+        generation = self._generation
+        epoch = await load(user_id)
+        if generation == self._generation:
+            ttl = self.negative_ttl if epoch is None else self.ttl
+            self._epochs[user_id] = (epoch, self.clock() + ttl)
+            self._epochs.move_to_end(user_id)
+            if len(self._epochs) > self.max_entries:
+                self._epochs.popitem(last=False)
+        return epoch
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            if tag.startswith(USER_TAG_PREFIX):
+                self._generation += 1
+                try:
+                    self._epochs.pop(uuid.UUID(tag[len(USER_TAG_PREFIX):]), None)
+                except ValueError:
+                    pass
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._epochs.clear()
+
+
+token_epochs = TokenEpochCache(
+    max_entries=Config.TOKEN_EPOCH_CACHE_SIZE,
+    ttl=Config.TOKEN_EPOCH_CACHE_TTL_SECONDS,
+    negative_ttl=Config.TOKEN_EPOCH_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+invalidation_bus.subscribe(token_epochs.invalidate_tags, token_epochs.clear)
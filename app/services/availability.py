@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import math
+from logging import getLogger
+from typing import AsyncContextManager, Callable, Iterable, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import User
+from app.database.session import sessionmanager
+from app.services.invalidation_bus import invalidation_bus
+from config import Config
+from utils.prometheus_logging import (AVAILABILITY_FILTER_BYTES, AVAILABILITY_FILTER_ENTRIES,
+                                      AVAILABILITY_FILTER_FALSE_POSITIVE_RATE)
+
+logger = getLogger(__name__)
+
+TAKEN_TAG_PREFIX = "taken:"
+BUILD_FETCH_SIZE = 10000
+
+
+def entry_digest(field: str, value: str) -> bytes:
+    """
+    Key of a username or an email in the filter. Values are case folded, which only makes
+    the filter answer "maybe taken" more often, the database check stays exact.
+    """
+    return hashlib.blake2b(f"{field}:{value.strip().casefold()}".encode(), digest_size=16).digest()
+
+
+def taken_tags(username: str, email: str) -> List[str]:
+    """
+    Tags telling every worker that a username and an email were taken. They carry digests,
+    so no address goes over the invalidation bus.
+    """
+    return [TAKEN_TAG_PREFIX + entry_digest(field, value).hex()
+            for field, value in (("username", username), ("email", email))]
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed bit array: no false negatives, false positives at `fp_rate`
+    as long as no more than `capacity` entries are added. Positions come from double hashing
+    of a 128 bit digest of the entry.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(capacity, 1)
+        self.size = max(math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: bytes) -> Iterable[int]:
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, digest: bytes) -> None:
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Expected rate for the entries added so far."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class AvailabilityIndex:
+    """
+    Bloom filter of the taken usernames and emails, answering "definitely free" without a query.
+
+    It is built from `users` at startup and updated from the taken tags published by every worker
+    after a signup commits. Usernames and emails are never freed, users are only deactivated.
+    Until a build completes, or when tags may have been missed after the bus reconnected,
+    `might_be_taken` answers None and callers check the database. The filter is rebuilt larger
+    once more entries than planned were added.
+    """
+
+    def __init__(self, open_session: Callable[[], AsyncContextManager[AsyncSession]]):
+        self.open_session = open_session
+        self._filter: Optional[BloomFilter] = None
+        # digests added while a build reads the table, replayed into the new filter
+        self._building: Optional[List[bytes]] = None
+        self._task: Optional[asyncio.Task] = None
+        # bumped when tags may have been missed, a build started before is outdated
+        self._generation = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_be_taken(self, field: str, value: str) -> Optional[bool]:
+        """
+        :return: False when the value is definitely free, True when it may be taken,
+            None when the filter is not usable and the database has to be checked
+        """
+        if self._filter is None:
+            return None
+        return entry_digest(field, value) in self._filter
+
+    def add(self, digest: bytes) -> None:
+        if self._building is not None:
+            self._building.append(digest)
+        if self._filter is None:
+            return
+        self._filter.add(digest)
+        self._report()
+        if self._filter.count > self._filter.capacity:
+            self.schedule_build()
+
+    def on_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            if tag.startswith(TAKEN_TAG_PREFIX):
+                self.add(bytes.fromhex(tag[len(TAKEN_TAG_PREFIX):]))
+
+    def on_flush(self) -> None:
+        # signups of other workers may have been missed, do not answer "free" until rebuilt
+        self._generation += 1
+        self._filter = None
+        self.schedule_build()
+
+    def schedule_build(self) -> Optional[asyncio.Task]:
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self.build())
+            except RuntimeError:
+                return None
+        return self._task
+
+    async def build(self) -> None:
+        """Reads every username and email into a new filter, sized for twice the current entries."""
+        while True:
+            generation = self._generation
+            self._building = building = []
+            try:
+                async with self.open_session() as session:
+                    users = (await session.execute(select(func.count()).select_from(User))).scalar_one()
+                    bloom = BloomFilter(max(2 * 2 * users, Config.AVAILABILITY_FILTER_CAPACITY),
+                                        Config.AVAILABILITY_FILTER_FALSE_POSITIVE_RATE)
+                    rows = await session.stream(
+                        select(User.username, User.email).execution_options(yield_per=BUILD_FETCH_SIZE)
+                    )
+                    async for username, email in rows:
+                        bloom.add(entry_digest("username", username))
+                        bloom.add(entry_digest("email", email))
+            except Exception:
+                logger.exception("Failed to build the availability filter")
+                return
+            finally:
+                self._building = None
+            if generation != self._generation:
+                continue
+            for digest in building:
+                bloom.add(digest)
+            self._filter = bloom
+            self._report()
+            logger.info("Availability filter built with %d entries in %d bytes", bloom.count, bloom.nbytes)
+            return
+
+    def _report(self) -> None:
+        AVAILABILITY_FILTER_BYTES.set(self._filter.nbytes)
+        AVAILABILITY_FILTER_ENTRIES.set(self._filter.count)
+        AVAILABILITY_FILTER_FALSE_POSITIVE_RATE.set(self._filter.false_positive_rate)
+
+
+availability_index = AvailabilityIndex(sessionmanager.session)
+
+invalidation_bus.subscribe(availability_index.on_tags, availability_index.on_flush)
@@ -0,0 +1,314 @@
+import abc
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from utils.prometheus_logging import INVALIDATION_FLUSHES, INVALIDATION_LAG, INVALIDATION_MESSAGES
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # the redis backend is optional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads are limited to 8000 bytes
+MAX_PAYLOAD_BYTES = 7500
+MAX_PENDING_TAGS = 10000
+# tags that could not be sent are retried this often, and on every connect
+PENDING_RETRY_SECONDS = 5.0
+
+TagsHandler = Callable[[Iterable[str]], None]
+FlushHandler = Callable[[], None]
+
+
+USER_TAG_PREFIX = "user:"
+
+
+def user_tag(user_id: uuid.UUID) -> str:
+    return f"{USER_TAG_PREFIX}{user_id}"
+
+
+def user_recipes_tag(user_id: uuid.UUID) -> str:
+    return f"user-recipes:{user_id}"
+
+
+class InvalidationBackend(abc.ABC):
+    """
+    Transport of invalidation messages between workers.
+    Calls `on_message` for every received payload and `on_connect` every time it is subscribed,
+    telling whether messages may have been missed: the connection was lost, or attempts to
+    connect failed while the worker was already running.
+    """
+
+    # seconds between connection attempts, doubled after every failure
+    reconnect_delay = 1.0
+    max_reconnect_delay = 30.0
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.on_message: Callable[[str], None] = lambda payload: None
+        self.on_connect: Callable[[bool], None] = lambda missed: None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: Callable[[str], None], on_connect: Callable[[bool], None]) -> None:
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @abc.abstractmethod
+    async def publish(self, payload: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def _listen(self, connected: Callable[[], None]) -> None:
+        """Subscribes, calls `connected` and returns once the connection is lost."""
+
+    async def _run_forever(self) -> None:
+        delay = self.reconnect_delay
+        missed = False
+
+        def connected() -> None:
+            nonlocal delay
+            delay = self.reconnect_delay
+            self.on_connect(missed)
+
+        while True:
+            try:
+                await self._listen(connected)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Invalidation bus connection failed: %s", e)
+            # whether it failed to connect or lost the connection, messages were published meanwhile
+            missed = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+class PostgresBackend(InvalidationBackend):
+    """LISTEN/NOTIFY on a dedicated asyncpg connection, outside of the SQLAlchemy pool."""
+
+    def __init__(self, database_url: str, channel: str):
+        super().__init__(channel)
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def _listen(self, connected: Callable[[], None]) -> None:
+        connection = await asyncpg.connect(self.dsn)
+        closed = asyncio.Event()
+        try:
+            connection.add_termination_listener(lambda conn: closed.set())
+            await connection.add_listener(self.channel, lambda conn, pid, channel, payload: self.on_message(payload))
+            self._connection = connection
+            connected()
+            await closed.wait()
+        finally:
+            self._connection = None
+            if not connection.is_closed():
+                await connection.close()
+
+    async def publish(self, payload: str) -> None:
+        if self._connection is None:
+            raise ConnectionError("Invalidation bus is not connected")
+        # one connection can run a single query at a time
+        async with self._lock:
+            await self._connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+
+class RedisBackend(InvalidationBackend):
+    """Pub/sub on any Redis-compatible server, requires the `redis` package."""
+
+    def __init__(self, redis_url: str, channel: str):
+        super().__init__(channel)
+        if aioredis is None:
+            raise RuntimeError("Install the redis package to use the redis invalidation bus backend")
+        self.client = aioredis.from_url(redis_url)
+
+    async def _listen(self, connected: Callable[[], None]) -> None:
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            connected()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    data = message["data"]
+                    self.on_message(data.decode() if isinstance(data, bytes) else data)
+        finally:
+            await pubsub.aclose()
+
+    async def publish(self, payload: str) -> None:
+        await self.client.publish(self.channel, payload)
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.client.aclose()
+
+
+class InvalidationBus:
+    """
+    Fans out cache invalidations to every worker.
+
+    Tags published on this worker are applied locally right away, then broadcast through the backend.
+    Subscribers of other workers receive them with the delivery lag recorded, and are flushed entirely
+    whenever the backend connects after messages may have been missed. Tags that could not be sent
+    are retried on every connect and every `retry_interval` seconds.
+    Without a backend the bus only works within this process.
+    """
+
+    def __init__(self, retry_interval: float = PENDING_RETRY_SECONDS):
+        self.origin = uuid.uuid4().hex
+        self.backend: Optional[InvalidationBackend] = None
+        self.retry_interval = retry_interval
+        self._subscribers: List[Tuple[TagsHandler, FlushHandler]] = []
+        self._pending: Set[str] = set()
+        self._pending_flush = False
+        self._retry: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self, on_tags: TagsHandler, on_flush: FlushHandler) -> None:
+        self._subscribers.append((on_tags, on_flush))
+
+    async def start(self, backend: InvalidationBackend) -> None:
+        self.backend = backend
+        await backend.start(self._receive, self._connected)
+
+    async def stop(self) -> None:
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        if self.backend is not None:
+            await self.backend.stop()
+            self.backend = None
+
+    def publish(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        self._deliver(tags)
+        if self.backend is None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._spawn(self._send(tags))
+
+    async def _send(self, tags: Set[str], flush: bool = False) -> None:
+        try:
+            if flush:
+                await self.backend.publish(self._encode([], flush=True))
+            for chunk in self._chunks(sorted(tags)):
+                await self.backend.publish(self._encode(chunk))
+                INVALIDATION_MESSAGES.labels(direction="sent").inc()
+        except Exception as e:
+            logger.warning("Failed to publish cache invalidation: %s", e)
+            self._pending_flush = self._pending_flush or flush or len(self._pending) + len(tags) > MAX_PENDING_TAGS
+            self._pending = set() if self._pending_flush else self._pending | tags
+            if self._retry is None and self.backend is not None:
+                self._retry = asyncio.get_running_loop().call_later(self.retry_interval, self._send_pending)
+
+    def _send_pending(self) -> None:
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        if self.backend is None or not (self._pending or self._pending_flush):
+            return
+        tags, flush = self._pending, self._pending_flush
+        self._pending, self._pending_flush = set(), False
+        self._spawn(self._send(tags, flush))
+
+    def _connected(self, missed: bool) -> None:
+        if missed:
+            # anything cached meanwhile may be outdated
+            INVALIDATION_FLUSHES.inc()
+            for _, on_flush in self._subscribers:
+                on_flush()
+        self._send_pending()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _receive(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Malformed cache invalidation message: %r", payload)
+            return
+        if message.get("o") == self.origin:
+            return
+        INVALIDATION_MESSAGES.labels(direction="received").inc()
+        INVALIDATION_LAG.observe(max(time.time() - message.get("ts", time.time()), 0))
+        if message.get("f"):
+            INVALIDATION_FLUSHES.inc()
+            for _, on_flush in self._subscribers:
+                on_flush()
+        self._deliver(message.get("t", ()))
+
+    def _deliver(self, tags: Iterable[str]) -> None:
+        tags = list(tags)
+        if not tags:
+            return
+        for on_tags, _ in self._subscribers:
+            on_tags(tags)
+
+    def _encode(self, tags: List[str], flush: bool = False) -> str:
+        message = {"o": self.origin, "ts": time.time(), "t": tags}
+        if flush:
+            message["f"] = True
+        return json.dumps(message)
+
+    @staticmethod
+    def _chunks(tags: List[str]):
+        chunk, size = [], 0
+        for tag in tags:
+            if chunk and size + len(tag) + 4 > MAX_PAYLOAD_BYTES - 100:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(tag)
+            size += len(tag) + 4
+        if chunk:
+            yield chunk
+
+
+invalidation_bus = InvalidationBus()
+
+
+def make_backend(kind: str, database_url: str, redis_url: Optional[str], channel: str) -> Optional[InvalidationBackend]:
+    if kind == "postgres":
+        return PostgresBackend(database_url, channel)
+    if kind == "redis":
+        if not redis_url:
+            raise RuntimeError("REDIS_URL is required for the redis invalidation bus backend")
+        return RedisBackend(redis_url, channel)
+    return None
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session) -> None:
+    # repositories collect tags while writing, they are published only once the data is committed
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        invalidation_bus.publish(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop("cache_tags", None)
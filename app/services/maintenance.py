@@ -0,0 +1,39 @@
+import asyncio
+from logging import getLogger
+from typing import Awaitable, Callable, List
+
+from app.database.session import sessionmanager
+from app.repository.idempotency_repo import IdempotencyRepository
+from app.repository.refresh_token_repo import RefreshTokenRepository
+from config import Config
+
+logger = getLogger(__name__)
+
+
+async def purge_idempotency_keys() -> None:
+    async with sessionmanager.session() as session:
+        purged = await IdempotencyRepository(session).purge_expired()
+    logger.info("Purged %d expired idempotency keys", purged)
+
+
+async def purge_refresh_tokens() -> None:
+    async with sessionmanager.session() as session:
+        purged = await RefreshTokenRepository(session).purge_expired()
+    logger.info("Purged %d expired refresh tokens", purged)
+
+
+# run by every worker, the jobs must be safe to run concurrently
+JOBS: List[Callable[[], Awaitable[None]]] = [purge_idempotency_keys, purge_refresh_tokens]
+
+
+async def run_periodically(job: Callable[[], Awaitable[None]], interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("Maintenance job %s failed", job.__name__)
+
+
+def start_maintenance() -> List[asyncio.Task]:
+    return [asyncio.create_task(run_periodically(job, Config.MAINTENANCE_INTERVAL_SECONDS)) for job in JOBS]
@@ -2,13 +2,14 @@ from fastapi import HTTPException, status
 
 from app.database.models import User, Role
 from app.repository.user_repo import ModeratorRepository
+from app.services.auth_services.dependencies import Principal
 
 
 class ModeratorService:
     def __init__(self, repository: ModeratorRepository):
         self.repository = repository
 
-    async def retrieve_user(self, current_user: User, username: str) -> User:
+    async def retrieve_user(self, current_user: Principal, username: str) -> User:
         if current_user.role == Role.user:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
         existing_user = await self.repository.get_user_by_username(username)
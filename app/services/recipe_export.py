@@ -0,0 +1,100 @@
+import uuid
+import zipfile
+from typing import AsyncContextManager, AsyncIterable, AsyncIterator, Callable
+
+import pydantic_core
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.repository.recipe_read_repo import RecipeReadRepository
+from app.schemas.responses.recipe_schema_resp import RecipeResponse
+from config import Config
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "zip": ("application/zip", "zip"),
+}
+
+_recipe_adapter = TypeAdapter(RecipeResponse)
+
+
+def dump_recipe(row) -> bytes:
+    return _recipe_adapter.dump_json(_recipe_adapter.validate_python(row, from_attributes=True))
+
+
+class _ZipSink:
+    """Write-only file collecting what ZipFile writes until it is drained, ZipFile sees it as unseekable."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def drain(self) -> bytes:
+        data, self._buffer = bytes(self._buffer), bytearray()
+        return data
+
+
+async def _json_array(items: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    separator = b"[\n"
+    async for item in items:
+        yield separator + item
+        separator = b",\n"
+    yield b"[]\n" if separator == b"[\n" else b"\n]\n"
+
+
+class RecipeExportService:
+    """
+    Streams a user's recipes without holding more than a fetch batch of rows and an output chunk.
+    The session is opened by the export itself, as it runs after the route handler has returned.
+    Chunks are produced only as fast as the client reads them.
+    """
+
+    def __init__(self, open_session: Callable[[], AsyncContextManager[AsyncSession]]):
+        self.open_session = open_session
+
+    async def export(self, user_id: uuid.UUID, export_format: str) -> AsyncIterator[bytes]:
+        async with self.open_session() as session:
+            repository = RecipeReadRepository(session)
+            chunks = self._ndjson(repository, user_id) if export_format == "ndjson" else self._zip(repository, user_id)
+            async for chunk in chunks:
+                yield chunk
+
+    async def _ndjson(self, repository: RecipeReadRepository, user_id: uuid.UUID) -> AsyncIterator[bytes]:
+        chunk = bytearray()
+        async for row in repository.stream_user_recipes(user_id):
+            chunk += dump_recipe(row) + b"\n"
+            if len(chunk) >= Config.RECIPE_EXPORT_CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk = bytearray()
+        if chunk:
+            yield bytes(chunk)
+
+    async def _zip(self, repository: RecipeReadRepository, user_id: uuid.UUID) -> AsyncIterator[bytes]:
+        """
+        recipes.json with the recipes and images.json, the manifest of their image URLs.
+        Entries are compressed as they are written, the archive uses data descriptors as it is never seeked.
+        Each entry is a pass over its own cursor, so no recipe is kept around for the manifest.
+        """
+        sink = _ZipSink()
+        entries = {
+            "recipes.json": (dump_recipe(row) async for row in repository.stream_user_recipes(user_id)),
+            "images.json": (pydantic_core.to_json({"recipe_id": recipe_id, "image_url": image_url})
+                            async for recipe_id, image_url in repository.stream_user_images(user_id)),
+        }
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, items in entries.items():
+                with archive.open(name, "w", force_zip64=True) as entry:
+                    async for data in _json_array(items):
+                        entry.write(data)
+                        if len(sink) >= Config.RECIPE_EXPORT_CHUNK_BYTES:
+                            yield sink.drain()
+        yield sink.drain()
@@ -0,0 +1,171 @@
+import codecs
+import csv
+import json
+import uuid
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+
+from app.database.models import Ingredient, Recipe, RecipeIngredient
+from app.repository.recipe_repo import RecipeRepository
+from app.schemas.requests.recipe_schema_req import RecipeCreate
+from config import Config
+
+IMPORT_FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = ("title", "description", "ingredients")
+
+# characters, a line without a line break past this length is not a recipe
+MAX_LINE_LENGTH = 1024 * 1024
+
+_LIMITS = {
+    "title": Recipe.__table__.c.title.type.length,
+    "name": Ingredient.__table__.c.name.type.length,
+    "quantity": RecipeIngredient.__table__.c.quantity.type.length,
+}
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Splits a UTF-8 byte stream into numbered lines, keeping only one line in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    buffer = ""
+    line_no = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line
+        if len(buffer) > MAX_LINE_LENGTH:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Line {line_no + 1} is too long")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield line_no + 1, buffer
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, Any]]:
+    """Yields (line number, raw JSON line), blank lines are skipped."""
+    async for line_no, line in iter_lines(chunks):
+        if line.strip():
+            yield line_no, line
+
+
+async def iter_csv(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yields (line number, row dict) of a CSV file with a `title,description,ingredients` header,
+    ingredients being a JSON array. Quoted values may span lines, the record's first line is reported.
+    """
+    header: Optional[List[str]] = None
+    record, record_line = "", 0
+    async for line_no, line in iter_lines(chunks):
+        record, record_line = (record + "\n" + line, record_line) if record else (line, line_no)
+        if record.count('"') % 2:
+            # inside a quoted value
+            continue
+        values, record = next(csv.reader([record.rstrip("\r")]), []), ""
+        if not any(values):
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            if not set(header) <= set(CSV_COLUMNS) or "title" not in header:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail=f"CSV header must be made of: {', '.join(CSV_COLUMNS)}")
+            continue
+        yield record_line, dict(zip(header, values))
+    if record:
+        yield record_line, ValueError("unterminated quoted value")
+
+
+def parse_recipe(raw: Any) -> RecipeCreate:
+    """
+    Validates one imported row with RecipeCreate, along with the constraints of the columns it goes to.
+    Raises ValidationError or ValueError.
+    """
+    if isinstance(raw, Exception):
+        raise raw
+    if isinstance(raw, str):
+        recipe = RecipeCreate.model_validate_json(raw)
+    else:
+        if raw.get("ingredients"):
+            raw["ingredients"] = json.loads(raw["ingredients"])
+        else:
+            raw["ingredients"] = []
+        raw["description"] = raw.get("description") or None
+        recipe = RecipeCreate.model_validate(raw)
+
+    problems = []
+    if len(recipe.title) > _LIMITS["title"]:
+        problems.append(f"title: at most {_LIMITS['title']} characters")
+    names = [ing.name for ing in recipe.ingredients]
+    if len(set(names)) != len(names):
+        problems.append("ingredients: names must be distinct")
+    for i, ing in enumerate(recipe.ingredients):
+        for field in ("name", "quantity"):
+            if len(getattr(ing, field)) > _LIMITS[field]:
+                problems.append(f"ingredients.{i}.{field}: at most {_LIMITS[field]} characters")
+    if problems:
+        raise ValueError("; ".join(problems))
+    return recipe
+
+
+def describe_error(e: Exception) -> List[str]:
+    if isinstance(e, ValidationError):
+        return [f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in e.errors()]
+    if isinstance(e, json.JSONDecodeError):
+        return [f"invalid JSON: {e.msg}"]
+    return [str(e)]
+
+
+class RecipeImportService:
+    def __init__(self, repository: RecipeRepository):
+        self.repository = repository
+
+    async def import_recipes(
+            self,
+            user_id: uuid.UUID,
+            chunks: AsyncIterable[bytes],
+            import_format: str,
+            chunk_size: int = Config.RECIPE_IMPORT_CHUNK_SIZE,
+            max_rows: int = Config.RECIPE_IMPORT_MAX_ROWS
+    ) -> Dict[str, Any]:
+        """
+        Imports recipes from an NDJSON or CSV stream.
+        Rows are validated and loaded in chunks of `chunk_size`, each chunk in its own transaction,
+        so memory stays flat and a failure does not lose the chunks already imported.
+        Invalid rows are skipped and reported with their line number.
+        """
+        iter_rows = iter_ndjson if import_format == "ndjson" else iter_csv
+        imported = failed = 0
+        errors: List[Dict[str, Any]] = []
+        chunk: List[RecipeCreate] = []
+
+        def reject(line_no: int, messages: List[str]) -> None:
+            nonlocal failed
+            failed += 1
+            if len(errors) < Config.RECIPE_IMPORT_MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "errors": messages})
+
+        async for line_no, raw in iter_rows(chunks):
+            if imported + len(chunk) >= max_rows:
+                reject(line_no, [f"at most {max_rows} recipes can be imported at once, the rest was skipped"])
+                break
+            try:
+                chunk.append(parse_recipe(raw))
+            except (ValidationError, ValueError) as e:
+                reject(line_no, describe_error(e))
+                continue
+            if len(chunk) == chunk_size:
+                imported += await self.flush(user_id, chunk)
+                chunk = []
+        if chunk:
+            imported += await self.flush(user_id, chunk)
+
+        return {"imported": imported, "failed": failed, "errors": errors}
+
+    async def flush(self, user_id: uuid.UUID, recipes: List[RecipeCreate]) -> int:
+        count = await self.repository.copy_recipes(user_id, recipes)
+        await self.repository.session.commit()
+        return count
@@ -1,22 +1,37 @@
+import base64
+import binascii
 import uuid
 import filetype
 import cloudinary
 import cloudinary.uploader
 
-from typing import Optional, IO
+from typing import Any, Collection, Dict, List, Optional, IO, Set
 from fastapi import HTTPException, status, UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 
-from app.database.models import Recipe, User
+from app.database.models import Recipe, Role
+from app.repository.recipe_read_repo import RecipeReadRepository
 from app.repository.recipe_repo import RecipeRepository
 from app.schemas.requests.recipe_schema_req import RecipeUpdate
+from app.services.auth_services.dependencies import Principal
 
 
 class RecipeService:
     def __init__(self, repository: RecipeRepository):
         self.repository = repository
 
-    async def update_recipe(self, recipe_id: uuid.UUID, payload: RecipeUpdate, current_user: User) -> Recipe:
+    async def update_recipe(
+            self,
+            recipe_id: uuid.UUID,
+            payload: RecipeUpdate,
+            current_user: Principal,
+            expected_versions: Optional[Set[int]] = None
+    ) -> Recipe:
+        """
+        The update only applies to the version it was read at: a concurrent write in between,
+        or a version other than `expected_versions` (from If-Match), fails with 412.
+        """
         recipe = await self.repository.get_recipe_by_id(recipe_id)
 
         if not recipe:
@@ -25,6 +40,8 @@ class RecipeService:
         if recipe.user_id != current_user.user_id:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="You can't modify others' recipes")
 
+        check_version(recipe, expected_versions)
+
         if "title" in payload.model_fields_set and payload.title is None:
             raise HTTPException(
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -38,6 +55,9 @@ class RecipeService:
                     detail="Recipe must contain at least one ingredient"
                 )
 
+        await self.repository.lock_changes(recipe.user_id)
+        # before update_ingredients may flush, so the row is never written without its version bump
+        self.repository.touch(recipe)
         simple_data = payload.model_dump(exclude_unset=True, exclude={"ingredients", "recipe_id"})
         for field, val in simple_data.items():
             setattr(recipe, field, val)
@@ -46,7 +66,7 @@ class RecipeService:
             await self.repository.update_ingredients(recipe, payload.ingredients)
 
         self.repository.session.add(recipe)
-        await self.repository.session.commit()
+        await commit_versioned(self.repository.session)
         await self.repository.session.refresh(recipe)
         return recipe
 
@@ -54,14 +74,16 @@ class RecipeService:
             self,
             recipe_id: uuid.UUID,
             file: Optional[UploadFile],
-            current_user: User,
-            session: AsyncSession
+            current_user: Principal,
+            session: AsyncSession,
+            expected_versions: Optional[Set[int]] = None
     ) -> (Recipe, str):
         recipe = await self.repository.get_recipe_by_id(recipe_id)
         if not recipe:
             raise HTTPException(status_code=404, detail="Recipe not found")
         if recipe.user_id != current_user.user_id:
             raise HTTPException(status_code=403, detail="You can't modify others' recipes")
+        check_version(recipe, expected_versions)
 
         if file:
             validate_file_size_type(file)
@@ -70,18 +92,121 @@ class RecipeService:
             print(file)
             result = cloudinary.uploader.upload(file.file)
             image_url = result["secure_url"]
-            recipe.image_url = image_url
             action = "updated"
         else:
             # Удаляем фото
-            recipe.image_url = None
+            image_url = None
             action = "removed"
+        await self.repository.lock_changes(recipe.user_id)
+        self.repository.touch(recipe)
+        recipe.image_url = image_url
 
         session.add(recipe)
-        await session.commit()
+        await commit_versioned(session)
         await session.refresh(recipe)
         return recipe, action
 
+    async def delete_recipe(
+            self,
+            recipe_id: uuid.UUID,
+            current_user: Principal,
+            expected_versions: Optional[Set[int]] = None
+    ) -> None:
+        recipe = await self.repository.get_recipe_by_id(recipe_id)
+        if not recipe:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
+        if recipe.user_id != current_user.user_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can't delete others' recipes")
+        check_version(recipe, expected_versions)
+
+        try:
+            await self.repository.delete_recipe(recipe)
+        except StaleDataError:
+            await self.repository.session.rollback()
+            raise recipe_changed()
+        await self.repository.session.commit()
+
+
+class RecipeReadService:
+    def __init__(self, repository: RecipeReadRepository):
+        self.repository = repository
+
+    async def batch_get(
+            self,
+            recipe_ids: List[uuid.UUID],
+            current_user: Principal,
+            fields: Optional[Collection[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Resolves many recipes in one query and answers in request order.
+        Recipes of deactivated authors are reported as not found, except to their owner and to staff.
+        """
+        staff = current_user.role in (Role.moderator, Role.admin)
+        recipes = await self.repository.fetch_visible_recipes(
+            set(recipe_ids), current_user.user_id, include_inactive_authors=staff, fields=fields
+        )
+        return [
+            {"recipe_id": recipe_id, "found": recipe_id in recipes, "recipe": recipes.get(recipe_id)}
+            for recipe_id in recipe_ids
+        ]
+
+    async def changes_since(self, current_user: Principal, token: Optional[str], limit: int) -> Dict[str, Any]:
+        """
+        Delta sync of the user's recipes: what was created, updated or deleted after the sync token,
+        oldest change first. Pages end at `limit` changes, `next_token` resumes after the last one.
+        Without a token, the whole library is returned and deletions are skipped,
+        as the client has nothing to delete yet.
+        """
+        since = decode_sync_token(token) if token else 0
+        recipes = await self.repository.fetch_user_changes(current_user.user_id, since, limit + 1)
+        tombstones = []
+        if since:
+            tombstones = await self.repository.fetch_user_tombstones(current_user.user_id, since, limit + 1)
+
+        changes = sorted([(recipe.change_seq, recipe) for recipe in recipes] +
+                         [(change_seq, recipe_id) for recipe_id, change_seq in tombstones],
+                         key=lambda change: change[0])
+        page = changes[:limit]
+        return {
+            "changed": [change for _, change in page if not isinstance(change, uuid.UUID)],
+            "deleted": [change for _, change in page if isinstance(change, uuid.UUID)],
+            "next_token": encode_sync_token(page[-1][0] if page else since),
+            "has_more": len(changes) > limit,
+        }
+
+
+def recipe_changed() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                         detail="Recipe was changed by another request, fetch it again")
+
+
+def check_version(recipe: Recipe, expected_versions: Optional[Set[int]]) -> None:
+    if expected_versions is not None and recipe.version not in expected_versions:
+        raise recipe_changed()
+
+
+async def commit_versioned(session: AsyncSession) -> None:
+    """Commits a recipe write, whose UPDATE matches no row if the version changed since the recipe was read."""
+    try:
+        await session.commit()
+    except StaleDataError:
+        await session.rollback()
+        raise recipe_changed()
+
+
+def encode_sync_token(change_seq: int) -> str:
+    return base64.urlsafe_b64encode(f"v1:{change_seq}".encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> int:
+    try:
+        version, change_seq = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().split(":")
+        if version != "v1" or int(change_seq) < 0:
+            raise ValueError(token)
+        return int(change_seq)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+
 
 def validate_file_size_type(file: UploadFile):
     FILE_SIZE = 2097152  # 2MB
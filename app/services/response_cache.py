@@ -0,0 +1,152 @@
+import collections
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, Optional, OrderedDict, Set
+
+from app.services.invalidation_bus import invalidation_bus
+from app.services.single_flight import SingleFlight
+from config import Config
+from utils.prometheus_logging import RESPONSE_CACHE_BYTES, RESPONSE_CACHE_REQUESTS
+
+
+@dataclass
+class CachedBody:
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+    tags: FrozenSet[str] = frozenset()
+    expires_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class _InvalidationWatch:
+    """What was invalidated while an entry was being computed."""
+
+    def __init__(self) -> None:
+        self.tags: Set[str] = set()
+        self.flushed = False
+
+    def outdates(self, entry: CachedBody) -> bool:
+        return self.flushed or not self.tags.isdisjoint(entry.tags)
+
+
+class ResponseCache:
+    """
+    Process-local cache of serialized responses.
+
+    Entries expire after their TTL and the least recently used ones are evicted once the bodies
+    exceed `max_bytes`. Concurrent misses of one key are coalesced, so only the first caller computes.
+    Entries are dropped by tag when the data they were built from changes, and an entry whose tags
+    were invalidated while it was being computed is not stored.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, CachedBody] = collections.OrderedDict()
+        self._tags: Dict[str, Set[str]] = collections.defaultdict(set)
+        self._flights: SingleFlight[CachedBody] = SingleFlight()
+        self._watches: Set[_InvalidationWatch] = set()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self.clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CachedBody, ttl: Optional[float] = None) -> None:
+        if entry.size > self.max_bytes:
+            return
+        self._remove(key)
+        entry.expires_at = self.clock() + (self.default_ttl if ttl is None else ttl)
+        self._entries[key] = entry
+        self._size += entry.size
+        for tag in entry.tags:
+            self._tags[tag].add(key)
+        while self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        RESPONSE_CACHE_BYTES.set(self._size)
+
+    async def get_or_compute(
+            self,
+            key: str,
+            compute: Callable[[], Awaitable[CachedBody]],
+            ttl: Optional[float] = None
+    ) -> CachedBody:
+        """
+        Returns the cached entry or computes it once for all concurrent callers of the same key.
+        If the computing caller is cancelled, one of the waiters takes over.
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                RESPONSE_CACHE_REQUESTS.labels(result="hit").inc()
+                return entry
+
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            RESPONSE_CACHE_REQUESTS.labels(result="coalesced").inc()
+            finished, entry = await self._flights.wait(flight)
+            if finished:
+                return entry
+
+        RESPONSE_CACHE_REQUESTS.labels(result="miss").inc()
+
+        async def compute_and_store() -> CachedBody:
+            watch = _InvalidationWatch()
+            self._watches.add(watch)
+            try:
+                entry = await compute()
+            finally:
+                self._watches.discard(watch)
+            if not watch.outdates(entry):
+                self.set(key, entry, ttl)
+            return entry
+
+        return await self._flights.lead(key, compute_and_store)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        for watch in self._watches:
+            watch.tags |= tags
+        for tag in tags:
+            for key in list(self._tags.pop(tag, ())):
+                self._remove(key)
+        RESPONSE_CACHE_BYTES.set(self._size)
+
+    def clear(self) -> None:
+        for watch in self._watches:
+            watch.flushed = True
+        self._entries.clear()
+        self._tags.clear()
+        self._size = 0
+        RESPONSE_CACHE_BYTES.set(0)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+response_cache = ResponseCache(
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    default_ttl=Config.RESPONSE_CACHE_TTL_SECONDS,
+)
+
+invalidation_bus.subscribe(response_cache.invalidate_tags, response_cache.clear)
@@ -0,0 +1,62 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class Flight(Generic[T]):
+    future: "asyncio.Future[T]"
+    # whatever the leader registered the call with, e.g. a fingerprint waiters must match
+    info: Any = None
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls per key: the first caller leads and computes, the others wait for
+    its result. If the leader is cancelled, its waiters are woken up and one of them leads anew.
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, Flight[T]] = {}
+
+    def get(self, key: Hashable) -> Optional[Flight[T]]:
+        return self._flights.get(key)
+
+    async def wait(self, flight: Flight[T]) -> Tuple[bool, Optional[T]]:
+        """
+        Waits for a call in flight, the waiter's own cancellation does not cancel it.
+
+        :return: whether the call finished and its result, False when its leader was cancelled
+        :raises: whatever the call raised
+        """
+        try:
+            return True, await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if not flight.future.cancelled() or asyncio.current_task().cancelling():
+                raise
+            return False, None
+
+    async def lead(self, key: Hashable, compute: Callable[[], Awaitable[T]], info: Any = None) -> T:
+        """
+        Computes the result of `key` for every caller waiting on it. Check with `get` that no call
+        of the key is in flight first.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # nobody may be waiting, keep asyncio from reporting an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = Flight(future, info)
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._flights.pop(key, None)
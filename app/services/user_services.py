@@ -1,10 +1,18 @@
 import datetime
+from typing import Dict, Optional
 
 from fastapi import HTTPException, status
+from pydantic.networks import validate_email
+from pydantic_core import PydanticCustomError
 
 from app.database.models import User, Role
 from app.repository.user_repo import UserRepository
 from app.schemas.requests.user_schema_req import UserUpdate, UserCreate
+from app.services.auth_services.admission import run_hash
+from app.services.auth_services.dependencies import Principal
+from app.services.auth_services.hashing import Hasher
+from app.services.availability import availability_index
+from utils.prometheus_logging import AVAILABILITY_CHECKS
 
 
 class UserService:
@@ -12,16 +20,59 @@ class UserService:
         self.repository = repository
 
     async def create_account(self, create_params: UserCreate) -> User:
+        """
+        Inserts the user in one statement, uniqueness is left to the constraints.
+        Only on a conflict is the taken field looked up, to tell which one it is.
+        """
         dict_params = create_params.model_dump(exclude_unset=True)
-        existing_username = await self.repository.get_user_by_username(dict_params["username"])
-        if existing_username:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail="User with this username already exists")
-        existing_email = await self.repository.get_user_by_username(dict_params["email"])
-        if existing_email:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail="User with this username email exists")
-        return await self.repository.create_user(dict_params)
+        dict_params["hashed_password"] = await run_hash(Hasher.get_password_hash, dict_params.pop("password"))
+        user = await self.repository.create_user(dict_params)
+        if user is not None:
+            return user
+
+        taken = await self.repository.get_taken_fields(dict_params["username"], dict_params["email"])
+        if "email" in taken:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User with this email already exists")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User with this username already exists")
+
+    async def check_availability(self, username: Optional[str], email: Optional[str]) -> Dict[str, bool]:
+        """
+        Tells whether a username and an email can still be signed up with.
+        Values the availability filter has never seen are free without a query, the others
+        and all values while the filter is not built are looked up on the unique indexes.
+
+        :return: availability of the fields that were given
+        """
+        values = {field: value for field, value in (("username", username), ("email", email)) if value is not None}
+        if not values:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Username or email is required")
+        if "email" in values:
+            try:
+                # stored the way signup's EmailStr normalizes it
+                values["email"] = validate_email(values["email"])[1]
+            except PydanticCustomError:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid email")
+
+        available: Dict[str, bool] = {}
+        filtered: Dict[str, Optional[bool]] = {}
+        for field, value in values.items():
+            filtered[field] = availability_index.might_be_taken(field, value)
+            if filtered[field] is False:
+                available[field] = True
+                AVAILABILITY_CHECKS.labels(field=field, result="free").inc()
+
+        unsure = {field: value for field, value in values.items() if field not in available}
+        if unsure:
+            taken = await self.repository.get_taken_fields(unsure.get("username"), unsure.get("email"))
+            for field in unsure:
+                available[field] = field not in taken
+                if field in taken:
+                    result = "taken"
+                else:
+                    result = "unfiltered" if filtered[field] is None else "false_positive"
+                AVAILABILITY_CHECKS.labels(field=field, result=result).inc()
+        return available
 
     async def get_user_info(self, current_user: User, username: str) -> User:
         if not username or username in {current_user.username, current_user.email}:
@@ -35,7 +86,7 @@ class UserService:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
         return user
 
-    async def update_user(self, current_user: User, user_update: UserUpdate) -> User:
+    async def update_user(self, current_user: Principal, user_update: UserUpdate) -> User:
         dict_params = user_update.model_dump(exclude_unset=True)
         updated_user = await self.repository.update_active_user_by_user_id(current_user.user_id, dict_params)
         if not updated_user:
@@ -0,0 +1,69 @@
+"""
+Password hashing throughput for a range of bcrypt and argon2id settings, to weigh a cost against login capacity.
+
+"latency" is the median time of one hash. "1 thread" is the rate of hashing back to back, the rate of one core.
+"all cores" hashes from one thread per core at once, both backends release the GIL, and "per core" divides it
+by the number of cores. argon2 settings are skipped when argon2-cffi is not installed.
+
+    python -m benchmarks.bench_hashing
+"""
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
+
+from app.services.auth_services.hashing import make_password_context
+
+PASSWORD = "Benchmark1234"
+SAMPLES = 5
+# name, scheme, bcrypt rounds, argon2 time cost, argon2 memory in KiB, argon2 parallelism
+SETTINGS: List[Tuple[str, str, int, int, int, int]] = [
+    ("bcrypt rounds=10", "bcrypt", 10, 0, 0, 1),
+    ("bcrypt rounds=11", "bcrypt", 11, 0, 0, 1),
+    ("bcrypt rounds=12", "bcrypt", 12, 0, 0, 1),
+    ("bcrypt rounds=13", "bcrypt", 13, 0, 0, 1),
+    ("argon2id t=2 m=19MiB p=1", "argon2", 0, 2, 19 * 1024, 1),
+    ("argon2id t=3 m=64MiB p=1", "argon2", 0, 3, 64 * 1024, 1),
+    ("argon2id t=4 m=64MiB p=1", "argon2", 0, 4, 64 * 1024, 1),
+    ("argon2id t=1 m=256MiB p=4", "argon2", 0, 1, 256 * 1024, 4),
+]
+
+
+def hash_many(context: CryptContext, count: int) -> List[float]:
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        context.hash(PASSWORD)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run() -> None:
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores")
+    print(f"{'setting':<28} {'latency':>10} {'1 thread':>12} {'all cores':>12} {'per core':>12}")
+    with ThreadPoolExecutor(max_workers=cores) as pool:
+        for name, scheme, rounds, time_cost, memory_cost, parallelism in SETTINGS:
+            context = make_password_context(scheme, rounds or 4, time_cost or 1, memory_cost or 1024, parallelism)
+            try:
+                # the first hash loads the backend
+                context.hash(PASSWORD)
+                latency = statistics.median(hash_many(context, SAMPLES))
+            except MissingBackendError:
+                print(f"{name:<28} skipped, argon2-cffi is not installed")
+                continue
+
+            started = time.perf_counter()
+            list(pool.map(lambda _: hash_many(context, SAMPLES), range(cores)))
+            all_cores = cores * SAMPLES / (time.perf_counter() - started)
+
+            print(f"{name:<28} {latency * 1000:>7.1f} ms {1 / latency:>8.1f} h/s {all_cores:>8.1f} h/s "
+                  f"{all_cores / cores:>8.1f} h/s")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,96 @@
+"""
+Throughput of importing a cookbook one recipe at a time versus the bulk import.
+
+"per recipe" is what a client looping over POST /profile/my-recipes/upload costs: create_recipe,
+the re-fetch, one lookup per ingredient and a commit for every recipe. "bulk" is RecipeImportService
+on an NDJSON stream: chunked validation, COPY into staging tables and set-based merges.
+
+Needs a migrated database, TEST_DATABASE_URL is used. The seeded user and recipes are removed afterwards.
+
+    python -m benchmarks.bench_import
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator, List
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database.models import Ingredient, Recipe, RecipeIngredient, User
+from app.repository.recipe_repo import RecipeRepository
+from app.schemas.requests.recipe_schema_req import RecipeCreate
+from app.services.recipe_import import RecipeImportService
+from config import Config
+
+PER_RECIPE = 200
+BULK = 5000
+INGREDIENTS = 8
+
+
+def cookbook(prefix: str, count: int) -> List[dict]:
+    return [
+        {"title": f"Recipe {i}", "description": "Mix everything, bake for 40 minutes and serve warm.",
+         "ingredients": [{"name": f"{prefix} {(i + j) % 40}", "quantity": f"{j + 1} g"} for j in range(INGREDIENTS)]}
+        for i in range(count)
+    ]
+
+
+async def ndjson(recipes: List[dict]) -> AsyncIterator[bytes]:
+    lines = [json.dumps(recipe).encode() + b"\n" for recipe in recipes]
+    for start in range(0, len(lines), 100):
+        yield b"".join(lines[start:start + 100])
+
+
+async def per_recipe(session: AsyncSession, user_id: uuid.UUID, recipes: List[dict]) -> None:
+    repository = RecipeRepository(session)
+    for data in recipes:
+        body = RecipeCreate.model_validate(data)
+        recipe = await repository.create_recipe(user_id=user_id, body=body)
+        await repository.add_ingredients(recipe=recipe, ingredients_data=body.ingredients)
+        await session.commit()
+
+
+async def bulk(session: AsyncSession, user_id: uuid.UUID, recipes: List[dict]) -> None:
+    report = await RecipeImportService(RecipeRepository(session)).import_recipes(user_id, ndjson(recipes), "ndjson")
+    assert report["imported"] == len(recipes), report
+
+
+async def cleanup(session: AsyncSession, user_id: uuid.UUID, prefix: str) -> None:
+    recipe_ids = select(Recipe.recipe_id).where(Recipe.user_id == user_id)
+    await session.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(recipe_ids)))
+    await session.execute(delete(Recipe).where(Recipe.user_id == user_id))
+    await session.execute(delete(Ingredient).where(Ingredient.name.like(f"{prefix} %")))
+    await session.execute(delete(User).where(User.user_id == user_id))
+    await session.commit()
+
+
+async def run() -> None:
+    engine = create_async_engine(Config.TEST_DATABASE_URL)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    user_id = uuid.uuid4()
+    prefix = f"bench ingredient {user_id.hex[:8]}"
+    async with session_maker() as session:
+        await session.execute(insert(User).values(
+            user_id=user_id, username=f"bench-{user_id.hex[:12]}", email=f"{user_id.hex[:12]}@bench.example",
+        ))
+        await session.commit()
+    try:
+        paths = {"per recipe": (per_recipe, PER_RECIPE), "bulk": (bulk, BULK)}
+        print(f"recipes with {INGREDIENTS} ingredients each")
+        print(f"{'path':>12} {'recipes':>8} {'seconds':>8} {'recipes/s':>10}")
+        for name, (load, count) in paths.items():
+            async with session_maker() as session:
+                started = time.perf_counter()
+                await load(session, user_id, cookbook(prefix, count))
+                elapsed = time.perf_counter() - started
+            print(f"{name:>12} {count:>8} {elapsed:>8.2f} {count / elapsed:>10.0f}")
+    finally:
+        async with session_maker() as session:
+            await cleanup(session, user_id, prefix)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
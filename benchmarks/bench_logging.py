@@ -0,0 +1,113 @@
+"""
+Log throughput and event loop impact of a plain StreamHandler versus the queue pipeline.
+
+The stream sleeps on every write to mimic a slow consumer of stdout (a full pipe, a busy log shipper).
+Loop lag is the worst delay of a 1 ms ticker running next to a coroutine that logs in bursts.
+
+    python -m benchmarks.bench_logging
+"""
+import asyncio
+import io
+import logging
+import time
+
+from utils.logging_pipeline import EndpointFilter, setup_logging
+
+RECORDS = 20000
+BURSTS = 50
+BURST_SIZE = 20
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, write_delay: float) -> None:
+        super().__init__()
+        self.write_delay = write_delay
+
+    def write(self, s: str) -> int:
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        return len(s)
+
+
+def configure(pipeline: bool, write_delay: float):
+    stream = SlowStream(write_delay)
+    if pipeline:
+        return setup_logging("bench", fmt="json", max_queue_size=RECORDS * 2, stream=stream)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] - %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    return None
+
+
+def throughput(logger: logging.Logger) -> float:
+    started = time.perf_counter()
+    for i in range(RECORDS):
+        logger.info("recipe %s fetched for user %s", i, "johndoe")
+    return RECORDS / (time.perf_counter() - started)
+
+
+async def loop_lag(logger: logging.Logger) -> float:
+    worst = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal worst
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            worst = max(worst, time.perf_counter() - before - 0.001)
+
+    task = asyncio.create_task(ticker())
+    for _ in range(BURSTS):
+        for i in range(BURST_SIZE):
+            logger.error("request failed: %s", i)
+        await asyncio.sleep(0.002)
+    done = True
+    await task
+    return worst
+
+
+def filter_cost() -> tuple[float, float]:
+    record = logging.LogRecord(
+        "uvicorn.access", logging.INFO, "", 0, '%s - "%s %s HTTP/%s" %d',
+        ("127.0.0.1:5000", "GET", "/profile/my-recipes?fields=title", "1.1", 200), None
+    )
+
+    def by_message(r: logging.LogRecord) -> bool:
+        return r.getMessage().find("GET /metrics") == -1
+
+    results = []
+    for check in (by_message, EndpointFilter().filter):
+        started = time.perf_counter()
+        for _ in range(100000):
+            check(record)
+        results.append((time.perf_counter() - started) / 100000)
+    return results[0], results[1]
+
+
+def main() -> None:
+    logger = logging.getLogger("bench")
+    print(f"{'handler':>10} {'write delay':>12} {'records/s':>12} {'max loop lag':>14}")
+    for write_delay in (0.0, 0.0005):
+        for pipeline in (False, True):
+            listener = configure(pipeline, write_delay)
+            rate = throughput(logger) if write_delay == 0 else float("nan")
+            if listener is not None:
+                listener.stop()
+                listener = configure(pipeline, write_delay)
+            lag = asyncio.run(loop_lag(logger))
+            if listener is not None:
+                listener.stop()
+            name = "queue" if pipeline else "stream"
+            print(f"{name:>10} {write_delay * 1000:>10.1f}ms {rate:>12.0f} {lag * 1000:>12.2f}ms")
+
+    by_message, by_args = filter_cost()
+    print(f"access log filter: getMessage() {by_message * 1e9:.0f} ns, record args {by_args * 1e9:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Memory and throughput of listing a user's recipes through the ORM versus the read model.
+
+"orm" is RecipeRepository.fetch_all_user_recipes: Recipe, RecipeIngredient and Ingredient objects
+tracked by the identity map, loaded with selectinload. "read model" is RecipeReadRepository: one query
+with ingredients aggregated by json_agg into __slots__ rows. Both feed the same serializer.
+
+Needs a migrated database, TEST_DATABASE_URL is used. The seeded user and recipes are removed afterwards.
+
+    python -m benchmarks.bench_read_model
+"""
+import asyncio
+import statistics
+import time
+import tracemalloc
+import uuid
+from typing import Awaitable, Callable, List, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database.models import Ingredient, Recipe, RecipeIngredient, User
+from app.repository.recipe_read_repo import RecipeReadRepository
+from app.repository.recipe_repo import RecipeRepository
+from app.routes.serialization import dump_envelope
+from app.schemas.responses.recipe_schema_resp import RecipeResponse
+from config import Config
+
+RECIPES = 500
+INGREDIENTS = 8
+REQUESTS = 50
+
+
+async def seed(session: AsyncSession) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    await session.execute(insert(User).values(
+        user_id=user_id, username=f"bench-{user_id.hex[:12]}", email=f"{user_id.hex[:12]}@bench.example",
+    ))
+    names = [f"bench ingredient {user_id.hex[:8]} {i}" for i in range(INGREDIENTS * 4)]
+    ingredient_ids = (await session.execute(
+        insert(Ingredient).returning(Ingredient.ingredient_id), [{"name": name} for name in names]
+    )).scalars().all()
+    recipe_ids = [uuid.uuid4() for _ in range(RECIPES)]
+    await session.execute(insert(Recipe), [
+        {"recipe_id": recipe_id, "user_id": user_id, "title": f"Recipe {i}",
+         "description": "Mix everything, bake for 40 minutes and serve warm."}
+        for i, recipe_id in enumerate(recipe_ids)
+    ])
+    await session.execute(insert(RecipeIngredient), [
+        {"recipe_id": recipe_id, "ingredient_id": ingredient_ids[(i + j) % len(ingredient_ids)],
+         "quantity": f"{j + 1} g"}
+        for i, recipe_id in enumerate(recipe_ids) for j in range(INGREDIENTS)
+    ])
+    await session.commit()
+    return user_id
+
+
+async def cleanup(session: AsyncSession, user_id: uuid.UUID) -> None:
+    recipe_ids = select(Recipe.recipe_id).where(Recipe.user_id == user_id)
+    await session.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(recipe_ids)))
+    await session.execute(delete(Recipe).where(Recipe.user_id == user_id))
+    await session.execute(delete(Ingredient).where(Ingredient.name.like(f"bench ingredient {user_id.hex[:8]} %")))
+    await session.execute(delete(User).where(User.user_id == user_id))
+    await session.commit()
+
+
+async def measure(
+        session_maker: async_sessionmaker,
+        fetch: Callable[[AsyncSession], Awaitable[Sequence]]
+) -> tuple[float, float]:
+    timings: List[float] = []
+    peaks: List[int] = []
+    for _ in range(REQUESTS):
+        async with session_maker() as session:
+            tracemalloc.start()
+            started = time.perf_counter()
+            body = dump_envelope(List[RecipeResponse], await fetch(session), "User recipes fetched")
+            timings.append(time.perf_counter() - started)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            assert body
+    return statistics.median(timings), statistics.median(peaks)
+
+
+async def run() -> None:
+    engine = create_async_engine(Config.TEST_DATABASE_URL)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        user_id = await seed(session)
+    try:
+        paths = {
+            "orm": lambda session: RecipeRepository(session).fetch_all_user_recipes(user_id),
+            "read model": lambda session: RecipeReadRepository(session).fetch_user_recipes(user_id),
+        }
+        print(f"{RECIPES} recipes x {INGREDIENTS} ingredients, median of {REQUESTS} requests")
+        print(f"{'path':>12} {'ms/request':>12} {'requests/s':>12} {'peak KiB':>10}")
+        for name, fetch in paths.items():
+            await measure(session_maker, fetch)  # warm up the connection and statement caches
+            latency, peak = await measure(session_maker, fetch)
+            print(f"{name:>12} {latency * 1000:>12.2f} {1 / latency:>12.1f} {peak / 1024:>10.0f}")
+    finally:
+        async with session_maker() as session:
+            await cleanup(session, user_id)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
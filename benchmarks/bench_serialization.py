@@ -0,0 +1,102 @@
+"""
+Serialization cost of read_my_recipes with 500 recipes, before and after the fast response path.
+
+"legacy" builds RecipeResponse models, wraps them in APIResponse and lets FastAPI validate the result
+against response_model and encode it with jsonable_encoder and json.dumps.
+"fast" validates the ORM objects into APIResponse[List[RecipeResponse]] once and dumps it straight to bytes.
+Both routes serve the same transient ORM objects through httpx's ASGI transport, so no database is involved.
+
+    python -m benchmarks.bench_serialization
+"""
+import asyncio
+import statistics
+import time
+import uuid
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+from app.database.models import Ingredient, Recipe, RecipeIngredient
+from app.routes.serialization import api_response, dump_envelope
+from app.schemas.responses.api_schema_resp import APIResponse
+from app.schemas.responses.recipe_schema_resp import RecipeResponse
+
+RECIPES = 500
+INGREDIENTS = 8
+REQUESTS = 200
+ROUNDS = 5
+
+
+def make_recipes() -> List[Recipe]:
+    user_id = uuid.uuid4()
+    ingredients = [Ingredient(ingredient_id=i, name=f"ingredient {i}") for i in range(INGREDIENTS * 4)]
+    recipes = []
+    for i in range(RECIPES):
+        recipe = Recipe(
+            recipe_id=uuid.uuid4(),
+            user_id=user_id,
+            title=f"Recipe {i}",
+            description="Mix everything, bake for 40 minutes and serve warm. " * 3,
+            version=1,
+            image_url=f"https://res.cloudinary.com/demo/image/upload/{uuid.uuid4()}.jpg",
+        )
+        recipe.ingredients = [
+            RecipeIngredient(ingredient=ingredients[(i + j) % len(ingredients)], quantity=f"{j + 1} g")
+            for j in range(INGREDIENTS)
+        ]
+        recipes.append(recipe)
+    return recipes
+
+
+def make_app(recipes: List[Recipe]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy", response_model=APIResponse)
+    async def legacy():
+        return APIResponse(
+            success=True,
+            data=[RecipeResponse.model_validate(r) for r in recipes],
+            message="User recipes fetched",
+        )
+
+    @app.get("/fast", response_model=APIResponse[List[RecipeResponse]])
+    async def fast():
+        return api_response(List[RecipeResponse], recipes, "User recipes fetched")
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str) -> float:
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        response = await client.get(path)
+        response.raise_for_status()
+    return (time.perf_counter() - started) / REQUESTS
+
+
+async def run() -> None:
+    recipes = make_recipes()
+    app = make_app(recipes)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        legacy_body = (await client.get("/legacy")).json()
+        fast_body = (await client.get("/fast")).json()
+        assert legacy_body == fast_body, "both paths must produce the same payload"
+
+        results = {"legacy": [], "fast": []}
+        for _ in range(ROUNDS):
+            for path in results:
+                results[path].append(await measure(client, f"/{path}"))
+
+    size = len(dump_envelope(List[RecipeResponse], recipes, "User recipes fetched"))
+    print(f"{RECIPES} recipes x {INGREDIENTS} ingredients, {size / 1024:.0f} KiB per response")
+    print(f"{'path':>8} {'ms/request':>12}")
+    for path, timings in results.items():
+        print(f"{path:>8} {statistics.median(timings) * 1000:>12.2f}")
+    saved = statistics.median(results["legacy"]) - statistics.median(results["fast"])
+    print(f"saved {saved * 1000:.2f} ms per request ({saved / statistics.median(results['legacy']):.0%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
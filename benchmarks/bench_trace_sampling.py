@@ -0,0 +1,84 @@
+"""
+Request overhead of OpenTelemetry tracing at different head sampling rates.
+
+Runs an instrumented FastAPI app in-process through httpx's ASGI transport and exports spans
+into an exporter that discards them, so the numbers show the SDK cost, not the network.
+"tail" rows record unsampled traces so that failing and slow ones can still be kept,
+"head" rows drop them at the sampler.
+
+    python -m benchmarks.bench_trace_sampling
+"""
+import asyncio
+import statistics
+import time
+from typing import Optional, Sequence
+
+import httpx
+from fastapi import FastAPI
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from utils.tracing import CountingBatchSpanProcessor, TailSamplingSpanProcessor, make_sampler
+
+REQUESTS = 2000
+ROUNDS = 5
+
+
+class DiscardingExporter(SpanExporter):
+    def __init__(self) -> None:
+        self.exported = 0
+
+    def export(self, spans: Sequence) -> SpanExportResult:
+        self.exported += len(spans)
+        return SpanExportResult.SUCCESS
+
+
+def build_app(sample_rate: Optional[float], tail: bool = True) -> tuple[FastAPI, Optional[TracerProvider]]:
+    app = FastAPI()
+
+    @app.get("/recipes/{recipe_id}")
+    async def read(recipe_id: int):
+        return {"recipe_id": recipe_id, "title": "soup", "ingredients": [{"name": "water", "quantity": "1l"}]}
+
+    if sample_rate is None:
+        return app, None
+
+    provider = TracerProvider(sampler=make_sampler(sample_rate, {}, record_unsampled=tail))
+    provider.add_span_processor(TailSamplingSpanProcessor(
+        CountingBatchSpanProcessor(DiscardingExporter()), slow_threshold_ms=1000, max_buffered_spans=10000
+    ))
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=provider)
+    return app, provider
+
+
+async def measure(app: FastAPI) -> float:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for i in range(100):
+            await client.get(f"/recipes/{i}")
+        started = time.perf_counter()
+        for i in range(REQUESTS):
+            await client.get(f"/recipes/{i}")
+        return (time.perf_counter() - started) / REQUESTS
+
+
+async def main() -> None:
+    results = {}
+    configs = [("no tracing", None, False)]
+    for rate in (0.0, 0.1, 1.0):
+        configs += [(f"{rate:.0%} head", rate, False), (f"{rate:.0%} tail", rate, True)]
+
+    for label, rate, tail in configs:
+        app, provider = build_app(rate, tail)
+        results[label] = statistics.median([await measure(app) for _ in range(ROUNDS)])
+        if provider is not None:
+            provider.shutdown()
+
+    baseline = results["no tracing"]
+    print(f"{'sampling':>12} {'us/request':>12} {'overhead':>10}")
+    for label, seconds in results.items():
+        print(f"{label:>12} {seconds * 1e6:>12.1f} {(seconds / baseline - 1) * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""
+Picks the password hashing cost for the hardware it runs on: the highest cost whose hash stays within
+the latency budget. Run it on the production hardware and put the printed settings in the environment,
+stored hashes are upgraded as users log in.
+
+    python -m cli.calibrate_hashing --budget-ms 250
+    python -m cli.calibrate_hashing --scheme argon2 --budget-ms 250 --memory-kib 65536
+"""
+import argparse
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from passlib.context import CryptContext
+
+from app.services.auth_services.hashing import PASSWORD_HASH_SCHEMES, make_password_context
+from config import Config
+
+PASSWORD = "Calibrate1234"
+MAX_BCRYPT_ROUNDS = 31
+MAX_ARGON2_TIME_COST = 64
+
+
+def measure(context: CryptContext, samples: int) -> float:
+    """Median seconds per hash."""
+    # the first hash loads the backend
+    context.hash(PASSWORD)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash(PASSWORD)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(args: argparse.Namespace) -> Tuple[Dict[str, int], List[Tuple[int, float]]]:
+    """
+    Raises the cost one step at a time until a hash exceeds the budget.
+
+    :return: settings of the highest cost within the budget, the lowest one if none is, and every measured cost
+    """
+    budget = args.budget_ms / 1000
+    if args.scheme == "bcrypt":
+        setting, costs = "BCRYPT_ROUNDS", range(4, MAX_BCRYPT_ROUNDS + 1)
+    else:
+        setting, costs = "ARGON2_TIME_COST", range(1, MAX_ARGON2_TIME_COST + 1)
+
+    measured = []
+    for cost in costs:
+        context = make_password_context(
+            args.scheme,
+            bcrypt_rounds=cost if args.scheme == "bcrypt" else Config.BCRYPT_ROUNDS,
+            argon2_time_cost=cost if args.scheme == "argon2" else Config.ARGON2_TIME_COST,
+            argon2_memory_cost=args.memory_kib,
+            argon2_parallelism=args.parallelism,
+        )
+        seconds = measure(context, args.samples)
+        measured.append((cost, seconds))
+        print(f"{setting}={cost}: {seconds * 1000:.1f} ms", file=sys.stderr)
+        if seconds > budget:
+            break
+
+    within = [cost for cost, seconds in measured if seconds <= budget]
+    settings = {"PASSWORD_HASH_SCHEME": args.scheme, setting: within[-1] if within else measured[0][0]}
+    if args.scheme == "argon2":
+        settings.update(ARGON2_MEMORY_COST_KIB=args.memory_kib, ARGON2_PARALLELISM=args.parallelism)
+    return settings, measured
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Choose the password hashing cost for a latency budget.")
+    parser.add_argument("--scheme", choices=PASSWORD_HASH_SCHEMES, default=Config.PASSWORD_HASH_SCHEME)
+    parser.add_argument("--budget-ms", type=float, default=250, help="time one hash may take")
+    parser.add_argument("--memory-kib", type=int, default=Config.ARGON2_MEMORY_COST_KIB, help="argon2 only")
+    parser.add_argument("--parallelism", type=int, default=Config.ARGON2_PARALLELISM, help="argon2 only")
+    parser.add_argument("--samples", type=int, default=5, help="hashes timed per cost, the median is used")
+    args = parser.parse_args()
+
+    settings, measured = calibrate(args)
+    if all(seconds > args.budget_ms / 1000 for _, seconds in measured):
+        print("Even the lowest cost exceeds the budget"
+              + (", lower --memory-kib" if args.scheme == "argon2" else ""), file=sys.stderr)
+    for name, value in settings.items():
+        print(f"{name}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Bulk import of a cookbook from the command line, through the same path as POST /profile/my-recipes/import.
+
+    python -m cli.import_recipes johndoe recipes.ndjson
+    python -m cli.import_recipes john@example.com cookbook.csv
+    cat recipes.ndjson | python -m cli.import_recipes johndoe - --format ndjson
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import AsyncIterator, BinaryIO
+
+from app.database.session import sessionmanager
+from app.repository.recipe_repo import RecipeRepository
+from app.repository.user_repo import UserRepository
+from app.services.recipe_import import IMPORT_FORMATS, RecipeImportService
+from config import Config
+
+READ_SIZE = 64 * 1024
+
+
+async def read_chunks(file: BinaryIO) -> AsyncIterator[bytes]:
+    while chunk := await asyncio.to_thread(file.read, READ_SIZE):
+        yield chunk
+
+
+async def run(args: argparse.Namespace) -> int:
+    import_format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    file = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        async with sessionmanager.session() as session:
+            user = await UserRepository(session).get_active_user_by_username_or_email(args.user)
+            if user is None:
+                print(f"No active user {args.user!r}", file=sys.stderr)
+                return 1
+            started = time.perf_counter()
+            report = await RecipeImportService(RecipeRepository(session)).import_recipes(
+                user.user_id, read_chunks(file), import_format, chunk_size=args.chunk_size, max_rows=args.max_rows
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        if file is not sys.stdin.buffer:
+            file.close()
+
+    for error in report["errors"]:
+        print(f"line {error['line']}: {'; '.join(error['errors'])}", file=sys.stderr)
+    print(f"{report['imported']} imported, {report['failed']} failed in {elapsed:.2f} s "
+          f"({report['imported'] / elapsed:.0f} recipes/s)")
+    return 0 if not report["failed"] else 2
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import recipes from an NDJSON or CSV file.")
+    parser.add_argument("user", help="username or email of the owner")
+    parser.add_argument("path", help="file to import, - for stdin")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="by default from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=Config.RECIPE_IMPORT_CHUNK_SIZE)
+    parser.add_argument("--max-rows", type=int, default=sys.maxsize, help="no limit by default")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
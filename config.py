@@ -30,6 +30,33 @@ class Settings(BaseSettings):
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRES_MINUTES: int
     REFRESH_TOKEN_EXPIRES_DAYS: int
+    REFRESH_TOKEN_PURGE_BATCH_SIZE: int = 1000
+    # users whose token epoch is kept in memory by each worker
+    TOKEN_EPOCH_CACHE_SIZE: int = 100000
+    # epochs are reloaded after this long even if an invalidation message was lost,
+    # unknown or inactive users sooner
+    TOKEN_EPOCH_CACHE_TTL_SECONDS: float = 5
+    TOKEN_EPOCH_CACHE_NEGATIVE_TTL_SECONDS: float = 1
+
+    # password hashing: bcrypt or argon2 (argon2id), costs from `python -m cli.calibrate_hashing`.
+    # Stored hashes of another scheme or a lower cost are replaced at the next login
+    PASSWORD_HASH_SCHEME: str = "bcrypt"
+    BCRYPT_ROUNDS: int = 12
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST_KIB: int = 64 * 1024
+    ARGON2_PARALLELISM: int = 1
+    # hashes running at once per worker, about its share of the cores, and how many more may wait
+    PASSWORD_HASH_CONCURRENCY: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 64
+    PASSWORD_HASH_QUEUE_TIMEOUT_MS: int = 1000
+
+    # attempts to prove a password (login, forgotten password) per account and per client address,
+    # a burst and a refill rate each, counted by every worker separately
+    LOGIN_ACCOUNT_BURST: int = 10
+    LOGIN_ACCOUNT_PER_MINUTE: float = 5
+    LOGIN_ADDRESS_BURST: int = 50
+    LOGIN_ADDRESS_PER_MINUTE: float = 30
+    LOGIN_RATE_LIMIT_MAX_ENTRIES: int = 100000
 
     #cloudinary
     CLOUD_NAME: str
@@ -52,6 +79,72 @@ class Settings(BaseSettings):
 
     BACKEND_URL: str
 
+    # tracing
+    TRACES_SAMPLE_RATE: float = 0.1
+    TRACES_ROUTE_SAMPLE_RATES: dict[str, float] = {"/metrics": 0.0}
+    TRACES_TAIL_SAMPLING: bool = True
+    TRACES_SLOW_REQUEST_MS: int = 1000
+    TRACES_TAIL_BUFFER_SPANS: int = 10000
+    OTLP_MAX_QUEUE_SIZE: int = 2048
+    OTLP_MAX_EXPORT_BATCH_SIZE: int = 512
+    OTLP_SCHEDULE_DELAY_MS: int = 5000
+
+    # logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000
+
+    # load shedding
+    LOAD_SHED_ROUTE_LIMITS: dict[str, int] = {"/": 100, "/auth": 32, "/profile": 64}
+    LOAD_SHED_QUEUE_SIZE: int = 100
+    LOAD_SHED_QUEUE_TIMEOUT_MS: int = 2000
+    LOAD_SHED_RETRY_AFTER_SECONDS: int = 2
+    DB_POOL_WAIT_BUDGET_MS: int = 500
+
+    # response cache
+    RESPONSE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    RESPONSE_CACHE_TTL_SECONDS: int = 30
+
+    # recipes
+    RECIPE_BATCH_MAX_IDS: int = 100
+    SYNC_PAGE_SIZE: int = 200
+    RECIPE_IMPORT_CHUNK_SIZE: int = 1000
+    RECIPE_IMPORT_MAX_ROWS: int = 50000
+    RECIPE_IMPORT_MAX_REPORTED_ERRORS: int = 100
+    RECIPE_EXPORT_FETCH_SIZE: int = 500
+    RECIPE_EXPORT_CHUNK_BYTES: int = 64 * 1024
+
+    # Idempotency-Key: how long responses are replayed, and after how long an unfinished request can be retried
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_LOCK_SECONDS: int = 60
+
+    # periodic cleanup of expired rows
+    MAINTENANCE_INTERVAL_SECONDS: int = 60 * 60
+
+    # username and email availability filter: entries it is sized for at least, and its target false positive rate
+    AVAILABILITY_FILTER_CAPACITY: int = 100000
+    AVAILABILITY_FILTER_FALSE_POSITIVE_RATE: float = 0.01
+
+    # batch endpoint
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_MAX_RESPONSE_BYTES: int = 1024 * 1024
+    BATCH_TIMEOUT_MS: int = 5000
+
+    # cache invalidation bus: postgres, redis or local (single worker)
+    INVALIDATION_BUS_BACKEND: str = "postgres"
+    INVALIDATION_BUS_CHANNEL: str = "cache_invalidation"
+    REDIS_URL: str | None = None
+
+    # request accounting
+    CPU_ACCOUNTING_SAMPLE_RATE: float = 0.1
+    ALLOCATION_ACCOUNTING: bool = False
+
+    # profiler
+    PROFILER_TOKEN: str | None = None
+    PROFILER_SAMPLE_INTERVAL_MS: int = 5
+    PROFILER_MIN_INTERVAL_SECONDS: int = 10
+    PROFILER_MAX_PROFILES: int = 20
+
     model_config = SettingsConfigDict(env_file=os.path.join(os.path.dirname(__file__), ".env"), extra="ignore")
 
 
@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 import random
 import time
 
@@ -17,15 +19,47 @@ from app.routes.moderator_route import moderator_router
 from app.routes.auth_route import auth_router
 from app.routes.admin_route import admin_router
 from app.routes.profile_route import profile_router
+from app.routes.recipe_route import recipe_router
+from app.routes.batch_route import batch_router
+from app.routes.sync_route import sync_router
 from utils.prometheus_logging import PrometheusMiddleware, metrics, setting_otlp
+from utils.profiler import ProfilerMiddleware
+from utils.load_shedding import LoadSheddingMiddleware
+from app.database.session import sessionmanager
+from utils.tracing import sentry_traces_sampler
+from utils.logging_pipeline import setup_logging
+from app.routes.serialization import FastJSONResponse
+from app.services.invalidation_bus import invalidation_bus, make_backend
+from app.services.maintenance import start_maintenance
+from app.services.availability import availability_index
 
 
 APP_NAME = "fastapi"
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # every worker subscribes to cache invalidations published by the others
+    backend = make_backend(
+        Config.INVALIDATION_BUS_BACKEND, sessionmanager.url, Config.REDIS_URL, Config.INVALIDATION_BUS_CHANNEL
+    )
+    if backend is not None:
+        await invalidation_bus.start(backend)
+    maintenance = start_maintenance()
+    # answers come from the database until the filter is built
+    availability_index.schedule_build()
+    yield
+    for task in maintenance:
+        task.cancel()
+    await asyncio.gather(*maintenance, return_exceptions=True)
+    await invalidation_bus.stop()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Recipe Share",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     exception_handlers={
         RequestValidationError: custom_validation_exception_handler,
         HTTPException: custom_http_exception_handler
@@ -34,22 +68,44 @@ app = FastAPI(
 
 
 # Prometheus
-app.add_middleware(PrometheusMiddleware, app_name=APP_NAME)
+app.add_middleware(
+    PrometheusMiddleware,
+    app_name=APP_NAME,
+    cpu_sample_rate=Config.CPU_ACCOUNTING_SAMPLE_RATE,
+    trace_allocations=Config.ALLOCATION_ACCOUNTING,
+)
 app.add_route("/metrics", metrics)
 
-if not Config.DEBUG:
-    setting_otlp(app, APP_NAME, "http://tempo:4317")
-
+# Load shedding wraps the metrics middleware, so requests cancelled on disconnect are counted there
+app.add_middleware(
+    LoadSheddingMiddleware,
+    route_limits=Config.LOAD_SHED_ROUTE_LIMITS,
+    max_queue=Config.LOAD_SHED_QUEUE_SIZE,
+    queue_timeout_ms=Config.LOAD_SHED_QUEUE_TIMEOUT_MS,
+    pool_wait=sessionmanager.pool_wait.current,
+    pool_wait_budget_ms=Config.DB_POOL_WAIT_BUDGET_MS,
+    retry_after=Config.LOAD_SHED_RETRY_AFTER_SECONDS,
+    app_name=APP_NAME,
+)
 
-# Filter Logging
-class EndpointFilter(logging.Filter):
-    # Uvicorn endpoint access log filter
-    def filter(self, record: logging.LogRecord) -> bool:
-        return record.getMessage().find("GET /metrics") == -1
+# On-demand request profiler, managed through /admin/profiler
+app.add_middleware(ProfilerMiddleware)
 
+if not Config.DEBUG:
+    setting_otlp(
+        app, APP_NAME, "http://tempo:4317",
+        sample_rate=Config.TRACES_SAMPLE_RATE,
+        route_sample_rates=Config.TRACES_ROUTE_SAMPLE_RATES,
+        tail_sampling=Config.TRACES_TAIL_SAMPLING,
+        slow_request_ms=Config.TRACES_SLOW_REQUEST_MS,
+        max_buffered_spans=Config.TRACES_TAIL_BUFFER_SPANS,
+        max_queue_size=Config.OTLP_MAX_QUEUE_SIZE,
+        max_export_batch_size=Config.OTLP_MAX_EXPORT_BATCH_SIZE,
+        schedule_delay_ms=Config.OTLP_SCHEDULE_DELAY_MS,
+    )
 
-# Filter out /endpoint
-logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
+# Logging goes through a queue drained by a background thread, /metrics is filtered out of access logs
+setup_logging(APP_NAME, level=Config.LOG_LEVEL, fmt=Config.LOG_FORMAT, max_queue_size=Config.LOG_QUEUE_SIZE)
 
 test_router = APIRouter(tags=["Testing"])
 
@@ -120,23 +176,23 @@ if not Config.DEBUG:
         # Add data like request headers and IP for users,
         # see https://docs.sentry.io/platforms/python/data-management/data-collected/ for more info
         send_default_pii=True,
-        traces_sample_rate=1.0,
+        traces_sampler=sentry_traces_sampler(Config.TRACES_SAMPLE_RATE, Config.TRACES_ROUTE_SAMPLE_RATES),
     )
 
 
 # Routers
 app.include_router(auth_router, prefix="/auth")
 app.include_router(profile_router, prefix="/profile")
+app.include_router(recipe_router, prefix="/recipes")
 app.include_router(moderator_router, prefix="/moderator")
 app.include_router(admin_router, prefix="/admin")
+app.include_router(sync_router)
+app.include_router(batch_router)
 app.include_router(test_router)
 
 if __name__ == "__main__":
+    # logging is already configured by setup_logging, keep uvicorn from overriding it
     if not Config.DEBUG:
-        log_config = uvicorn.config.LOGGING_CONFIG
-        log_config["formatters"]["access"][
-            "fmt"
-        ] = "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] [trace_id=%(otelTraceID)s span_id=%(otelSpanID)s resource.service.name=%(otelServiceName)s] - %(message)s"
-        uvicorn.run(app, host="0.0.0.0", port=8000, log_config=log_config)
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
     else:
-        uvicorn.run(app, host="127.0.0.1", port=8000)
+        uvicorn.run(app, host="127.0.0.1", port=8000, log_config=None)
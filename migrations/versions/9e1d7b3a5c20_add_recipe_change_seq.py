@@ -0,0 +1,46 @@
+"""add_recipe_change_seq
+
+Revision ID: 9e1d7b3a5c20
+Revises: 4c2e8f1a9d3b
+Create Date: 2026-10-19 21:42:37.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e1d7b3a5c20'
+down_revision: Union[str, None] = '4c2e8f1a9d3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('recipe_change_seq')))
+    # existing recipes are numbered by the volatile default, one value per row
+    op.add_column('recipes', sa.Column(
+        'change_seq', sa.BigInteger(), server_default=sa.text("nextval('recipe_change_seq')"), nullable=False
+    ))
+    op.create_index('ix_recipes_user_id_change_seq', 'recipes', ['user_id', 'change_seq'], unique=False)
+    op.create_table('recipe_tombstones',
+    sa.Column('recipe_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('change_seq', sa.BigInteger(), server_default=sa.text("nextval('recipe_change_seq')"), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('recipe_id')
+    )
+    op.create_index(
+        'ix_recipe_tombstones_user_id_change_seq', 'recipe_tombstones', ['user_id', 'change_seq'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_tombstones_user_id_change_seq', table_name='recipe_tombstones')
+    op.drop_table('recipe_tombstones')
+    op.drop_index('ix_recipes_user_id_change_seq', table_name='recipes')
+    op.drop_column('recipes', 'change_seq')
+    op.execute(sa.schema.DropSequence(sa.Sequence('recipe_change_seq')))
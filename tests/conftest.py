@@ -9,9 +9,11 @@ import contextlib
 
 from main import app
 from config import Config
-from app.services.auth_services.auth import create_refresh_token, create_access_token
+from app.services.auth_services.admission import login_admission
+from app.services.auth_services.auth import create_access_token
+from app.repository.refresh_token_repo import RefreshTokenRepository
 from app.services.auth_services.hashing import Hasher
-from app.database.models import Base, User, Recipe, RecipeIngredient, Ingredient
+from app.database.models import Base, User, Recipe, RecipeIngredient, Ingredient, RefreshToken
 from app.database.session import get_db
 
 from PIL import Image
@@ -59,6 +61,13 @@ async def clear_database():
     yield
 
 
+@pytest.fixture(scope="function", autouse=True)
+def reset_login_admission():
+    # every test logs in from the same address
+    login_admission.clear()
+    yield
+
+
 async def _get_test_db() -> AsyncGenerator[AsyncSession, None]:
     async with get_root_async_session() as session:
         yield session
@@ -87,6 +96,15 @@ def get_user_from_database() -> Callable[..., Any]:
     return _get
 
 
+@pytest_asyncio.fixture(scope="function")
+def get_refresh_tokens_from_database() -> Callable[..., Any]:
+    async def _get(user_id: uuid.UUID) -> List[RefreshToken]:
+        async for session in _get_test_db():
+            result = await session.execute(select(RefreshToken).where(RefreshToken.user_id == user_id))
+            return list(result.scalars())
+    return _get
+
+
 @pytest_asyncio.fixture(scope="function")
 def get_recipe_from_database() -> Callable[..., Any]:
     async def _get(recipe_id: uuid.UUID) -> Recipe | None:
@@ -106,6 +124,7 @@ def create_test_user() -> Callable[..., Any]:
         email: str = "john@example.com",
         role: str = "user",
         is_verified: bool = False,
+        is_active: bool = True,
         with_refresh: bool = False
     ) -> User:
         hashed_pass = Hasher.get_password_hash("Test1234")
@@ -118,6 +137,7 @@ def create_test_user() -> Callable[..., Any]:
             hashed_password=hashed_pass,
             role=role,
             is_verified=is_verified,
+            is_active=is_active,
         )
         async for session in _get_test_db():
             session.add(user)
@@ -125,11 +145,8 @@ def create_test_user() -> Callable[..., Any]:
             await session.refresh(user)
 
             if with_refresh:
-                token = create_refresh_token(str(user.user_id))
-                user.refresh_token = token
-                session.add(user)
-                await session.commit()
-                await session.refresh(user)
+                # only the hash is stored, keep the token around for the test
+                user.refresh_token = await RefreshTokenRepository(session).issue(user.user_id)
 
             return user
     return _create
@@ -191,8 +208,13 @@ def create_test_recipe() -> Callable[..., Any]:
     return _create
 
 
-def create_test_auth_headers_for_user(user_id: str, scopes: Optional[List[str]] = None) -> dict[str, str]:
-    access_token = create_access_token(user_id, scopes)
+def create_test_auth_headers_for_user(
+        user_id: str,
+        scopes: Optional[List[str]] = None,
+        role: str = "user",
+        token_epoch: int = 0
+) -> dict[str, str]:
+    access_token = create_access_token(user_id, scopes, role, "user:verified" in (scopes or []), token_epoch)
     return {"Authorization": f"Bearer {access_token}"}
 
 
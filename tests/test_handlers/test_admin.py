@@ -0,0 +1,70 @@
+import pytest
+from httpx import AsyncClient
+
+from tests.conftest import create_test_auth_headers_for_user
+from utils.profiler import request_profiler
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    monkeypatch.setattr(request_profiler, "token", None)
+    monkeypatch.setattr(request_profiler, "min_interval", 0)
+    request_profiler.disarm()
+    request_profiler.profiles.clear()
+    yield request_profiler
+    request_profiler.disarm()
+    request_profiler.profiles.clear()
+
+
+@pytest.mark.asyncio
+async def test_profiler_endpoints(client: AsyncClient, create_test_user, profiler):
+    admin = await create_test_user(role="admin")
+    headers = create_test_auth_headers_for_user(str(admin.user_id), ["user", "moderator", "admin"], role="admin")
+
+    response = await client.post("/admin/profiler/arm", params={"path": "/not-a-route", "count": 2}, headers=headers)
+    assert response.status_code == 200
+    assert profiler.armed_count == 2 and profiler.armed_path == "/not-a-route"
+
+    # requests outside the armed path are not profiled
+    response = await client.get("/admin/profiler/profiles", headers=headers)
+    assert "X-Profile-Id" not in response.headers
+    assert response.json()["data"] == []
+
+    response = await client.get("/not-a-route")
+    assert response.status_code == 404
+    profile_id = response.headers["X-Profile-Id"]
+
+    response = await client.get("/admin/profiler/profiles", headers=headers)
+    assert [profile["profile_id"] for profile in response.json()["data"]] == [profile_id]
+    assert response.json()["data"][0]["path"] == "/not-a-route"
+
+    response = await client.get(f"/admin/profiler/profiles/{profile_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "GET /not-a-route"
+
+    response = await client.get(f"/admin/profiler/profiles/{profile_id}", params={"format": "collapsed"},
+                                headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    response = await client.get("/admin/profiler/profiles/unknown", headers=headers)
+    assert response.status_code == 404
+
+    response = await client.post("/admin/profiler/arm", params={"count": 0}, headers=headers)
+    assert response.status_code == 200
+    assert profiler.armed_count == 0
+    response = await client.get("/not-a-route")
+    assert "X-Profile-Id" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_profiler_endpoints_require_admin(client: AsyncClient, create_test_user, profiler):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+
+    response = await client.post("/admin/profiler/arm", params={"count": 1}, headers=headers)
+    assert response.status_code == 403
+    assert profiler.armed_count == 0
+
+    response = await client.get("/admin/profiler/profiles", headers=headers)
+    assert response.status_code == 403
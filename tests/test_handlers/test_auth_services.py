@@ -1,13 +1,21 @@
+import asyncio
 import re
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import update
 
+from app.services.auth_services import admission
+from app.services.auth_services.admission import LoginAdmission, TokenBuckets
 from app.services.auth_services.auth import verify_token, create_email_verification_token, create_reset_password_token
-from app.services.auth_services.hashing import Hasher
+from app.services.auth_services.hashing import Hasher, make_password_context, pwd_context
+from app.database.models import User
+from app.repository.refresh_token_repo import hash_refresh_token
 from app.services.auth_services.mail import fm
+from app.services.availability import availability_index
 from config import Config
-from tests.conftest import create_test_auth_headers_for_user
+from utils.load_shedding import ConcurrencyLimiter
+from tests.conftest import create_test_auth_headers_for_user, get_root_async_session
 
 
 @pytest.mark.asyncio
@@ -36,6 +44,67 @@ async def test_create_user(client: AsyncClient, get_user_from_database):
     assert user.is_active is True
 
 
+@pytest.mark.asyncio
+async def test_concurrent_signups(monkeypatch, client: AsyncClient, get_user_from_database):
+    async def fake_send_message(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(fm, "send_message", fake_send_message)
+    # every signup hashes, queued ones must not be shed however slow the machine is
+    monkeypatch.setattr(admission, "hash_slots", ConcurrencyLimiter(Config.PASSWORD_HASH_CONCURRENCY, 10, 600))
+
+    payloads = [{"email": "same@example.com", "username": f"user{i}", "password": "Test1234"} for i in range(5)]
+    payloads += [{"email": f"user{i}@example.com", "username": "same", "password": "Test1234"} for i in range(5)]
+    responses = await asyncio.gather(*(client.post("/auth/signup", json=payload) for payload in payloads))
+
+    statuses = [response.status_code for response in responses]
+    assert sorted(statuses) == [201, 201] + [409] * 8
+    details = {response.json()["detail"] for response in responses if response.status_code == 409}
+    assert details <= {"User with this email already exists", "User with this username already exists"}
+    assert await get_user_from_database(email="same@example.com") is not None
+    assert await get_user_from_database(username="same") is not None
+
+
+@pytest.mark.asyncio
+async def test_availability(monkeypatch, client: AsyncClient, create_test_user):
+    async def fake_send_message(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(fm, "send_message", fake_send_message)
+    await create_test_user(username="johndoe", email="john@example.com")
+
+    # before the filter is built every check goes to the database
+    monkeypatch.setattr(availability_index, "_filter", None)
+    response = await client.get("/auth/availability", params={"username": "johndoe", "email": "free@example.com"})
+    assert response.status_code == 200
+    assert response.json()["data"] == {"username": False, "email": True}
+
+    monkeypatch.setattr(availability_index, "open_session", get_root_async_session)
+    await availability_index.build()
+    assert availability_index.ready
+    assert availability_index.might_be_taken("username", "johndoe") is True
+    assert availability_index.might_be_taken("username", "someone-else") is False
+
+    response = await client.get("/auth/availability", params={"username": "someone-else"})
+    assert response.json()["data"] == {"username": True, "email": None}
+    response = await client.get("/auth/availability", params={"email": "JOHN@EXAMPLE.COM"})
+    assert response.json()["data"] == {"username": None, "email": True}
+    response = await client.get("/auth/availability", params={"email": "john@EXAMPLE.com"})
+    assert response.json()["data"] == {"username": None, "email": False}
+
+    # a signup is added to the filter once committed
+    response = await client.post("/auth/signup", json={
+        "email": "new@example.com", "username": "newcomer", "password": "Test1234"
+    })
+    assert response.status_code == 201
+    assert availability_index.might_be_taken("username", "newcomer") is True
+    response = await client.get("/auth/availability", params={"username": "newcomer", "email": "new@example.com"})
+    assert response.json()["data"] == {"username": False, "email": False}
+
+    response = await client.get("/auth/availability")
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_signup_sends_email(monkeypatch, client, get_user_from_database):
     sent = {}
@@ -87,7 +156,7 @@ async def test_validation_create_user(client: AsyncClient, get_user_from_databas
 
 
 @pytest.mark.asyncio
-async def test_login(client: AsyncClient, create_test_user, get_user_from_database):
+async def test_login(client: AsyncClient, create_test_user, get_refresh_tokens_from_database):
     user = await create_test_user()
 
     # sign in via email
@@ -112,9 +181,9 @@ async def test_login(client: AsyncClient, create_test_user, get_user_from_databa
     assert response_signin_email.json()["access_token"]
     assert response_signin_email.json()["token_type"] == "bearer"
 
-    # checking if we updated refresh token in DB
-    user_email = await get_user_from_database(email=user.email)
-    assert user_email.refresh_token is not None
+    # checking if we stored the refresh token in DB
+    tokens = await get_refresh_tokens_from_database(user.user_id)
+    assert [token.token_hash for token in tokens] == [hash_refresh_token(response_signin_email_token)]
 
     # assert response from login via username from body and cookies (to find tokens)
     response_signin_username = await client.post("/auth/login", data=payload_signin_username)
@@ -123,15 +192,120 @@ async def test_login(client: AsyncClient, create_test_user, get_user_from_databa
     assert response_signin_username.json()["access_token"]
     assert response_signin_username.json()["token_type"] == "bearer"
 
-    # checking if refresh token is not changed during all manipulations
-    user_username = await get_user_from_database(username=user.username)
-    assert user_username is not None
-    assert user_username.refresh_token is not None
-    assert user_username.refresh_token == response_signin_username.cookies.get("refresh_token")
+    # every login is a separate device, the first one stays logged in
+    tokens = await get_refresh_tokens_from_database(user.user_id)
+    assert {token.token_hash for token in tokens} == {
+        hash_refresh_token(response_signin_email_token),
+        hash_refresh_token(response_signin_username.cookies.get("refresh_token")),
+    }
+    assert len({token.family_id for token in tokens}) == 2
 
 
 @pytest.mark.asyncio
-async def test_invalid_login(client: AsyncClient, get_user_from_database):
+async def test_login_rehashes_outdated_password_hash(client: AsyncClient, create_test_user, get_user_from_database):
+    user = await create_test_user()
+    outdated = make_password_context("bcrypt", 4, Config.ARGON2_TIME_COST, Config.ARGON2_MEMORY_COST_KIB,
+                                     Config.ARGON2_PARALLELISM).hash("Test1234")
+    async with get_root_async_session() as session:
+        await session.execute(update(User).where(User.user_id == user.user_id).values(hashed_password=outdated))
+        await session.commit()
+
+    response = await client.post("/auth/login", data={
+        "grant_type": "password", "username": user.username, "password": "Test1234"
+    })
+    assert response.status_code == 200
+
+    rehashed = (await get_user_from_database(user_id=user.user_id)).hashed_password
+    assert rehashed != outdated
+    assert not pwd_context.needs_update(rehashed)
+    assert Hasher.verify_password("Test1234", rehashed)
+
+
+@pytest.mark.asyncio
+async def test_login_admission_under_attack(monkeypatch, client: AsyncClient, create_test_user):
+    user = await create_test_user()
+    now = [0.0]
+    monkeypatch.setattr(admission, "login_admission", LoginAdmission(
+        accounts=TokenBuckets(3, 60, 100, clock=lambda: now[0]),
+        addresses=TokenBuckets(4, 60, 100, clock=lambda: now[0]),
+    ))
+    hashes = {"real": 0, "dummy": 0}
+    verify_and_update, verify_dummy = Hasher.verify_and_update, Hasher.verify_dummy
+
+    def counting_verify_and_update(*args):
+        hashes["real"] += 1
+        return verify_and_update(*args)
+
+    def counting_verify_dummy(*args):
+        hashes["dummy"] += 1
+        return verify_dummy(*args)
+
+    monkeypatch.setattr(Hasher, "verify_and_update", staticmethod(counting_verify_and_update))
+    monkeypatch.setattr(Hasher, "verify_dummy", staticmethod(counting_verify_dummy))
+
+    # guessing one account's password: the account bucket admits a burst of 3
+    responses = await asyncio.gather(*(client.post("/auth/login", data={
+        "grant_type": "password", "username": user.username, "password": f"guess{i}"
+    }) for i in range(10)))
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [401] * 3 + [429] * 7
+    assert all(response.headers["Retry-After"] == "1" for response in responses if response.status_code == 429)
+    assert hashes == {"real": 3, "dummy": 0}
+
+    # the same account spelled differently shares the bucket
+    response = await client.post("/auth/login", data={
+        "grant_type": "password", "username": user.username.upper(), "password": "Test1234"
+    })
+    assert response.status_code == 429
+
+    # the owner gets in once the bucket refills
+    now[0] += 1
+    response = await client.post("/auth/login", data={
+        "grant_type": "password", "username": user.username, "password": "Test1234"
+    })
+    assert response.status_code == 200
+    assert hashes == {"real": 4, "dummy": 0}
+
+    # spraying unknown accounts from one address: 1 token is left of its burst of 4, refilled at 1 per second
+    responses = await asyncio.gather(*(client.post("/auth/login", data={
+        "grant_type": "password", "username": f"victim{i}", "password": "Test1234"
+    }) for i in range(20)))
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [401] + [429] * 19
+    assert hashes == {"real": 4, "dummy": 1}
+
+    # a forgotten password is an attempt too
+    now[0] += 1
+    response = await client.post("/auth/forget-password", json={"username": "victim0"})
+    assert response.status_code == 404
+    response = await client.post("/auth/forget-password", json={"username": "victim1"})
+    assert response.status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_password_hashes_are_capped(monkeypatch):
+    monkeypatch.setattr(admission, "hash_slots", ConcurrencyLimiter(1, 1, 0.05))
+    release = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def slow_hash():
+        asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+        return "hash"
+
+    running = asyncio.ensure_future(admission.run_hash(slow_hash))
+    await asyncio.sleep(0.01)
+    # one hash runs, one may wait up to the queue timeout, the rest are refused upfront
+    results = await asyncio.gather(*(admission.run_hash(slow_hash) for _ in range(3)), return_exceptions=True)
+    assert [result.status_code for result in results] == [503] * 3
+    assert all(result.headers["Retry-After"] for result in results)
+
+    release.set()
+    assert await running == "hash"
+    assert await admission.run_hash(lambda: "next") == "next"
+
+
+@pytest.mark.asyncio
+async def test_invalid_login(client: AsyncClient, get_user_from_database, get_refresh_tokens_from_database):
     payload_signup = {
         "email": "kononomisha@gmail.com",
         "username": "user",
@@ -154,7 +328,7 @@ async def test_invalid_login(client: AsyncClient, get_user_from_database):
     assert response.json()["detail"] == "Invalid credentials"
 
     user = await get_user_from_database(email=payload_signup["email"])
-    assert user.refresh_token is None
+    assert await get_refresh_tokens_from_database(user.user_id) == []
 
 
 @pytest.mark.asyncio
@@ -170,6 +344,36 @@ async def test_access_token(client: AsyncClient, get_user_from_database, create_
     assert response.json()["message"] == "Access token refreshed"
 
 
+@pytest.mark.asyncio
+async def test_refresh_token_rotation(client: AsyncClient, create_test_user, get_refresh_tokens_from_database):
+    test_user = await create_test_user(with_refresh=True)
+    stolen = test_user.refresh_token
+
+    client.cookies.set("refresh_token", stolen)
+    response = await client.post("/auth/token")
+    assert response.status_code == 200
+    rotated = response.cookies.get("refresh_token")
+    assert rotated and rotated != stolen
+
+    # the used token is kept to detect its reuse
+    tokens = await get_refresh_tokens_from_database(test_user.user_id)
+    assert len(tokens) == 2 and len({token.family_id for token in tokens}) == 1
+
+    # replaying the used token revokes the whole family, the rotated token included
+    client.cookies.set("refresh_token", stolen)
+    response = await client.post("/auth/token")
+    assert response.status_code == 401
+    assert await get_refresh_tokens_from_database(test_user.user_id) == []
+
+    client.cookies.set("refresh_token", rotated)
+    response = await client.post("/auth/token")
+    assert response.status_code == 401
+
+    client.cookies.set("refresh_token", "not-a-token")
+    response = await client.post("/auth/token")
+    assert response.status_code == 401
+
+
 @pytest.mark.asyncio
 async def test_verify_email(client, create_test_user, get_user_from_database):
     user = await create_test_user()
@@ -239,13 +443,22 @@ async def test_reset_password(monkeypatch, client, create_test_user, get_user_fr
 
 
 @pytest.mark.asyncio
-async def test_signout(client, create_test_user, get_user_from_database):
+async def test_signout(client, create_test_user, get_refresh_tokens_from_database):
     user = await create_test_user(with_refresh=True)
-    headers = create_test_auth_headers_for_user(str(user.user_id))
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+
+    response = await client.get("/profile/", headers=headers)
+    assert response.status_code == 200
 
     response = await client.post("/auth/sign-out", headers=headers)
     assert response.status_code == 200
     assert response.json()["message"] == "You successfully logged out!"
 
-    logged_out_user = await get_user_from_database(user_id=user.user_id)
-    assert logged_out_user.refresh_token is None
+    # access tokens issued before the sign-out are revoked along with the refresh tokens
+    response = await client.get("/profile/", headers=headers)
+    assert response.status_code == 401
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"], token_epoch=1)
+    response = await client.get("/profile/", headers=headers)
+    assert response.status_code == 200
+
+    assert await get_refresh_tokens_from_database(user.user_id) == []
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from httpx._transports.asgi import ASGITransport
+
+from app.database import session as session_module
+from app.database.session import DatabaseSessionManager, SerializedSession
+from app.services.auth_services.token_epochs import token_epochs
+from config import Config
+from main import app
+from tests.conftest import create_test_auth_headers_for_user
+
+
+@pytest_asyncio.fixture(scope="function")
+async def shared_client(monkeypatch):
+    """Client going through the real `get_db`, with the list of the sessions it opened."""
+    manager = DatabaseSessionManager(Config.TEST_DATABASE_URL)
+    opened = []
+    session = manager.session
+
+    def counted_session():
+        opened.append(1)
+        return session()
+
+    monkeypatch.setattr(manager, "session", counted_session)
+    monkeypatch.setattr(session_module, "sessionmanager", manager)
+    token_epochs.clear()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost") as ac:
+        yield ac, opened
+    await manager._engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_batch(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user", "user:verified"])
+    recipe = await create_test_recipe(user_id=user.user_id)
+
+    response = await client.post("/batch", headers=headers, json={"requests": [
+        {"path": "/profile/"},
+        {"path": "/profile/my-recipes", "query": {"fields": "recipe_id,title"}},
+        {"method": "PATCH", "path": "/profile/my-recipes/update", "query": {"recipe_id": str(recipe.recipe_id)},
+         "body": {"title": "renamed"}},
+        {"method": "POST", "path": "/recipes/batch-get", "body": {"ids": [str(recipe.recipe_id)]},
+         "query": {"fields": "title"}},
+        {"path": "/does-not-exist"},
+    ]})
+    assert response.status_code == 200
+    profile, recipes, update, batch_get, missing = response.json()["data"]
+
+    assert profile["status"] == 200
+    assert profile["body"]["data"]["username"] == user.username
+    assert "etag" in profile["headers"]
+    assert recipes["body"]["data"] == [{"recipe_id": str(recipe.recipe_id), "title": recipe.title}]
+    assert update["status"] == 201
+    # the write runs before the reads that follow it
+    assert batch_get["body"]["data"][0]["recipe"] == {"title": "renamed"}
+    assert missing["status"] == 404
+
+
+@pytest.mark.asyncio
+async def test_batch_limits(client: AsyncClient, create_test_user):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+
+    too_many = [{"path": "/profile/"}] * (Config.BATCH_MAX_REQUESTS + 1)
+    response = await client.post("/batch", headers=headers, json={"requests": too_many})
+    assert response.status_code == 422
+
+    response = await client.post("/batch", headers=headers, json={"requests": [{"path": "/batch"}]})
+    assert response.status_code == 422
+
+    response = await client.post("/batch", json={"requests": [{"path": "/profile/"}]})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_batch_shares_session_except_for_streams(shared_client, create_test_user, create_test_recipe):
+    client, opened_sessions = shared_client
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    recipe = await create_test_recipe(user_id=user.user_id, ingredients=[])
+
+    response = await client.post("/batch", headers=headers, json={"requests": [
+        {"path": "/profile/"},
+        {"path": "/profile/my-recipes/export"},
+        {"path": "/profile/my-recipes", "query": {"fields": "recipe_id"}},
+        {"path": "/profile/my-recipes/export"},
+    ]})
+    assert response.status_code == 200
+    profile, export, recipes, second_export = response.json()["data"]
+    assert profile["status"] == 200
+    assert recipes["body"]["data"] == [{"recipe_id": str(recipe.recipe_id)}]
+    for part in (export, second_export):
+        assert part["status"] == 200
+        assert [json.loads(line)["recipe_id"] for line in part["body"].splitlines()] == [str(recipe.recipe_id)]
+    # the token epoch lookup, the session shared by the batch and one per export
+    assert len(opened_sessions) == 4
+
+
+def test_serialized_session_refuses_streams():
+    serialized = SerializedSession(object())
+    with pytest.raises(AttributeError):
+        serialized.stream
+    with pytest.raises(AttributeError):
+        serialized.stream_scalars
@@ -0,0 +1,95 @@
+import uuid
+
+import pytest
+from httpx import AsyncClient
+
+from app.schemas.responses.recipe_schema_resp import RecipeResponse
+from config import Config
+from tests.conftest import create_test_auth_headers_for_user
+
+
+@pytest.mark.asyncio
+async def test_batch_get_recipes(client: AsyncClient, create_test_user, create_test_recipe, get_recipe_from_database):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    first = await create_test_recipe(user_id=user.user_id, title="first")
+    second = await create_test_recipe(user_id=user.user_id, title="second")
+    missing = uuid.uuid4()
+
+    ids = [str(second.recipe_id), str(missing), str(first.recipe_id)]
+    response = await client.post("/recipes/batch-get", json={"ids": ids}, headers=headers)
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [item["recipe_id"] for item in data] == ids
+    assert [item["found"] for item in data] == [True, False, True]
+    assert data[1]["recipe"] is None
+    expected = RecipeResponse.model_validate(await get_recipe_from_database(second.recipe_id)).model_dump(mode="json")
+    assert data[0]["recipe"] == expected
+
+    response = await client.post("/recipes/batch-get", params={"fields": "title"}, json={"ids": ids}, headers=headers)
+    assert response.json()["data"][2]["recipe"] == {"title": "first"}
+
+
+@pytest.mark.asyncio
+async def test_batch_get_hides_recipes_of_inactive_authors(client: AsyncClient, create_test_user, create_test_recipe):
+    author = await create_test_user(username="inactive", email="inactive@example.com", is_active=False)
+    recipe = await create_test_recipe(user_id=author.user_id)
+    viewer = await create_test_user()
+    moderator = await create_test_user(username="moderator", email="moderator@example.com", role="moderator")
+
+    body = {"ids": [str(recipe.recipe_id)]}
+    response = await client.post("/recipes/batch-get", json=body,
+                                 headers=create_test_auth_headers_for_user(str(viewer.user_id), ["user"]))
+    assert response.json()["data"][0]["found"] is False
+
+    response = await client.post("/recipes/batch-get", json=body,
+                                 headers=create_test_auth_headers_for_user(str(moderator.user_id), ["user"], role="moderator"))
+    assert response.json()["data"][0]["found"] is True
+
+
+@pytest.mark.asyncio
+async def test_batch_get_limits_ids(client: AsyncClient, create_test_user):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+
+    ids = [str(uuid.uuid4()) for _ in range(Config.RECIPE_BATCH_MAX_IDS + 1)]
+    response = await client.post("/recipes/batch-get", json={"ids": ids}, headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_sync_returns_changes_since_token(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    first = await create_test_recipe(user_id=user.user_id, title="first")
+    second = await create_test_recipe(user_id=user.user_id, title="second", ingredients=[])
+
+    response = await client.get("/sync", params={"limit": 1}, headers=headers)
+    assert response.status_code == 200
+    page = response.json()["data"]
+    assert [recipe["title"] for recipe in page["changed"]] == ["first"]
+    assert page["has_more"] is True
+
+    response = await client.get("/sync", params={"since": page["next_token"]}, headers=headers)
+    page = response.json()["data"]
+    assert [recipe["title"] for recipe in page["changed"]] == ["second"]
+    assert page["has_more"] is False
+    token = page["next_token"]
+
+    response = await client.get("/sync", params={"since": token}, headers=headers)
+    assert response.json()["data"]["changed"] == []
+    assert response.json()["data"]["next_token"] == token
+
+    await client.patch("/profile/my-recipes/update", params={"recipe_id": str(first.recipe_id)},
+                       json={"title": "renamed"}, headers=headers)
+    response = await client.delete("/profile/my-recipes/delete", params={"recipe_id": str(second.recipe_id)},
+                                   headers=headers)
+    assert response.status_code == 200
+
+    response = await client.get("/sync", params={"since": token}, headers=headers)
+    page = response.json()["data"]
+    assert [recipe["title"] for recipe in page["changed"]] == ["renamed"]
+    assert page["deleted"] == [str(second.recipe_id)]
+
+    response = await client.get("/sync", params={"since": "not-a-token"}, headers=headers)
+    assert response.status_code == 400
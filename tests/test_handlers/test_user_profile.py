@@ -1,9 +1,19 @@
+import io
+import json
+import tracemalloc
+import zipfile
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import insert
 
 from app.schemas.responses.recipe_schema_resp import RecipeResponse
 from app.schemas.responses.user_schema_resp import UserResponse
-from tests.conftest import create_test_auth_headers_for_user, image_file
+from app.database.models import Recipe
+from app.repository.recipe_repo import RecipeRepository
+from app.services.response_cache import response_cache
+from app.services.recipe_export import RecipeExportService
+from tests.conftest import create_test_auth_headers_for_user, image_file, get_root_async_session
 
 
 @pytest.mark.asyncio
@@ -187,3 +197,205 @@ async def test_fetch_profile(
         assert res["data"] == RecipeResponse.model_validate(updated_recipe).model_dump(mode="json")
 
     assert res["errors"] == expected_error
+
+
+@pytest.mark.asyncio
+async def test_conditional_read_my_recipes(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user", "user:verified"])
+    recipe = await create_test_recipe(user_id=user.user_id)
+
+    response = await client.get("/profile/my-recipes", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # nothing changed: empty 304 with the same tag
+    not_modified = await client.get("/profile/my-recipes", headers={**headers, "If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    assert not_modified.content == b""
+
+    # an update bumps the recipe version and therefore the tag
+    response = await client.patch("/profile/my-recipes/update", params={"recipe_id": recipe.recipe_id},
+                                  json={"ingredients": [{"name": "salt", "quantity": "1"}]}, headers=headers)
+    assert response.status_code == 201
+
+    modified = await client.get("/profile/my-recipes", headers={**headers, "If-None-Match": etag})
+    assert modified.status_code == 200
+    assert modified.headers["ETag"] != etag
+    assert modified.json()["data"][0]["ingredients"] == [{"name": "salt", "quantity": "1"}]
+
+
+@pytest.mark.asyncio
+async def test_read_my_recipes_etag_describes_the_body(monkeypatch, client: AsyncClient, create_test_user,
+                                                       create_test_recipe):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    recipe = await create_test_recipe(user_id=user.user_id)
+
+    # the versions were read before a write that committed ahead of the body query
+    async def stale_versions(self, user_id):
+        return [(recipe.recipe_id, recipe.version - 1)]
+
+    with monkeypatch.context() as patch:
+        patch.setattr(RecipeRepository, "fetch_user_recipe_versions", stale_versions)
+        response = await client.get("/profile/my-recipes", params={"fields": "title"}, headers=headers)
+    assert response.status_code == 200
+
+    response_cache.clear()
+    fresh = await client.get("/profile/my-recipes", params={"fields": "title"}, headers=headers)
+    assert fresh.json() == response.json()
+    assert fresh.headers["ETag"] == response.headers["ETag"]
+
+
+@pytest.mark.asyncio
+async def test_conditional_read_profile(client: AsyncClient, create_test_user):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+
+    response = await client.get("/profile/", headers=headers)
+    assert response.status_code == 200
+
+    not_modified = await client.get("/profile/", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_read_my_recipes_sparse_fields(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user(with_refresh=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    recipe = await create_test_recipe(user_id=user.user_id)
+
+    response = await client.get("/profile/my-recipes", params={"fields": "recipe_id,title"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["data"] == [{"recipe_id": str(recipe.recipe_id), "title": recipe.title}]
+
+    full = await client.get("/profile/my-recipes", headers=headers)
+    assert full.headers["ETag"] != response.headers["ETag"]
+    assert len(full.json()["data"][0]["ingredients"]) == 2
+
+    response = await client.get("/profile/my-recipes", params={"fields": "title,author"}, headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_import_recipes(client: AsyncClient, create_test_user):
+    user = await create_test_user(is_verified=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user", "user:verified"])
+
+    body = "\n".join([
+        '{"title": "Soup", "ingredients": [{"name": "water", "quantity": "1 l"}, {"name": "salt", "quantity": "5 g"}]}',
+        '{"title": "Broken"',
+        '{"title": "Toast", "description": "Crispy", "ingredients": [{"name": "bread", "quantity": "2"}]}',
+        '{"ingredients": []}',
+    ])
+    response = await client.post("/profile/my-recipes/import", content=body,
+                                 headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 201
+    report = response.json()["data"]
+    assert report["imported"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 4]
+
+    csv_body = 'title,description,ingredients\nPancakes,"Fluffy,\nand sweet","[{""name"": ""salt"", ""quantity"": ""1 g""}]"\n'
+    response = await client.post("/profile/my-recipes/import", content=csv_body,
+                                 headers={**headers, "Content-Type": "text/csv"})
+    assert response.json()["data"] == {"imported": 1, "failed": 0, "errors": []}
+
+    recipes = (await client.get("/profile/my-recipes", headers=headers)).json()["data"]
+    by_title = {recipe["title"]: recipe for recipe in recipes}
+    assert set(by_title) == {"Soup", "Toast", "Pancakes"}
+    assert by_title["Pancakes"]["description"] == "Fluffy,\nand sweet"
+    assert sorted(by_title["Soup"]["ingredients"], key=lambda ing: ing["name"]) == [
+        {"name": "salt", "quantity": "5 g"}, {"name": "water", "quantity": "1 l"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_my_recipes(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    recipes = [await create_test_recipe(user_id=user.user_id, title=f"recipe {i}", ingredients=[]) for i in range(3)]
+    expected = sorted((RecipeResponse.model_validate(recipe).model_dump(mode="json") for recipe in recipes),
+                      key=lambda recipe: recipe["recipe_id"])
+
+    response = await client.get("/profile/my-recipes/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+    response = await client.get("/profile/my-recipes/export", params={"format": "zip"}, headers=headers)
+    assert response.headers["content-disposition"].endswith('.zip"')
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert json.loads(archive.read("recipes.json")) == expected
+    assert json.loads(archive.read("images.json")) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("export_format", ["ndjson", "zip"])
+async def test_export_memory_is_flat(create_test_user, export_format):
+    async def peak_memory(user_id, count: int) -> int:
+        async with get_root_async_session() as session:
+            await session.execute(insert(Recipe), [
+                {"user_id": user_id, "title": f"recipe {i}", "description": "x" * 500} for i in range(count)
+            ])
+            await session.commit()
+        tracemalloc.start()
+        async for _ in RecipeExportService(get_root_async_session).export(user_id, export_format):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    small = await create_test_user(username="small", email="small@example.com")
+    large = await create_test_user(username="large", email="large@example.com")
+    # both above one fetch batch, the larger export is ten times the data
+    small_peak = await peak_memory(small.user_id, 1000)
+    large_peak = await peak_memory(large.user_id, 10000)
+    assert large_peak < small_peak * 1.5
+
+
+@pytest.mark.asyncio
+async def test_post_recipe_idempotency_key(client: AsyncClient, create_test_user):
+    user = await create_test_user(is_verified=True)
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user", "user:verified"])
+    headers["Idempotency-Key"] = "3f1c9a52-retry"
+    payload = {"title": "Soup", "ingredients": [{"name": "water", "quantity": "1 l"}]}
+
+    first = await client.post("/profile/my-recipes/upload", json=payload, headers=headers)
+    assert first.status_code == 201
+    retry = await client.post("/profile/my-recipes/upload", json=payload, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+
+    recipes = (await client.get("/profile/my-recipes", headers=headers)).json()["data"]
+    assert len(recipes) == 1
+
+    response = await client.post("/profile/my-recipes/upload", json={**payload, "title": "Stew"}, headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_update_recipe_if_match(client: AsyncClient, create_test_user, create_test_recipe):
+    user = await create_test_user()
+    headers = create_test_auth_headers_for_user(str(user.user_id), ["user"])
+    recipe = await create_test_recipe(user_id=user.user_id)
+    params = {"recipe_id": str(recipe.recipe_id)}
+
+    first = await client.patch("/profile/my-recipes/update", params=params, json={"title": "first"},
+                               headers={**headers, "If-Match": '"recipe-1"'})
+    assert first.status_code == 201
+    assert first.headers["etag"] == '"recipe-2"'
+    assert first.json()["data"]["version"] == 2
+
+    # a second editor still holding version 1 does not overwrite the first one
+    stale = await client.patch("/profile/my-recipes/update", params=params, json={"title": "second"},
+                               headers={**headers, "If-Match": '"recipe-1"'})
+    assert stale.status_code == 412
+
+    response = await client.delete("/profile/my-recipes/delete", params=params,
+                                   headers={**headers, "If-Match": '"recipe-1"'})
+    assert response.status_code == 412
+
+    recipes = (await client.get("/profile/my-recipes", headers=headers)).json()["data"]
+    assert [(recipe["title"], recipe["version"]) for recipe in recipes] == [("first", 2)]
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from app.repository.dataloader import DataLoader, get_loader
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+
+class Batches:
+    """Batch function recording its calls and how many of them overlapped."""
+
+    def __init__(self, calls=None, active=None) -> None:
+        self.calls = [] if calls is None else calls
+        self.active = [0, 0] if active is None else active  # running now, most at once
+        self.fail = False
+
+    async def __call__(self, keys):
+        self.calls.append(list(keys))
+        self.active[0] += 1
+        self.active[1] = max(self.active)
+        try:
+            await asyncio.sleep(0)
+            if self.fail:
+                raise ValueError("boom")
+            return {key: f"value {key}" for key in keys if key != "missing"}
+        finally:
+            self.active[0] -= 1
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_lookups_of_a_tick_are_coalesced():
+    batches = Batches()
+    loader = DataLoader("test", batches)
+    values = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("missing"))
+    assert values == ["value a", "value b", "value a", None]
+    assert batches.calls == [["a", "b", "missing"]]
+
+
+@pytest.mark.asyncio
+async def test_chunks_run_one_after_another():
+    batches = Batches()
+    loader = DataLoader("test", batches, max_batch_size=2)
+    values = await asyncio.gather(*(loader.load(key) for key in "abcde"))
+    assert values == [f"value {key}" for key in "abcde"]
+    assert batches.calls == [["a", "b"], ["c", "d"], ["e"]]
+    assert batches.active[1] == 1
+
+
+@pytest.mark.asyncio
+async def test_loaders_of_a_session_do_not_overlap(session):
+    calls, active = [], [0, 0]
+    users = get_loader(session, "users", Batches(calls, active))
+    recipes = get_loader(session, "recipes", Batches(calls, active))
+    assert get_loader(session, "users", Batches()) is users
+
+    await asyncio.gather(users.load("a"), recipes.load("b"), users.load("c"))
+    assert sorted(calls) == [["a", "c"], ["b"]]
+    assert active[1] == 1
+
+
+@pytest.mark.asyncio
+async def test_values_are_memoized_and_failures_are_not():
+    batches = Batches()
+    loader = DataLoader("test", batches)
+    assert await loader.load("a") == "value a"
+    assert await loader.load("a") == "value a"
+    assert batches.calls == [["a"]]
+
+    batches.fail = True
+    with pytest.raises(ValueError):
+        await loader.load("b")
+    batches.fail = False
+    assert await loader.load("b") == "value b"
+    assert batches.calls == [["a"], ["b"], ["b"]]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_is_not_memoized():
+    batches = Batches()
+    loader = DataLoader("test", batches, max_batch_size=1)
+
+    async def cancel_batches(keys, calls):
+        lookups = [asyncio.ensure_future(loader.load(key)) for key in keys]
+        while len(batches.calls) < calls or not loader._tasks:
+            await asyncio.sleep(0)
+        for task in list(loader._tasks):
+            task.cancel()
+        return await asyncio.gather(*lookups, return_exceptions=True)
+
+    # cancelled before it started
+    results = await cancel_batches("ab", calls=0)
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert not loader._futures and batches.calls == []
+
+    # cancelled while loading the first chunk, the second is never loaded
+    results = await cancel_batches("ab", calls=1)
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert not loader._futures and batches.calls == [["a"]]
+    assert await loader.load("b") == "value b"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("write", [
+    lambda session: (session.add(Item(id=1)), session.flush()),
+    lambda session: (session.execute(text("SELECT 1")), session.commit()),
+    lambda session: (session.execute(text("SELECT 1")), session.rollback()),
+])
+async def test_loaders_are_cleared_when_the_session_writes(session, write):
+    batches = Batches()
+    loader = get_loader(session, "test", batches)
+    assert await loader.load("a") == "value a"
+
+    # a lookup in flight is kept
+    pending = asyncio.ensure_future(loader.load("b"))
+    await asyncio.sleep(0)
+    write(session)
+    assert await pending == "value b"
+
+    assert await loader.load("a") == "value a"
+    assert await loader.load("b") == "value b"
+    assert batches.calls == [["a"], ["b"], ["a"]]
@@ -0,0 +1,179 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+
+from app.services.invalidation_bus import InvalidationBackend, InvalidationBus
+
+
+class FakeBackend(InvalidationBackend):
+    """Fails the first `failures` connection attempts, stays connected until `drop` is called."""
+
+    reconnect_delay = 0.01
+    max_reconnect_delay = 0.01
+
+    def __init__(self, failures: int = 0) -> None:
+        super().__init__("invalidation-test")
+        self.failures = failures
+        self.failing_publishes = 0
+        self.connected = False
+        self.sent = []
+        self._lost = asyncio.Event()
+
+    async def _listen(self, connected) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("refused")
+        self._lost = asyncio.Event()
+        self.connected = True
+        try:
+            connected()
+            await self._lost.wait()
+        finally:
+            self.connected = False
+
+    def drop(self) -> None:
+        self._lost.set()
+
+    async def publish(self, payload: str) -> None:
+        if not self.connected or self.failing_publishes:
+            self.failing_publishes = max(self.failing_publishes - 1, 0)
+            raise ConnectionError("not connected")
+        self.sent.append(json.loads(payload))
+
+    def sent_tags(self) -> set:
+        return {tag for message in self.sent for tag in message["t"]}
+
+
+class Subscriber:
+    def __init__(self, bus: InvalidationBus) -> None:
+        self.tags = []
+        self.flushes = 0
+        bus.subscribe(self.tags.extend, self.flush)
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+
+async def until(condition) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError("condition not met in time")
+
+
+@pytest.mark.asyncio
+async def test_publishes_to_backend_and_locally():
+    bus = InvalidationBus()
+    subscriber = Subscriber(bus)
+    backend = FakeBackend()
+    await bus.start(backend)
+    try:
+        await until(lambda: backend.connected)
+        bus.publish(["recipe:1", "recipes"])
+        assert sorted(subscriber.tags) == ["recipe:1", "recipes"]
+        await until(lambda: backend.sent)
+        assert backend.sent[0]["t"] == ["recipe:1", "recipes"]
+        assert backend.sent[0]["o"] == bus.origin
+        # connected right away, nothing was missed
+        assert subscriber.flushes == 0
+    finally:
+        await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_first_connect_after_failures_flushes_and_sends_pending():
+    bus = InvalidationBus(retry_interval=60)
+    subscriber = Subscriber(bus)
+    backend = FakeBackend(failures=2)
+    await bus.start(backend)
+    try:
+        bus.publish(["recipe:1"])
+        await until(lambda: backend.connected)
+        # tags published before the first connect are sent once it succeeds, without waiting for the timer
+        await until(lambda: backend.sent)
+        assert backend.sent_tags() == {"recipe:1"}
+        assert subscriber.flushes == 1
+    finally:
+        await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_flushes_and_sends_pending():
+    bus = InvalidationBus(retry_interval=60)
+    subscriber = Subscriber(bus)
+    backend = FakeBackend()
+    await bus.start(backend)
+    try:
+        await until(lambda: backend.connected)
+        backend.drop()
+        bus.publish(["recipe:2"])
+        await until(lambda: subscriber.flushes == 1)
+        await until(lambda: backend.sent)
+        assert backend.sent_tags() == {"recipe:2"}
+    finally:
+        await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_pending_tags_are_retried_while_connected():
+    bus = InvalidationBus(retry_interval=0.02)
+    subscriber = Subscriber(bus)
+    backend = FakeBackend()
+    await bus.start(backend)
+    try:
+        await until(lambda: backend.connected)
+        backend.failing_publishes = 2
+        bus.publish(["recipe:1"])
+        bus.publish(["recipe:2"])
+        await until(lambda: backend.sent)
+        assert backend.sent_tags() == {"recipe:1", "recipe:2"}
+        assert subscriber.flushes == 0
+        assert not bus._pending and bus._retry is None
+    finally:
+        await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_too_many_pending_tags_send_a_flush():
+    bus = InvalidationBus(retry_interval=60)
+    backend = FakeBackend()
+    await bus.start(backend)
+    try:
+        await until(lambda: backend.connected)
+        backend.failing_publishes = 1
+        with mock.patch("app.services.invalidation_bus.MAX_PENDING_TAGS", 2):
+            bus.publish(["recipe:1", "recipe:2", "recipe:3"])
+            await until(lambda: bus._pending_flush)
+        assert not bus._pending
+        backend.drop()
+        await until(lambda: backend.sent)
+        assert backend.sent[0]["f"] is True
+    finally:
+        await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_receives_messages_of_other_workers():
+    bus = InvalidationBus()
+    subscriber = Subscriber(bus)
+    other = InvalidationBus()
+
+    bus._receive(other._encode(["recipe:1"]))
+    bus._receive(bus._encode(["recipe:2"]))
+    bus._receive("not json")
+    assert subscriber.tags == ["recipe:1"]
+
+    bus._receive(other._encode([], flush=True))
+    assert subscriber.flushes == 1
+
+
+def test_backend_must_implement_publish_and_listen():
+    class ListenOnly(InvalidationBackend):
+        async def _listen(self, connected) -> None:
+            connected()
+
+    with pytest.raises(TypeError):
+        ListenOnly("invalidation-test")
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from app.services.response_cache import CachedBody, ResponseCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def body(size: int, *tags: str) -> CachedBody:
+    return CachedBody(b"x" * size, tags=frozenset(tags))
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ResponseCache(max_bytes=10, default_ttl=30, clock=Clock())
+    cache.set("a", body(4))
+    cache.set("b", body(4))
+    assert cache.get("a") is not None
+    cache.set("c", body(4))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+    # larger than the whole cache, not stored and nothing evicted for it
+    cache.set("d", body(11))
+    assert cache.get("d") is None
+    assert cache.get("a") is not None
+
+    # replacing an entry does not count it twice
+    cache.set("a", body(6))
+    assert cache.get("c") is not None
+    assert cache._size == 10
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=clock)
+    cache.set("default", body(1))
+    cache.set("short", body(1), ttl=5)
+    clock.now = 5
+    assert cache.get("short") is None
+    assert cache.get("default") is not None
+    clock.now = 30
+    assert cache.get("default") is None
+    assert cache._size == 0
+
+
+def test_invalidation_by_tag():
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=Clock())
+    cache.set("recipe", body(2, "recipe:1"))
+    cache.set("list", body(3, "recipe:1", "recipes"))
+    cache.set("profile", body(4, "user:1"))
+
+    cache.invalidate_tags(["recipe:1"])
+    assert cache.get("recipe") is None and cache.get("list") is None
+    assert cache.get("profile") is not None
+    assert cache._size == 4
+    assert set(cache._tags) == {"user:1"}
+
+    cache.clear()
+    assert cache.get("profile") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_compute_once():
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=Clock())
+    calls = []
+    release = asyncio.Event()
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        return body(3)
+
+    callers = [asyncio.ensure_future(cache.get_or_compute("key", compute)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    entries = await asyncio.gather(*callers)
+    assert len(calls) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert await cache.get_or_compute("key", compute) is entries[0]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_waiter_takes_over_from_cancelled_leader():
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=Clock())
+    started = []
+    release = asyncio.Event()
+
+    async def compute():
+        started.append(1)
+        await release.wait()
+        return body(len(started))
+
+    leader = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    waiters = [asyncio.ensure_future(cache.get_or_compute("key", compute)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    await asyncio.sleep(0)
+    release.set()
+    entries = await asyncio.gather(*waiters)
+    # one waiter computed again, the others waited for it
+    assert len(started) == 2
+    assert all(entry.size == 2 for entry in entries)
+
+    # a cancelled waiter does not cancel the computation
+    release.clear()
+    cache.clear()
+    leader = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    release.set()
+    assert (await leader).size == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_waiters_and_are_not_cached():
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=Clock())
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise ValueError("boom")
+
+    callers = [asyncio.ensure_future(cache.get_or_compute("key", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get("key") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(("invalidate", "stored"), [
+    (lambda cache: cache.invalidate_tags(["user:2", "taken:abc"]), True),
+    (lambda cache: cache.invalidate_tags(["user:2", "recipe:1"]), False),
+    (lambda cache: cache.clear(), False),
+])
+async def test_invalidation_during_compute(invalidate, stored):
+    cache = ResponseCache(max_bytes=100, default_ttl=30, clock=Clock())
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return body(3, "recipe:1", "recipes")
+
+    computing = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    invalidate(cache)
+    release.set()
+    assert (await computing).size == 3
+    # only an invalidation of the entry's own tags keeps it from being stored
+    assert (cache.get("key") is not None) is stored
+    assert not cache._watches
@@ -0,0 +1,98 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.services.auth_services.token_epochs import TokenEpochCache
+from app.services.invalidation_bus import InvalidationBus, user_tag
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Epochs:
+    """Token epochs as stored in the database, counting the loads."""
+
+    def __init__(self) -> None:
+        self.epochs = {}
+        self.loads = 0
+
+    async def __call__(self, user_id: uuid.UUID):
+        self.loads += 1
+        await asyncio.sleep(0)
+        return self.epochs.get(user_id)
+
+
+def make_cache(clock: Clock) -> TokenEpochCache:
+    return TokenEpochCache(max_entries=2, ttl=5, negative_ttl=1, clock=clock)
+
+
+@pytest.mark.asyncio
+async def test_revocation_takes_effect_within_ttl_when_a_message_is_lost():
+    clock = Clock()
+    cache = make_cache(clock)
+    bus, other_worker = InvalidationBus(), InvalidationBus()
+    bus.subscribe(cache.invalidate_tags, cache.clear)
+    database = Epochs()
+    user_id = uuid.uuid4()
+    database.epochs[user_id] = 1
+
+    assert await cache.get(user_id, database) == 1
+    # signed out on another worker, its invalidation message never arrives
+    database.epochs[user_id] = 2
+    clock.now = 4.9
+    assert await cache.get(user_id, database) == 1
+    clock.now = 5
+    assert await cache.get(user_id, database) == 2
+    assert database.loads == 2
+
+    # a delivered message takes effect right away
+    database.epochs[user_id] = 3
+    bus._receive(other_worker._encode([user_tag(user_id)]))
+    assert await cache.get(user_id, database) == 3
+
+
+@pytest.mark.asyncio
+async def test_unknown_users_are_cached_briefly():
+    clock = Clock()
+    cache = make_cache(clock)
+    database = Epochs()
+    user_id = uuid.uuid4()
+
+    assert await cache.get(user_id, database) is None
+    assert await cache.get(user_id, database) is None
+    assert database.loads == 1
+    database.epochs[user_id] = 1
+    clock.now = 1
+    assert await cache.get(user_id, database) == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_are_evicted():
+    cache = make_cache(Clock())
+    database = Epochs()
+    users = [uuid.uuid4() for _ in range(3)]
+    for user_id in users[:2]:
+        await cache.get(user_id, database)
+    await cache.get(users[0], database)
+    await cache.get(users[2], database)
+    assert list(cache._epochs) == [users[0], users[2]]
+
+
+@pytest.mark.asyncio
+async def test_load_across_invalidation_is_not_stored():
+    cache = make_cache(Clock())
+    database = Epochs()
+    user_id = uuid.uuid4()
+    database.epochs[user_id] = 1
+
+    loading = asyncio.ensure_future(cache.get(user_id, database))
+    await asyncio.sleep(0)
+    cache.invalidate_tags([user_tag(uuid.uuid4())])
+    assert await loading == 1
+    assert user_id not in cache._epochs
@@ -0,0 +1,101 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from prometheus_client import REGISTRY
+
+from utils.logging_pipeline import DroppingQueueHandler, EndpointFilter, JsonFormatter, TraceContextFilter
+
+
+def make_record(msg="message %s", args=("arg",), exc_info=None, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("app.test", logging.INFO, "/app/test.py", 7, msg, args, exc_info)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def access_record(path) -> logging.LogRecord:
+    return make_record('%s - "%s %s HTTP/%s" %d', ("127.0.0.1:5000", "GET", path, "1.1", 200))
+
+
+@pytest.mark.parametrize(("record", "kept"), [
+    (access_record("/metrics"), False),
+    (access_record("/metrics?format=openmetrics"), False),
+    (access_record("/recipes/"), True),
+    (access_record("/metrics/extra"), True),
+    (access_record(None), True),
+    (make_record("%s %s %s", ("a", "b", "/metrics")), True),
+    (make_record("%(path)s", ({"path": "/metrics"},)), True),
+    (make_record("no args", ()), True),
+    (make_record("no args", None), True),
+])
+def test_endpoint_filter(record, kept):
+    assert EndpointFilter().filter(record) is kept
+
+
+def test_trace_context_filter():
+    record = make_record()
+    assert TraceContextFilter("recipes").filter(record)
+    assert (record.trace_id, record.span_id, record.service_name) == ("0", "0", "recipes")
+
+    tracer = TracerProvider().get_tracer(__name__)
+    with tracer.start_as_current_span("request") as span:
+        record = make_record()
+        TraceContextFilter("recipes").filter(record)
+    context = span.get_span_context()
+    assert record.trace_id == format(context.trace_id, "032x")
+    assert record.span_id == format(context.span_id, "016x")
+
+
+def test_json_formatter():
+    record = make_record(user_id="42", trace_id="abc", span_id="def", service_name="recipes")
+    payload = json.loads(JsonFormatter().format(record))
+    assert payload["message"] == "message arg"
+    assert payload["level"] == "INFO"
+    assert payload["logger"] == "app.test"
+    assert payload["file"] == "test.py:7"
+    assert (payload["trace_id"], payload["span_id"], payload["service.name"]) == ("abc", "def", "recipes")
+    # fields passed through `extra=` are kept, the standard attributes are not repeated
+    assert payload["user_id"] == "42"
+    assert "args" not in payload and "levelno" not in payload
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(exc_info=sys.exc_info())
+    payload = json.loads(JsonFormatter().format(record))
+    assert "ValueError: boom" in payload["exception"]
+    assert payload["trace_id"] == "0"
+
+
+def test_queue_handler_drops_on_full_queue():
+    log_queue = queue.Queue(maxsize=2)
+    handler = DroppingQueueHandler(log_queue)
+    dropped_before = REGISTRY.get_sample_value("fastapi_log_records_dropped_total") or 0
+
+    arguments = ["mutable"]
+    for i in range(5):
+        handler.handle(make_record("record %s %s", (i, arguments)))
+    arguments.append("changed")
+
+    assert REGISTRY.get_sample_value("fastapi_log_records_dropped_total") == dropped_before + 3
+    queued = [log_queue.get_nowait(), log_queue.get_nowait()]
+    # the message was merged when queued, before the arguments changed
+    assert [record.getMessage() for record in queued] == ["record 0 ['mutable']", "record 1 ['mutable']"]
+    assert all(record.args is None for record in queued)
+
+
+def test_queue_handler_keeps_exception_apart():
+    handler = DroppingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        handler.handle(make_record(exc_info=sys.exc_info()))
+    record = handler.queue.get_nowait()
+    assert record.exc_info is None
+    assert "ValueError: boom" in record.exc_text
+    assert record.getMessage() == "message arg"
+    assert "ValueError: boom" in json.loads(JsonFormatter().format(record))["exception"]
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+from httpx import AsyncClient
+from httpx._transports.asgi import ASGITransport
+from starlette.responses import PlainTextResponse
+
+from utils.profiler import ProfilerMiddleware, RequestProfiler
+
+
+def http_scope(path: str = "/recipes/", headers: tuple = ()) -> dict:
+    return {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+
+
+async def busy_app(scope, receive, send):
+    # blocks the event loop thread, which is the thread the sampler watches
+    time.sleep(0.05)
+    await PlainTextResponse("ok")(scope, receive, send)
+
+
+def test_token_header():
+    profiler = RequestProfiler(token="s3cret", interval=0.001, min_interval=0, max_profiles=10)
+    assert profiler.enabled
+    assert profiler.wants(http_scope(headers=[(b"x-profile-request", b"s3cret")]))
+    assert not profiler.wants(http_scope(headers=[(b"x-profile-request", b"s3cre")]))
+    assert not profiler.wants(http_scope(headers=[(b"x-profile-request", b"wrong!")]))
+    assert not profiler.wants(http_scope())
+
+
+def test_arm_and_disarm():
+    profiler = RequestProfiler(token=None, interval=0.001, min_interval=0, max_profiles=10)
+    assert not profiler.enabled
+    assert not profiler.wants(http_scope())
+
+    profiler.arm("/recipes", 2)
+    assert profiler.enabled
+    assert profiler.wants(http_scope("/recipes/1"))
+    assert not profiler.wants(http_scope("/profile/"))
+
+    # each acquired profile uses up one armed request
+    assert profiler.acquire()
+    assert profiler.armed_count == 1
+    profiler.release(object())
+
+    profiler.disarm()
+    assert not profiler.enabled
+    assert profiler.armed_path is None
+    assert not profiler.wants(http_scope("/recipes/1"))
+
+
+def test_rate_limit():
+    profiler = RequestProfiler(token="s3cret", interval=0.001, min_interval=60, max_profiles=10)
+    assert profiler.acquire()
+    # one profile at a time
+    assert not profiler.acquire()
+    profiler.release(object())
+    # and none until min_interval has passed since the last one started
+    assert not profiler.acquire()
+
+    profiler.min_interval = 0
+    assert profiler.acquire()
+
+
+@pytest.mark.asyncio
+async def test_middleware_captures_profile():
+    profiler = RequestProfiler(token="s3cret", interval=0.001, min_interval=60, max_profiles=10)
+    transport = ASGITransport(app=ProfilerMiddleware(busy_app, profiler))
+    async with AsyncClient(transport=transport, base_url="http://localhost") as client:
+        response = await client.get("/recipes/", headers={"X-Profile-Request": "s3cret"})
+        assert response.status_code == 200
+        profile_id = response.headers["X-Profile-Id"]
+
+        # rate limited, the request runs unprofiled
+        response = await client.get("/recipes/", headers={"X-Profile-Request": "s3cret"})
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+
+        response = await client.get("/recipes/", headers={"X-Profile-Request": "wrong"})
+        assert "X-Profile-Id" not in response.headers
+
+    profile = profiler.get(profile_id)
+    assert [p.profile_id for p in profiler.profiles] == [profile_id]
+    assert profile.path == "/recipes/"
+    assert profile.duration >= 0.05
+    assert sum(profile.samples.values()) > 0
+    assert "busy_app" in profile.to_collapsed()
+    speedscope = profile.to_speedscope()
+    assert speedscope["profiles"][0]["samples"]
+    assert len(speedscope["profiles"][0]["samples"]) == len(speedscope["profiles"][0]["weights"])
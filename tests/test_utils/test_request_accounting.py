@@ -0,0 +1,138 @@
+import asyncio
+import time
+import tracemalloc
+
+import pytest
+from httpx import AsyncClient
+from httpx._transports.asgi import ASGITransport
+from prometheus_client import REGISTRY
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from utils.prometheus_logging import PrometheusMiddleware
+from utils.request_accounting import ResourceUsage, accounted, install_task_factory, metered
+
+
+def burn(seconds: float) -> None:
+    deadline = time.thread_time() + seconds
+    while time.thread_time() < deadline:
+        pass
+
+
+async def burn_in_steps(steps: int, seconds: float) -> None:
+    for _ in range(steps):
+        burn(seconds)
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_interleaved_requests_are_not_counted():
+    install_task_factory(asyncio.get_running_loop())
+    light, heavy = ResourceUsage(), ResourceUsage()
+
+    async def light_request():
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+    await asyncio.gather(metered(light_request(), light), metered(burn_in_steps(20, 0.005), heavy))
+    assert heavy.cpu_seconds >= 0.1
+    assert light.cpu_seconds < 0.02
+
+
+@pytest.mark.asyncio
+async def test_child_tasks_and_threadpool_calls_are_counted():
+    install_task_factory(asyncio.get_running_loop())
+    usage = ResourceUsage()
+
+    async def request():
+        # tasks started by the request, e.g. by BaseHTTPMiddleware, inherit its usage
+        await asyncio.gather(asyncio.ensure_future(burn_in_steps(5, 0.01)), burn_in_steps(5, 0.01))
+        await run_in_threadpool(accounted(burn), 0.05)
+        # not wrapped, so not accounted
+        await run_in_threadpool(burn, 0.05)
+
+    outside = asyncio.ensure_future(burn_in_steps(5, 0.01))
+    await metered(request(), usage)
+    await outside
+    assert 0.15 <= usage.cpu_seconds < 0.2
+
+
+@pytest.mark.asyncio
+async def test_exceptions_and_cancellation_pass_through():
+    usage = ResourceUsage()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await metered(failing(), usage)
+
+    cancelled = []
+
+    async def waiting():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    task = asyncio.ensure_future(metered(waiting(), usage))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert cancelled == [True]
+
+
+@pytest.mark.asyncio
+async def test_allocations():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        usage, other = ResourceUsage(trace_allocations=True), ResourceUsage(trace_allocations=True)
+
+        async def allocating(size: int):
+            for _ in range(3):
+                buffer = bytearray(size)
+                del buffer
+                await asyncio.sleep(0)
+
+        async def not_metered():
+            kept = []
+            for _ in range(3):
+                kept.append(bytearray(4 << 20))
+                await asyncio.sleep(0)
+
+        await asyncio.gather(metered(allocating(1 << 20), usage), metered(allocating(1024), other), not_metered())
+        # freed within the step, still counted
+        assert 3_000_000 <= usage.allocated_bytes < 4 << 20
+        assert other.allocated_bytes < 1 << 20
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+@pytest.mark.asyncio
+async def test_middleware_observes_sampled_requests():
+    async def busy(request):
+        await burn_in_steps(5, 0.01)
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/busy", busy)])
+    app.add_middleware(PrometheusMiddleware, app_name="accounting-test", cpu_sample_rate=1.0)
+    labels = {"method": "GET", "path": "/busy", "app_name": "accounting-test"}
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://localhost") as client:
+        idle = asyncio.ensure_future(burn_in_steps(10, 0.01))
+        response = await client.get("/busy")
+        await idle
+    assert response.status_code == 200
+
+    assert REGISTRY.get_sample_value("fastapi_requests_cpu_seconds_count", labels) == 1
+    cpu = REGISTRY.get_sample_value("fastapi_requests_cpu_seconds_sum", labels)
+    assert 0.05 <= cpu < 0.09
@@ -0,0 +1,138 @@
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import Decision
+from opentelemetry.trace.status import Status, StatusCode
+from prometheus_client import REGISTRY
+
+from utils.tracing import (CountingBatchSpanProcessor, RouteRatioSampler, TailSamplingSpanProcessor,
+                           make_sampler, sentry_traces_sampler)
+
+MS = 1_000_000
+
+
+def make_tracer(sample_rate: float, slow_request_ms: int = 100, max_buffered_spans: int = 100):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(sampler=make_sampler(sample_rate, {}))
+    provider.add_span_processor(
+        TailSamplingSpanProcessor(SimpleSpanProcessor(exporter), slow_request_ms, max_buffered_spans)
+    )
+    return provider.get_tracer(__name__), exporter
+
+
+def run_trace(tracer, name: str, duration_ms: int = 10, children: int = 1, error: bool = False) -> None:
+    root = tracer.start_span(name, start_time=0)
+    context = trace.set_span_in_context(root)
+    for i in range(children):
+        child = tracer.start_span(f"query {i}", context=context, start_time=MS)
+        if error:
+            child.set_status(Status(StatusCode.ERROR))
+        child.end(end_time=2 * MS)
+    root.end(end_time=duration_ms * MS)
+
+
+def exported_names(exporter: InMemorySpanExporter) -> list:
+    return [span.name for span in exporter.get_finished_spans()]
+
+
+def test_head_sampled_spans_pass_through():
+    tracer, exporter = make_tracer(sample_rate=1.0)
+    root = tracer.start_span("GET /recipes/", start_time=0)
+    child = tracer.start_span("query", context=trace.set_span_in_context(root), start_time=MS)
+    child.end(end_time=2 * MS)
+    # exported before the trace is complete
+    assert exported_names(exporter) == ["query"]
+    root.end(end_time=3 * MS)
+    assert exported_names(exporter) == ["query", "GET /recipes/"]
+
+
+def test_error_and_slow_traces_are_kept():
+    tracer, exporter = make_tracer(sample_rate=0.0, slow_request_ms=100)
+
+    def kept(rule: str) -> float:
+        return REGISTRY.get_sample_value("fastapi_trace_spans_kept_total", {"rule": rule}) or 0
+
+    def dropped() -> float:
+        return REGISTRY.get_sample_value("fastapi_trace_spans_dropped_total", {"reason": "sampled_out"}) or 0
+
+    kept_error, kept_slow, dropped_before = kept("error"), kept("slow"), dropped()
+
+    run_trace(tracer, "GET /fast")
+    assert exported_names(exporter) == []
+    assert dropped() == dropped_before + 2
+
+    run_trace(tracer, "GET /failing", error=True)
+    assert exported_names(exporter) == ["query 0", "GET /failing"]
+    assert all(span.context.trace_flags.sampled for span in exporter.get_finished_spans())
+    assert kept("error") == kept_error + 2
+    exporter.clear()
+
+    run_trace(tracer, "GET /slow", duration_ms=150, children=2)
+    assert exported_names(exporter) == ["query 0", "query 1", "GET /slow"]
+    assert kept("slow") == kept_slow + 3
+
+
+def test_buffer_evicts_oldest_traces():
+    tracer, exporter = make_tracer(sample_rate=0.0, max_buffered_spans=2)
+    evicted_before = REGISTRY.get_sample_value("fastapi_trace_spans_dropped_total", {"reason": "buffer_full"}) or 0
+
+    first = tracer.start_span("GET /first", start_time=0)
+    for i in range(2):
+        tracer.start_span(f"first {i}", context=trace.set_span_in_context(first), start_time=MS).end(end_time=MS)
+    # the buffer is full, buffering a span of another trace evicts the whole first trace
+    run_trace(tracer, "GET /second", error=True)
+    assert exported_names(exporter) == ["query 0", "GET /second"]
+    assert REGISTRY.get_sample_value("fastapi_trace_spans_dropped_total", {"reason": "buffer_full"}) == evicted_before + 2
+
+    # only the root is left of the evicted trace
+    exporter.clear()
+    first.set_status(Status(StatusCode.ERROR))
+    first.end(end_time=MS)
+    assert exported_names(exporter) == ["GET /first"]
+
+
+@pytest.mark.parametrize(("name", "decision"), [
+    ("GET /healthz", Decision.DROP),
+    ("GET /profile/", Decision.DROP),
+    ("GET /profile/my-recipes/export", Decision.RECORD_AND_SAMPLE),
+    ("POST /recipes/", Decision.RECORD_AND_SAMPLE),
+])
+def test_route_ratio_sampler(name, decision):
+    sampler = RouteRatioSampler(1.0, {"/healthz": 0.0, "/profile": 0.0, "/profile/my-recipes": 1.0},
+                                record_unsampled=False)
+    assert sampler.should_sample(None, 0x1234, name).decision is decision
+
+    recording = RouteRatioSampler(1.0, {"/healthz": 0.0, "/profile": 0.0, "/profile/my-recipes": 1.0})
+    expected = Decision.RECORD_ONLY if decision is Decision.DROP else decision
+    assert recording.should_sample(None, 0x1234, name).decision is expected
+
+
+def test_sentry_traces_sampler():
+    sampler = sentry_traces_sampler(0.5, {"/healthz": 0.0, "/auth": 1.0})
+    assert sampler({"asgi_scope": {"path": "/healthz"}}) == 0.0
+    assert sampler({"asgi_scope": {"path": "/auth/login"}}) == 1.0
+    assert sampler({"asgi_scope": {"path": "/recipes/"}}) == 0.5
+    assert sampler({"parent_sampled": True, "asgi_scope": {"path": "/healthz"}}) == 1.0
+
+
+def test_counting_batch_processor_counts_full_queue():
+    processor = CountingBatchSpanProcessor(
+        InMemorySpanExporter(), max_queue_size=2, max_export_batch_size=2, schedule_delay_millis=60000
+    )
+    provider = TracerProvider()
+    tracer = provider.get_tracer(__name__)
+    full_before = REGISTRY.get_sample_value("fastapi_trace_export_queue_full_total") or 0
+    try:
+        queue = processor._batch_processor._queue
+        queued = tracer.start_span("queued")
+        queued.end()
+        queue.extend([queued, queued])
+
+        span = tracer.start_span("overflow")
+        span.end()
+        processor.on_end(span)
+        assert REGISTRY.get_sample_value("fastapi_trace_export_queue_full_total") == full_before + 1
+    finally:
+        processor.shutdown()
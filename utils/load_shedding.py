@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import json
+from typing import Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.prometheus_logging import REQUESTS_SHED, REQUESTS_WAITING
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of in-flight requests of a route group.
+    Requests over the cap wait in a bounded FIFO queue for at most `queue_timeout` seconds.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self) -> Optional[str]:
+        """
+        :return: None when a slot was acquired, otherwise the reason the request has to be shed
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            self._discard(waiter)
+            # the slot may have been handed over right before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        return None
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # hand the slot over, in_flight stays the same
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class LoadSheddingMiddleware:
+    """
+    Sheds load before it reaches the handlers:
+
+    * every route group (longest matching path prefix) has its own in-flight limit and wait queue;
+    * requests are rejected upfront while acquiring a database connection takes longer than the budget;
+    * handlers are cancelled as soon as the client disconnects before the response is complete.
+
+    Shed requests get 503 with Retry-After.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            route_limits: Dict[str, int],
+            max_queue: int = 100,
+            queue_timeout_ms: int = 2000,
+            pool_wait: Optional[Callable[[], float]] = None,
+            pool_wait_budget_ms: int = 500,
+            retry_after: int = 2,
+            exempt_paths: Iterable[str] = ("/metrics",),
+            app_name: str = "fastapi-app",
+    ) -> None:
+        self.app = app
+        self.groups: Tuple[Tuple[str, ConcurrencyLimiter], ...] = tuple(sorted(
+            ((prefix, ConcurrencyLimiter(limit, max_queue, queue_timeout_ms / 1000))
+             for prefix, limit in route_limits.items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        ))
+        self.pool_wait = pool_wait
+        self.pool_wait_budget = pool_wait_budget_ms / 1000
+        self.retry_after = retry_after
+        self.exempt_paths = frozenset(exempt_paths)
+        self.app_name = app_name
+
+    def get_group(self, path: str) -> Tuple[Optional[str], Optional[ConcurrencyLimiter]]:
+        if path in self.exempt_paths:
+            return None, None
+        for prefix, limiter in self.groups:
+            if path.startswith(prefix):
+                return prefix, limiter
+        return None, None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        group, limiter = self.get_group(scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self.pool_wait is not None and self.pool_wait() > self.pool_wait_budget:
+            await self.shed(group, "db_pool", send)
+            return
+
+        REQUESTS_WAITING.labels(route_group=group, app_name=self.app_name).inc()
+        try:
+            reason = await limiter.acquire()
+        finally:
+            REQUESTS_WAITING.labels(route_group=group, app_name=self.app_name).dec()
+        if reason is not None:
+            await self.shed(group, reason, send)
+            return
+
+        try:
+            await self.run_until_disconnect(group, scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def run_until_disconnect(self, group: str, scope: Scope, receive: Receive, send: Send) -> None:
+        loop = asyncio.get_running_loop()
+        disconnect: asyncio.Future = loop.create_future()
+        replay: Deque[Message] = collections.deque()
+        body_done = False
+        response_complete = False
+        watcher: Optional[asyncio.Task] = None
+
+        async def watch_disconnect() -> None:
+            message = await receive()
+            if not disconnect.done():
+                disconnect.set_result(message)
+            if message["type"] == "http.disconnect" and not response_complete:
+                app_task.cancel()
+
+        def request_consumed(message: Message) -> None:
+            nonlocal body_done, watcher
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                body_done = True
+                # from now on the only message left is the disconnect
+                watcher = loop.create_task(watch_disconnect())
+
+        async def wrapped_receive() -> Message:
+            if replay:
+                return replay.popleft()
+            if body_done:
+                return await asyncio.shield(disconnect)
+            message = await receive()
+            request_consumed(message)
+            return message
+
+        async def wrapped_send(message: Message) -> None:
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        if not _has_body(scope):
+            # handlers of bodiless requests usually never call receive(), read the empty body for them
+            message = await receive()
+            replay.append(message)
+            request_consumed(message)
+
+        app_task = loop.create_task(self.app(scope, wrapped_receive, wrapped_send))
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling() or not disconnect.done():
+                raise
+            REQUESTS_SHED.labels(route_group=group, reason="client_disconnect", app_name=self.app_name).inc()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+    async def shed(self, group: str, reason: str, send: Send) -> None:
+        REQUESTS_SHED.labels(route_group=group, reason=reason, app_name=self.app_name).inc()
+        body = json.dumps({
+            "success": False,
+            "data": None,
+            "message": "Service is overloaded, retry later",
+            "errors": [reason],
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _has_body(scope: Scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            return value != b"0"
+        if name == b"transfer-encoding":
+            return True
+    return False
@@ -0,0 +1,158 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable
+
+from opentelemetry import trace
+from prometheus_client import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    "fastapi_log_records_dropped_total",
+    "Total count of log records dropped because the logging queue was full",
+)
+
+TEXT_FORMAT = ("%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] "
+               "[trace_id=%(trace_id)s span_id=%(span_id)s resource.service.name=%(service_name)s] - %(message)s")
+
+# attributes every LogRecord has, anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "trace_id", "span_id", "service_name",
+    "otelTraceID", "otelSpanID", "otelServiceName", "otelTraceSampled",
+}
+
+
+class EndpointFilter(logging.Filter):
+    """
+    Uvicorn access log filter dropping requests to the given paths.
+    Reads the path from the record arguments instead of formatting the message.
+    """
+
+    def __init__(self, excluded_paths: Iterable[str] = ("/metrics",)) -> None:
+        super().__init__()
+        self.excluded_paths = frozenset(excluded_paths)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn.access args: (client_addr, method, full_path, http_version, status_code),
+        # any other record is let through as is
+        args = record.args
+        if not isinstance(args, tuple) or len(args) != 5:
+            return True
+        path = args[2]
+        if not isinstance(path, str):
+            return True
+        return path.partition("?")[0] not in self.excluded_paths
+
+
+class TraceContextFilter(logging.Filter):
+    """Stores the current trace context on the record while still in the logging thread."""
+
+    def __init__(self, service_name: str) -> None:
+        super().__init__()
+        self.service_name = service_name
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = trace.format_trace_id(context.trace_id)
+            record.span_id = trace.format_span_id(context.span_id)
+        else:
+            record.trace_id = record.span_id = "0"
+        record.service_name = self.service_name
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": f"{record.filename}:{record.lineno}",
+            "trace_id": getattr(record, "trace_id", "0"),
+            "span_id": getattr(record, "span_id", "0"),
+            "service.name": getattr(record, "service_name", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                payload[key] = value
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        elif record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller: records arriving at a full queue are dropped and counted."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # merge the arguments now, they may be mutated before the listener gets to them,
+        # but leave the exception apart so that formatters can render it as a separate field
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class SafeQueueListener(QueueListener):
+    def stop(self) -> None:
+        # stopping twice (explicitly and at exit) would fail on the already joined thread
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(
+        service_name: str,
+        level: str = "INFO",
+        fmt: str = "json",
+        max_queue_size: int = 10000,
+        stream=None
+) -> QueueListener:
+    """
+    Routes the root and uvicorn loggers through a bounded in-memory queue.
+    Callers only pay for building the record, the stream I/O and formatting happen on the listener thread.
+
+    :param fmt: "json" for structured output or "text" for the plain format with trace ids
+    :return: the started listener, stopped automatically at interpreter exit
+    """
+    log_queue: queue.Queue = queue.Queue(max_queue_size)
+
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(TraceContextFilter(service_name))
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    listener = SafeQueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+    logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
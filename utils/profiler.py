@@ -0,0 +1,219 @@
+import collections
+import hmac
+import itertools
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Counter, Deque, Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import Config
+
+Frame = Tuple[str, str, int]
+Stack = Tuple[Frame, ...]
+
+
+class StackSampler:
+    """
+    Samples the Python stack of a single thread from a background thread.
+
+    The request runs on the event loop thread, so samples also include any other coroutine
+    that happened to be scheduled while the profiled request was in flight.
+    """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[Stack] = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter[Stack]:
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+
+@dataclass
+class RequestProfile:
+    profile_id: str
+    method: str
+    path: str
+    started_at: float
+    interval: float
+    duration: float = 0.0
+    samples: Counter[Stack] = field(default_factory=collections.Counter)
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "samples": sum(self.samples.values()),
+        }
+
+    def to_collapsed(self) -> str:
+        """Brendan Gregg's collapsed stack format, accepted by flamegraph.pl and speedscope."""
+        lines = []
+        for stack, count in self.samples.most_common():
+            lines.append(";".join(f"{name} ({filename}:{line})" for name, filename, line in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        frames: List[dict] = []
+        frame_index: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "exporter": "recipe-share",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.method} {self.path}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+class RequestProfiler:
+    """
+    Keeps the profiler state shared by the middleware and the admin endpoints:
+    pending admin toggles, the rate limit and the last finished profiles.
+    """
+
+    def __init__(self, token: Optional[str], interval: float, min_interval: float, max_profiles: int) -> None:
+        self.token = token
+        self.interval = interval
+        self.min_interval = min_interval
+        self.profiles: Deque[RequestProfile] = collections.deque(maxlen=max_profiles)
+        self.armed_count = 0
+        self.armed_path: Optional[str] = None
+        self._running = False
+        self._last_started = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.armed_count > 0 or self.token is not None
+
+    def arm(self, path: Optional[str], count: int) -> None:
+        self.armed_path = path
+        self.armed_count = count
+
+    def disarm(self) -> None:
+        self.armed_path = None
+        self.armed_count = 0
+
+    def wants(self, scope: Scope) -> bool:
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == b"x-profile-request":
+                    # constant time, so response timing does not leak the token
+                    return hmac.compare_digest(value, self.token.encode())
+        if self.armed_count > 0:
+            return self.armed_path is None or scope["path"].startswith(self.armed_path)
+        return False
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        if self._running or now - self._last_started < self.min_interval:
+            return False
+        self._running = True
+        self._last_started = now
+        if self.armed_count > 0:
+            self.armed_count -= 1
+        return True
+
+    def release(self, profile: RequestProfile) -> None:
+        self._running = False
+        self.profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        return next((p for p in self.profiles if p.profile_id == profile_id), None)
+
+
+request_profiler = RequestProfiler(
+    token=Config.PROFILER_TOKEN,
+    interval=Config.PROFILER_SAMPLE_INTERVAL_MS / 1000,
+    min_interval=Config.PROFILER_MIN_INTERVAL_SECONDS,
+    max_profiles=Config.PROFILER_MAX_PROFILES,
+)
+
+
+class ProfilerMiddleware:
+    """
+    Profiles a single request when it carries the ``X-Profile-Request`` header with the configured
+    token, or when an admin armed the profiler for the matching path.
+    The id of the captured profile is returned in the ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: RequestProfiler = request_profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.profiler.wants(scope) or not self.profiler.acquire():
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(
+            profile_id=uuid.uuid4().hex,
+            method=scope["method"],
+            path=scope["path"],
+            started_at=time.time(),
+            interval=self.profiler.interval,
+        )
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(itertools.chain(
+                    message.get("headers", []), [(b"x-profile-id", profile.profile_id.encode())]
+                ))
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), self.profiler.interval)
+        before_time = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.samples = sampler.stop()
+            profile.duration = time.perf_counter() - before_time
+            self.profiler.release(profile)
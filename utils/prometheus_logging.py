@@ -1,5 +1,8 @@
+import asyncio
+import random
 import time
-from typing import Tuple
+import tracemalloc
+from typing import Mapping, Tuple
 
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import \
@@ -8,7 +11,6 @@ from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from prometheus_client import REGISTRY, Counter, Gauge, Histogram
 from prometheus_client.openmetrics.exposition import (CONTENT_TYPE_LATEST,
                                                       generate_latest)
@@ -20,6 +22,10 @@ from starlette.routing import Match
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 from starlette.types import ASGIApp
 
+from utils.request_accounting import ResourceUsage, install_task_factory, metered
+from utils.tracing import (CountingBatchSpanProcessor,
+                           TailSamplingSpanProcessor, make_sampler)
+
 INFO = Gauge(
     "fastapi_app_info", "FastAPI application information.", [
         "app_name"]
@@ -38,6 +44,20 @@ REQUESTS_PROCESSING_TIME = Histogram(
     "Histogram of requests processing time by path (in seconds)",
     ["method", "path", "app_name"],
 )
+REQUESTS_CPU_TIME = Histogram(
+    "fastapi_requests_cpu_seconds",
+    "Histogram of CPU time of sampled requests by path, their own task steps and accounted threadpool calls "
+    "(in seconds)",
+    ["method", "path", "app_name"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5),
+)
+REQUESTS_ALLOCATED_BYTES = Histogram(
+    "fastapi_requests_allocated_bytes",
+    "Histogram of a lower bound of the memory allocated by sampled requests by path: the peak traced memory "
+    "growth of each of their task steps, summed (in bytes)",
+    ["method", "path", "app_name"],
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
 EXCEPTIONS = Counter(
     "fastapi_exceptions_total",
     "Total count of exceptions raised by path and exception type",
@@ -48,12 +68,117 @@ REQUESTS_IN_PROGRESS = Gauge(
     "Gauge of requests by method and path currently being processed",
     ["method", "path", "app_name"],
 )
+REQUESTS_SHED = Counter(
+    "fastapi_requests_shed_total",
+    "Total count of requests rejected or cancelled by load shedding by route group and reason",
+    ["route_group", "reason", "app_name"],
+)
+REQUESTS_WAITING = Gauge(
+    "fastapi_requests_waiting",
+    "Gauge of requests waiting for a concurrency slot by route group",
+    ["route_group", "app_name"],
+)
+DB_POOL_ACQUIRE_TIME = Histogram(
+    "fastapi_db_pool_acquire_seconds",
+    "Histogram of time spent acquiring a database connection from the pool (in seconds)",
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0),
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    "fastapi_response_cache_requests_total",
+    "Total count of response cache lookups by result (hit, miss, coalesced)",
+    ["result"],
+)
+RESPONSE_CACHE_BYTES = Gauge(
+    "fastapi_response_cache_bytes",
+    "Gauge of serialized response bytes held by the response cache",
+)
+DATALOADER_BATCH_SIZE = Histogram(
+    "fastapi_dataloader_batch_size",
+    "Histogram of keys resolved per batched repository lookup by loader",
+    ["loader"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+INVALIDATION_MESSAGES = Counter(
+    "fastapi_cache_invalidation_messages_total",
+    "Total count of cache invalidation messages by direction (sent, received)",
+    ["direction"],
+)
+INVALIDATION_LAG = Histogram(
+    "fastapi_cache_invalidation_lag_seconds",
+    "Histogram of the delay between publishing a cache invalidation and receiving it on another worker",
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0),
+)
+INVALIDATION_FLUSHES = Counter(
+    "fastapi_cache_invalidation_flushes_total",
+    "Total count of full cache flushes after the invalidation bus reconnected",
+)
+IDEMPOTENCY_REQUESTS = Counter(
+    "fastapi_idempotency_requests_total",
+    "Total count of requests carrying an Idempotency-Key by outcome (executed, replayed, coalesced, conflict, mismatch)",
+    ["result"],
+)
+
+AVAILABILITY_CHECKS = Counter(
+    "fastapi_availability_checks_total",
+    "Total count of username and email availability checks by field and result "
+    "(free, taken, false_positive, unfiltered), false_positive / (free + false_positive) is the observed rate",
+    ["field", "result"],
+)
+AVAILABILITY_FILTER_BYTES = Gauge(
+    "fastapi_availability_filter_bytes",
+    "Gauge of memory held by the bit array of the username and email availability filter",
+)
+AVAILABILITY_FILTER_ENTRIES = Gauge(
+    "fastapi_availability_filter_entries",
+    "Gauge of usernames and emails added to the availability filter",
+)
+AVAILABILITY_FILTER_FALSE_POSITIVE_RATE = Gauge(
+    "fastapi_availability_filter_false_positive_rate",
+    "Gauge of the expected false positive rate of the availability filter for its current entries",
+)
+
+REFRESH_TOKEN_REFRESHES = Counter(
+    "fastapi_refresh_token_refreshes_total",
+    "Total count of refresh token exchanges by result (rotated, reused, invalid)",
+    ["result"],
+)
+TOKEN_EPOCH_LOOKUPS = Counter(
+    "fastapi_token_epoch_lookups_total",
+    "Total count of access token epoch checks by result (hit, miss), a miss reads the epoch from the database",
+    ["result"],
+)
+LOGIN_ATTEMPTS = Counter(
+    "fastapi_login_attempts_total",
+    "Total count of password attempts by admission result (admitted, account_limited, address_limited)",
+    ["result"],
+)
+PASSWORD_HASHES_SHED = Counter(
+    "fastapi_password_hashes_shed_total",
+    "Total count of password hashes refused because too many were running or waiting, by reason",
+    ["reason"],
+)
 
 
 class PrometheusMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp, app_name: str = "fastapi-app") -> None:
+    def __init__(
+            self,
+            app: ASGIApp,
+            app_name: str = "fastapi-app",
+            cpu_sample_rate: float = 0.0,
+            trace_allocations: bool = False
+    ) -> None:
+        """
+        :param cpu_sample_rate: share of requests (0..1) whose CPU time is accounted, see `utils.request_accounting`.
+            Only the steps of the sampled request's own tasks are counted, not those of requests interleaved with it.
+        :param trace_allocations: additionally record the memory allocated by sampled requests.
+            Starts tracemalloc for the whole process, which slows down every allocation.
+        """
         super().__init__(app)
         self.app_name = app_name
+        self.cpu_sample_rate = cpu_sample_rate
+        self.trace_allocations = trace_allocations
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
         INFO.labels(app_name=self.app_name).inc()
 
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
@@ -66,9 +191,16 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
         REQUESTS_IN_PROGRESS.labels(
             method=method, path=path, app_name=self.app_name).inc()
         REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
+        usage = None
+        if self.cpu_sample_rate > 0 and random.random() < self.cpu_sample_rate:
+            install_task_factory(asyncio.get_running_loop())
+            usage = ResourceUsage(self.trace_allocations)
         before_time = time.perf_counter()
         try:
-            response = await call_next(request)
+            if usage is not None:
+                response = await metered(call_next(request), usage)
+            else:
+                response = await call_next(request)
         except BaseException as e:
             status_code = HTTP_500_INTERNAL_SERVER_ERROR
             EXCEPTIONS.labels(method=method, path=path, exception_type=type(
@@ -85,6 +217,12 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             REQUESTS_PROCESSING_TIME.labels(method=method, path=path, app_name=self.app_name).observe(
                 after_time - before_time, exemplar={'TraceID': trace_id}
             )
+            if usage is not None:
+                REQUESTS_CPU_TIME.labels(method=method, path=path, app_name=self.app_name).observe(usage.cpu_seconds)
+                if usage.trace_allocations:
+                    REQUESTS_ALLOCATED_BYTES.labels(method=method, path=path, app_name=self.app_name).observe(
+                        usage.allocated_bytes
+                    )
         finally:
             RESPONSES.labels(method=method, path=path,
                              status_code=status_code, app_name=self.app_name).inc()
@@ -107,7 +245,20 @@ def metrics(request: Request) -> Response:
     return Response(generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
 
 
-def setting_otlp(app: ASGIApp, app_name: str, endpoint: str, log_correlation: bool = True) -> None:
+def setting_otlp(
+        app: ASGIApp,
+        app_name: str,
+        endpoint: str,
+        log_correlation: bool = True,
+        sample_rate: float = 1.0,
+        route_sample_rates: Mapping[str, float] | None = None,
+        tail_sampling: bool = True,
+        slow_request_ms: int = 1000,
+        max_buffered_spans: int = 10000,
+        max_queue_size: int = 2048,
+        max_export_batch_size: int = 512,
+        schedule_delay_ms: int = 5000,
+) -> None:
     # Setting OpenTelemetry
     # set the service name to show in traces
     resource = Resource.create(attributes={
@@ -115,11 +266,20 @@ def setting_otlp(app: ASGIApp, app_name: str, endpoint: str, log_correlation: bo
     })
 
     # set the tracer provider
-    tracer = TracerProvider(resource=resource)
+    # traces losing the head decision are recorded but exported only if they fail or are slow
+    tracer = TracerProvider(
+        resource=resource,
+        sampler=make_sampler(sample_rate, route_sample_rates or {}, record_unsampled=tail_sampling)
+    )
     trace.set_tracer_provider(tracer)
 
-    tracer.add_span_processor(BatchSpanProcessor(
-        OTLPSpanExporter(endpoint=endpoint, insecure=True)))
+    exporter = CountingBatchSpanProcessor(
+        OTLPSpanExporter(endpoint=endpoint, insecure=True),
+        max_queue_size=max_queue_size,
+        max_export_batch_size=max_export_batch_size,
+        schedule_delay_millis=schedule_delay_ms,
+    )
+    tracer.add_span_processor(TailSamplingSpanProcessor(exporter, slow_request_ms, max_buffered_spans))
 
     if log_correlation:
         LoggingInstrumentor().instrument(set_logging_format=True)
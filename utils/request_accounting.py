@@ -0,0 +1,140 @@
+"""
+CPU time and allocations of a single request, while other requests run on the same event loop.
+
+A request runs as steps of its tasks, the task of the middleware and every task started under it,
+interleaved with steps of other requests. Each step of a metered task is timed on its own: thread
+CPU time and, with tracemalloc on, the peak traced memory above the step's start. Tasks inherit
+the request's `ResourceUsage` through a context variable, and a task factory installed on the loop
+meters every task started while it is set.
+
+Threadpool work runs outside the steps; wrap it with `accounted` to add the worker thread's CPU
+time. FastAPI runs sync dependencies and handlers in the threadpool without it, the app has none
+doing real work.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Coroutine, Generator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ResourceUsage:
+    def __init__(self, trace_allocations: bool = False) -> None:
+        self.cpu_seconds = 0.0
+        # lower bound of the bytes allocated: the sum of every step's peak memory growth
+        self.allocated_bytes = 0
+        self.trace_allocations = trace_allocations and tracemalloc.is_tracing()
+        # threadpool calls add from their own threads
+        self._lock = threading.Lock()
+
+    def add(self, cpu_seconds: float, allocated_bytes: int = 0) -> None:
+        with self._lock:
+            self.cpu_seconds += cpu_seconds
+            self.allocated_bytes += allocated_bytes
+
+
+_usage: contextvars.ContextVar[Optional[ResourceUsage]] = contextvars.ContextVar("request_usage", default=None)
+
+
+class _Metered:
+    """Drives a coroutine step by step and adds the cost of each step to `usage`."""
+
+    __slots__ = ("coro", "usage")
+
+    def __init__(self, coro: Coroutine, usage: ResourceUsage) -> None:
+        self.coro = coro
+        self.usage = usage
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        coro, usage = self.coro, self.usage
+        value, error = None, None
+        while True:
+            started_memory = 0
+            if usage.trace_allocations:
+                started_memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            started_cpu = time.thread_time()
+            try:
+                yielded = coro.send(value) if error is None else coro.throw(error)
+            except BaseException as e:
+                self.step_finished(started_cpu, started_memory)
+                if isinstance(e, StopIteration):
+                    return e.value
+                raise
+            self.step_finished(started_cpu, started_memory)
+
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+    def step_finished(self, started_cpu: float, started_memory: int) -> None:
+        cpu_seconds = time.thread_time() - started_cpu
+        allocated = 0
+        if self.usage.trace_allocations:
+            allocated = max(tracemalloc.get_traced_memory()[1] - started_memory, 0)
+        self.usage.add(cpu_seconds, allocated)
+
+
+async def metered(coro: Coroutine[Any, Any, T], usage: ResourceUsage) -> T:
+    """
+    Runs `coro` with `usage` as the current request's usage: its own steps and those of every task
+    it starts are added to it.
+    """
+    token = _usage.set(usage)
+    try:
+        return await _Metered(coro, usage)
+    finally:
+        _usage.reset(token)
+
+
+def accounted(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Adds the CPU time of `func` to the current request's usage, for functions run in the threadpool,
+    which copies the context into the worker thread.
+    """
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        usage = _usage.get()
+        if usage is None:
+            return func(*args, **kwargs)
+        started = time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            usage.add(time.thread_time() - started)
+    return wrapper
+
+
+def install_task_factory(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Meters the tasks started while a request is metered, on top of the loop's current task factory.
+    Tasks of requests that are not metered are created as before.
+    """
+    previous = loop.get_task_factory()
+    if getattr(previous, "meters_requests", False):
+        return
+
+    def task_factory(loop: asyncio.AbstractEventLoop, coro: Coroutine, **kwargs: Any) -> "asyncio.Future[Any]":
+        context = kwargs.get("context")
+        usage = context.get(_usage) if context is not None else _usage.get()
+        if usage is not None:
+            coro = _run_metered(coro, usage)
+        if previous is not None:
+            return previous(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    task_factory.meters_requests = True
+    loop.set_task_factory(task_factory)
+
+
+async def _run_metered(coro: Awaitable[T], usage: ResourceUsage) -> T:
+    # the task already runs in a copy of the context that holds `usage`
+    return await _Metered(coro, usage)
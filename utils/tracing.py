@@ -0,0 +1,214 @@
+import collections
+import threading
+from typing import Dict, List, Mapping, Optional, OrderedDict, Sequence
+
+from opentelemetry.context import Context
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import (ALWAYS_OFF, Decision, ParentBased,
+                                              Sampler, SamplingResult,
+                                              TraceIdRatioBased)
+from opentelemetry.trace import Link, SpanContext, SpanKind, TraceFlags
+from opentelemetry.trace.status import StatusCode
+from opentelemetry.util.types import Attributes
+from prometheus_client import Counter
+
+TRACE_SPANS_DROPPED = Counter(
+    "fastapi_trace_spans_dropped_total",
+    "Total count of finished spans that were not exported by reason",
+    ["reason"],
+)
+TRACE_SPANS_KEPT = Counter(
+    "fastapi_trace_spans_kept_total",
+    "Total count of spans exported from unsampled traces by the always-keep rule",
+    ["rule"],
+)
+TRACE_EXPORT_QUEUE_FULL = Counter(
+    "fastapi_trace_export_queue_full_total",
+    "Total count of spans pushed into a full exporter queue, evicting the oldest queued span",
+)
+
+
+class RouteRatioSampler(Sampler):
+    """
+    Head sampler with a per-route sampling rate.
+
+    Routes are matched by the longest path prefix of the span name ("GET /profile/my-recipes").
+    Traces that lose the head decision are still recorded when `record_unsampled` is set,
+    so that a tail processor can keep them if they turn out to be slow or failing.
+    """
+
+    def __init__(self, default_rate: float, route_rates: Mapping[str, float], record_unsampled: bool = True) -> None:
+        self._default = TraceIdRatioBased(default_rate)
+        self._routes = sorted(
+            ((prefix, TraceIdRatioBased(rate)) for prefix, rate in route_rates.items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._record_unsampled = record_unsampled
+
+    def _sampler_for(self, name: str) -> TraceIdRatioBased:
+        path = name.split(" ", 1)[-1]
+        for prefix, sampler in self._routes:
+            if path.startswith(prefix):
+                return sampler
+        return self._default
+
+    def should_sample(
+            self,
+            parent_context: Optional[Context],
+            trace_id: int,
+            name: str,
+            kind: Optional[SpanKind] = None,
+            attributes: Attributes = None,
+            links: Optional[Sequence[Link]] = None,
+            trace_state=None,
+    ) -> SamplingResult:
+        result = self._sampler_for(name).should_sample(
+            parent_context, trace_id, name, kind, attributes, links, trace_state
+        )
+        if result.decision is Decision.DROP and self._record_unsampled:
+            return SamplingResult(Decision.RECORD_ONLY, attributes, result.trace_state)
+        return result
+
+    def get_description(self) -> str:
+        return f"RouteRatioSampler{{default={self._default.rate}, routes={len(self._routes)}}}"
+
+
+class _RecordOnlySampler(Sampler):
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None,
+                      trace_state=None) -> SamplingResult:
+        return SamplingResult(Decision.RECORD_ONLY, attributes)
+
+    def get_description(self) -> str:
+        return "RecordOnlySampler"
+
+
+def make_sampler(default_rate: float, route_rates: Mapping[str, float], record_unsampled: bool = True) -> Sampler:
+    """
+    Parent-based sampler: root spans get the per-route head decision, local children of
+    recorded-only spans stay recorded so the whole trace can still be kept by the tail processor.
+    """
+    return ParentBased(
+        root=RouteRatioSampler(default_rate, route_rates, record_unsampled),
+        local_parent_not_sampled=_RecordOnlySampler() if record_unsampled else ALWAYS_OFF,
+    )
+
+
+class CountingBatchSpanProcessor(BatchSpanProcessor):
+    """BatchSpanProcessor that counts spans arriving at a full queue, which the SDK only logs."""
+
+    def on_end(self, span: ReadableSpan) -> None:
+        if span.context.trace_flags.sampled:
+            # relies on the SDK internals: the batch queue is a bounded deque that evicts the oldest span
+            queue = getattr(getattr(self, "_batch_processor", None), "_queue", None)
+            if queue is not None and queue.maxlen is not None and len(queue) >= queue.maxlen:
+                TRACE_EXPORT_QUEUE_FULL.inc()
+        super().on_end(span)
+
+
+def _as_sampled(span: ReadableSpan) -> ReadableSpan:
+    context = span.context
+    return ReadableSpan(
+        name=span.name,
+        context=SpanContext(
+            context.trace_id,
+            context.span_id,
+            context.is_remote,
+            TraceFlags(context.trace_flags | TraceFlags.SAMPLED),
+            context.trace_state,
+        ),
+        parent=span.parent,
+        resource=span.resource,
+        attributes=span.attributes,
+        events=span.events,
+        links=span.links,
+        kind=span.kind,
+        status=span.status,
+        start_time=span.start_time,
+        end_time=span.end_time,
+        instrumentation_scope=span.instrumentation_scope,
+    )
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Buffers spans of traces that lost the head sampling decision until their local root span ends,
+    then exports the whole trace if it failed or was slower than `slow_threshold_ms`.
+    Head-sampled spans are passed to the delegate right away.
+    """
+
+    def __init__(self, delegate: SpanProcessor, slow_threshold_ms: int, max_buffered_spans: int) -> None:
+        self._delegate = delegate
+        self._slow_threshold_ns = slow_threshold_ms * 1_000_000
+        self._max_buffered_spans = max_buffered_spans
+        self._buffer: OrderedDict[int, List[ReadableSpan]] = collections.OrderedDict()
+        self._buffered_spans = 0
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context: Optional[Context] = None) -> None:
+        self._delegate.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        if span.context.trace_flags.sampled:
+            self._delegate.on_end(span)
+            return
+
+        trace_id = span.context.trace_id
+        is_local_root = span.parent is None or span.parent.is_remote
+        with self._lock:
+            if not is_local_root:
+                self._buffer_span(trace_id, span)
+                return
+            spans = self._buffer.pop(trace_id, [])
+            self._buffered_spans -= len(spans)
+        spans.append(span)
+
+        rule = self._keep_rule(span, spans)
+        if rule is None:
+            TRACE_SPANS_DROPPED.labels(reason="sampled_out").inc(len(spans))
+            return
+        TRACE_SPANS_KEPT.labels(rule=rule).inc(len(spans))
+        for buffered in spans:
+            self._delegate.on_end(_as_sampled(buffered))
+
+    def _buffer_span(self, trace_id: int, span: ReadableSpan) -> None:
+        while self._buffered_spans >= self._max_buffered_spans and self._buffer:
+            _, evicted = self._buffer.popitem(last=False)
+            self._buffered_spans -= len(evicted)
+            TRACE_SPANS_DROPPED.labels(reason="buffer_full").inc(len(evicted))
+        self._buffer.setdefault(trace_id, []).append(span)
+        self._buffered_spans += 1
+
+    def _keep_rule(self, root: ReadableSpan, spans: List[ReadableSpan]) -> Optional[str]:
+        if any(s.status.status_code is StatusCode.ERROR for s in spans):
+            return "error"
+        if root.end_time - root.start_time >= self._slow_threshold_ns:
+            return "slow"
+        return None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._buffer.clear()
+            self._buffered_spans = 0
+        self._delegate.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self._delegate.force_flush(timeout_millis)
+
+
+def sentry_traces_sampler(default_rate: float, route_rates: Mapping[str, float]):
+    """Builds a Sentry `traces_sampler` applying the same per-route rates as the OTLP sampler."""
+    routes: Dict[str, float] = dict(sorted(route_rates.items(), key=lambda item: len(item[0]), reverse=True))
+
+    def traces_sampler(sampling_context: dict) -> float:
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            return float(parent_sampled)
+        path = sampling_context.get("asgi_scope", {}).get("path", "")
+        for prefix, rate in routes.items():
+            if path.startswith(prefix):
+                return rate
+        return default_rate
+
+    return traces_sampler